@@ -0,0 +1,5 @@
+@echo off
+
+python vfs_emulator.py --headless --vfs_path complex_vfs.xml --batch test_basic.txt test_advanced.txt test_errors.txt test_write.txt test_snapshot.txt test_search.txt test_grep.txt test_mount.txt test_verify.txt test_diff.txt --output test_output
+
+pause
\ No newline at end of file
@@ -0,0 +1,287 @@
+"""бенчмарк vfs: синтетические xml образы, замеры загрузки и команд (операций в секунду, задержки, память)
+
+запуск:
+  python vfs_benchmark.py [--breadth 4] [--depth 3] [--files 20] [--content_size 256] [--base64_ratio 0.2]
+                          [--ops 2000] [--replays 5] [--modes xml,streaming,lazy,mmap] [--xml образ.xml]
+                          [--seed 1] [--json результат.json] [--no_memory]
+"""
+import base64
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from vfs_emulator import VFS, VFSShell, compile_image
+
+try:
+    import resource  #максимальный rss процесса (только unix)
+except ImportError:
+    resource = None
+
+LOAD_MODES = ("xml", "streaming", "lazy", "mmap")  #способы загрузки образа
+PERCENTILES = (50, 90, 99)  #процентили задержки в отчете
+SCRIPT_COMMANDS = 200  #строк в синтетическом скрипте для прогона
+
+
+class _NullOutput:
+    """поток вывода, который ничего не сохраняет (вывод команд в замер не входит)"""
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def generate_xml(path, breadth=4, depth=3, files=20, content_size=256, base64_ratio=0.2, seed=1):
+    """генерация образа: breadth поддиректорий на уровень, depth уровней, files файлов в каждой директории;
+    возвращает (пути файлов, пути директорий)"""
+    rng = random.Random(seed)  #одинаковый образ при одинаковых параметрах
+    file_paths, dir_paths = [], ["/"]  #созданные пути
+    line = "lorem ipsum dolor sit amet, consectetur adipiscing elit\n"  #строка текстового содержимого
+    text = (line * (content_size // len(line) + 1))[:content_size]  #текст нужного размера
+
+    def write_files(f, dir_path, indent):  #файлы одной директории
+        for i in range(files):
+            name = f"file{i}.txt"
+            file_path = ('' if dir_path == '/' else dir_path) + '/' + name
+            if rng.random() < base64_ratio:  #двоичный файл в base64
+                data = base64.b64encode(rng.randbytes(content_size)).decode('ascii')
+                f.write(f'{indent}<file name="{name}" encoding="base64">{data}</file>\n')
+            else:  #текстовый файл
+                f.write(f'{indent}<file name="{name}">{text}</file>\n')
+            file_paths.append(file_path)
+
+    with open(path, 'w', encoding='utf-8') as f:  #образ пишется потоково, без дерева в памяти
+        f.write('<vfs name="benchmark">\n')
+        write_files(f, "/", "    ")
+        stack = [("/", 1, iter(range(breadth)))]  #(путь, уровень, номера поддиректорий)
+        while stack:
+            dir_path, level, numbers = stack[-1]
+            number = next(numbers, None)  #очередная поддиректория
+            if number is None:  #директория записана
+                stack.pop()
+                if stack:
+                    f.write("    " * level + "</directory>\n")
+                continue
+            name = f"dir{number}"
+            child_path = ('' if dir_path == '/' else dir_path) + '/' + name
+            indent = "    " * (level + 1)
+            f.write("    " * level + f'<directory name="{name}">\n')
+            dir_paths.append(child_path)
+            write_files(f, child_path, indent)
+            stack.append((child_path, level + 1, iter(range(breadth if level < depth else 0))))
+        f.write('</vfs>\n')
+    return file_paths, dir_paths
+
+
+def percentile(sorted_values, p):
+    """процентиль по отсортированным значениям (ближайший ранг)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(name, latencies, ops_per_call=1):
+    """сводка замера: операций в секунду и процентили задержки в микросекундах"""
+    latencies = sorted(latencies)
+    total = sum(latencies)  #суммарное время
+    ops = len(latencies) * ops_per_call  #число операций
+    result = {"name": name, "ops": ops, "seconds": total,
+              "ops_per_sec": ops / total if total else 0.0}
+    for p in PERCENTILES:
+        result[f"p{p}_us"] = percentile(latencies, p) * 1e6
+    result["max_us"] = (latencies[-1] if latencies else 0.0) * 1e6
+    return result
+
+
+def measure(name, func, calls):
+    """задержка каждого вызова func(*args) для списка аргументов calls"""
+    latencies = []
+    clock = time.perf_counter
+    for args in calls:
+        start = clock()
+        func(*args)
+        latencies.append(clock() - start)
+    return summarize(name, latencies)
+
+
+def measure_load(path, mode, memory=True):
+    """время загрузки образа и пиковая память python (tracemalloc) во время загрузки"""
+    kwargs = {"xml": {"streaming": False, "lazy": False}, "streaming": {"streaming": True, "lazy": False},
+              "lazy": {"lazy": True}}.get(mode)
+
+    def load():  #одна загрузка в новую vfs
+        vfs = VFS()
+        success, message = vfs.load(path) if kwargs is None else vfs.load_from_xml(path, **kwargs)
+        if not success:
+            raise RuntimeError(message)
+        return vfs
+
+    gc.collect()
+    start = time.perf_counter()
+    vfs = load()  #замер времени без накладных расходов tracemalloc
+    result = summarize(f"load ({mode})", [time.perf_counter() - start])
+    if memory:  #отдельная загрузка для пиковой памяти
+        del vfs
+        gc.collect()
+        tracemalloc.start()
+        vfs = load()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["retained_mb"] = current / 1e6  #память, которую vfs занимает после загрузки
+        result["peak_mb"] = peak / 1e6  #пик во время загрузки
+    return vfs, result
+
+
+def write_script(path, file_paths, dir_paths, rng):
+    """синтетический скрипт только из читающих команд (прогон можно повторять на той же vfs)"""
+    commands = []
+    for _ in range(SCRIPT_COMMANDS):
+        kind = rng.randrange(4)
+        if kind == 0:
+            commands.append(f"cd {rng.choice(dir_paths)}")
+        elif kind == 1:
+            commands.append(f"ls {rng.choice(dir_paths)}")
+        elif kind == 2:
+            commands.append(f"head -n 3 {rng.choice(file_paths)}")
+        else:
+            commands.append(f"cat {rng.choice(file_paths)}")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(commands) + "\n")
+    return len(commands)
+
+
+def run_operations(vfs, file_paths, dir_paths, ops, replays, script_path, rng):
+    """замеры операций над загруженной vfs"""
+    results = []
+    dirs = [(rng.choice(dir_paths),) for _ in range(ops)]
+    probes = [(path if rng.random() < 0.5 else path + "_missing",) for (path,) in dirs]  #половина промахов
+    files = [(rng.choice(file_paths),) for _ in range(ops)]
+    results.append(measure("list_directory", vfs.list_directory, dirs))
+    results.append(measure("directory_exists", vfs.directory_exists, probes))
+    results.append(measure("read_file", vfs.read_file, files))
+    results.append(measure("get_file_head", vfs.get_file_head, [(path, 5) for (path,) in files]))
+
+    vfs.snapshot_save("benchmark")  #изменения ниже откатываются после замеров
+    modes = ("600", "644", "700", "755")
+    targets = [(path, rng.choice(modes)) for (path,) in files]
+    results.append(measure("chmod", vfs.chmod, targets))
+    empty = [f"{rng.choice(dir_paths).rstrip('/')}/bench_empty{i}" for i in range(ops)]  #пустые директории для rmdir
+    empty = [path for path in dict.fromkeys(empty) if vfs.mkdir(path)[0]]
+    results.append(measure("rmdir", vfs.rmdir, [(path,) for path in reversed(empty)]))
+    vfs.snapshot_restore("benchmark")
+    vfs.snapshot_drop("benchmark")
+
+    lines = write_script(script_path, file_paths, dir_paths, rng)
+    latencies = []
+    for _ in range(replays):  #полный безоконный прогон скрипта
+        shell = VFSShell(vfs, script_path, _NullOutput())
+        start = time.perf_counter()
+        shell.start_emulator()
+        latencies.append(time.perf_counter() - start)
+    result = summarize("script replay", latencies, ops_per_call=lines)  #операции - строки скрипта
+    result["commands"] = lines
+    results.append(result)
+    return results
+
+
+def format_report(shape, results):
+    """текстовый отчет"""
+    lines = [f"образ: {shape}"]
+    header = f"{'замер':<30}{'операций':>10}{'оп/с':>14}" + "".join(f"{'p%d мкс' % p:>12}" for p in PERCENTILES)
+    lines.append(header + f"{'пик МБ':>10}{'vfs МБ':>10}")
+    for r in results:
+        row = f"{r['name']:<30}{r['ops']:>10}{r['ops_per_sec']:>14.1f}"
+        row += "".join(f"{r[f'p{p}_us']:>12.1f}" for p in PERCENTILES)
+        row += f"{r['peak_mb']:>10.1f}{r['retained_mb']:>10.1f}" if "peak_mb" in r else ""
+        lines.append(row)
+    if resource is not None:  #максимальный rss всего процесса
+        lines.append(f"максимальный rss процесса: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+    return "\n".join(lines)
+
+
+def run_benchmark(xml_path=None, modes=LOAD_MODES, ops=2000, replays=5, memory=True, seed=1, **shape):
+    """полный прогон: генерация (если образ не задан), загрузка каждым способом и замеры операций"""
+    workdir = tempfile.mkdtemp(prefix="vfs_benchmark_")  #временные образы и скрипт
+    rng = random.Random(seed)
+    try:
+        if xml_path is None:  #синтетический образ
+            xml_path = os.path.join(workdir, "benchmark.xml")
+            start = time.perf_counter()
+            file_paths, dir_paths = generate_xml(xml_path, seed=seed, **shape)
+            shape["generate_seconds"] = round(time.perf_counter() - start, 3)
+        else:  #готовый образ - пути берутся из него
+            probe = VFS()
+            success, message = probe.load(xml_path)
+            if not success:
+                raise RuntimeError(message)
+            file_paths, dir_paths = list(probe.files), list(probe.directories)
+            del probe
+        shape.update(files_total=len(file_paths), dirs_total=len(dir_paths),
+                     xml_mb=round(os.path.getsize(xml_path) / 1e6, 2))
+
+        results = []
+        for mode in modes:
+            path = xml_path
+            if mode == "mmap":  #бинарный образ компилируется заранее (в замер не входит)
+                path = os.path.join(workdir, "benchmark.img")
+                success, message = compile_image(xml_path, path)
+                if not success:
+                    raise RuntimeError(message)
+            vfs, load_result = measure_load(path, mode, memory)
+            results.append(load_result)
+            for result in run_operations(vfs, file_paths, dir_paths, ops, replays,
+                                         os.path.join(workdir, "script.txt"), random.Random(rng.random())):
+                result["name"] = f"{result['name']} ({mode})"
+                results.append(result)
+            del vfs
+            gc.collect()
+        return shape, results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)  #временные файлы (вместе с файлами-спутниками хеша)
+
+
+def main():
+    shape = {"breadth": 4, "depth": 3, "files": 20, "content_size": 256, "base64_ratio": 0.2}  #форма образа
+    options = {"ops": 2000, "replays": 5, "seed": 1}  #параметры замеров
+    modes, xml_path, json_path, memory = LOAD_MODES, None, None, True
+
+    i = 1  #начальный индекс аргументов
+    while i < len(sys.argv):  #обработка аргументов командной строки
+        name = sys.argv[i][2:] if sys.argv[i].startswith("--") else None  #имя параметра без --
+        value = sys.argv[i + 1] if i + 1 < len(sys.argv) else None  #значение параметра
+        if name == "no_memory":  #без замера памяти (быстрее)
+            memory = False
+            i += 1
+            continue
+        if value is None:  #параметр без значения
+            i += 1
+            continue
+        if name in shape:  #форма образа
+            shape[name] = float(value) if name == "base64_ratio" else int(value)
+        elif name in options:  #параметры замеров
+            options[name] = int(value)
+        elif name == "modes":  #способы загрузки через запятую
+            modes = tuple(mode for mode in value.split(",") if mode in LOAD_MODES)
+        elif name == "xml":  #готовый образ вместо синтетического
+            xml_path = value
+        elif name == "json":  #файл для результатов в json (для отслеживания регрессий)
+            json_path = value
+        i += 2  #переход через два аргумента
+
+    shape, results = run_benchmark(xml_path, modes, memory=memory, **options, **shape)
+    print(format_report(shape, results))
+    if json_path:  #машиночитаемые результаты
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({"shape": shape, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
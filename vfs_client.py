@@ -0,0 +1,95 @@
+"""клиент сервера vfs (python vfs_emulator.py --vfs_path образ.xml --serve адрес) для скриптов и тестов
+
+запуск:
+  python vfs_client.py 127.0.0.1:7070 "ls /" "cd /home" "cat readme.txt"
+  python vfs_client.py /tmp/vfs.sock < команды.txt
+
+команды отправляются сразу все, не дожидаясь ответов; ответы выводятся по порядку по мере получения
+"""
+import socket
+import sys
+import threading
+
+from vfs_emulator import parse_address
+
+
+class VFSClient:
+    """подключение к серверу vfs: у каждого подключения своя текущая директория"""
+
+    def __init__(self, address, timeout=None):
+        host, port = parse_address(address)  #tcp адрес или путь к unix сокету
+        if port is None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(host)
+        else:
+            self.sock = socket.create_connection((host, port), timeout)
+        self.reader = self.sock.makefile('rb')  #буферизованное чтение блоков ответа
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """закрытие подключения"""
+        self.reader.close()
+        self.sock.close()
+
+    def send(self, command):
+        """отправка одной команды без ожидания ответа"""
+        self.sock.sendall(command.replace('\n', ' ').encode('utf-8') + b"\n")
+
+    def send_all(self, commands):
+        """отправка команд в отдельном потоке: сервер и клиент не блокируют друг друга на полных буферах"""
+        thread = threading.Thread(target=lambda: [self.send(command) for command in commands], daemon=True)
+        thread.start()
+        return thread
+
+    def iter_response(self):
+        """блоки ответа на очередную команду по мере получения (большие файлы приходят частями)"""
+        while True:
+            header = self.reader.readline()  #длина блока
+            if not header:  #сервер закрыл соединение
+                raise ConnectionError("соединение закрыто сервером")
+            size = int(header)
+            if size == 0:  #конец ответа
+                return
+            yield self.reader.read(size).decode('utf-8')
+
+    def execute(self, command):
+        """выполнение команды и ее вывод целиком"""
+        self.send(command)
+        return ''.join(self.iter_response())
+
+    def pipeline(self, commands):
+        """выполнение набора команд без ожидания ответа на каждую; список выводов по порядку"""
+        commands = list(commands)
+        self.send_all(commands)
+        return [''.join(self.iter_response()) for _ in commands]
+
+
+def main():
+    if len(sys.argv) < 2:  #адрес обязателен
+        print(__doc__)
+        sys.exit(1)
+    commands = sys.argv[2:] or [line.rstrip('\n') for line in sys.stdin]  #команды из аргументов или stdin
+    commands = [command for command in commands if command.strip()]  #пустые строки не отправляются
+
+    try:
+        with VFSClient(sys.argv[1]) as client:
+            client.send_all(commands)
+            for command in commands:  #ответы в порядке команд
+                sys.stdout.write(f"vfs> {command}\n")
+                for chunk in client.iter_response():  #вывод по мере получения
+                    sys.stdout.write(chunk)
+                if command.split()[0].lower() == "exit":  #сервер закрывает подключение
+                    break
+    except OSError as e:  #включая разрыв соединения
+        print(f"ошибка подключения: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
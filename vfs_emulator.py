@@ -1,117 +1,933 @@
-import tkinter as tk
-from tkinter.scrolledtext import ScrolledText
 import os
 import sys
+import asyncio
 import hashlib
 import xml.etree.ElementTree as ET
+import xml.parsers.expat
 import base64
+import codecs
+import cProfile
+from array import array
+import fnmatch
+import functools
+import itertools
+import io
+import json
+import mmap
+import multiprocessing
+import pstats
+import re
+import stat
+import struct
+import time
+import tracemalloc
+from xml.sax.saxutils import escape, quoteattr
+from collections import OrderedDict, deque
+from collections.abc import Mapping, Set
+
+
+STREAMING_THRESHOLD = 64 * 1024 * 1024  #размер образа, начиная с которого загрузка идет потоково
+HASH_CHUNK_SIZE = 1024 * 1024  #размер блока чтения при хешировании
+HASH_CACHE_SUFFIX = ".vfscache"  #суффикс файла-спутника с закэшированным хешем mmap образа (xml хешируется при разборе)
+MERKLE_CACHE_SUFFIX = ".vfsmerkle"  #суффикс файла-спутника с хешами всех узлов дерева меркла
+PATH_CACHE_SIZE = 4096  #размер lru кэша нормализованных путей
+GREP_NGRAM = 3  #длина n-грамм индекса поиска по содержимому
+LINE_INDEX_CACHE_SIZE = 32  #сколько индексов смещений строк хранится одновременно
+BINARY_SNIFF_SIZE = 8192  #сколько байт из начала файла проверяется на двоичные данные
+HEXDUMP_WIDTH = 16  #байт в строке вывода hexdump
+XML_INDENT = "    "  #отступ вложенных элементов при сохранении xml
+BASE64_CHUNK = 3 * 16 * 1024  #размер блока base64 при сохранении (кратен 3 - блоки склеиваются без '=')
+_XML_UNSAFE = re.compile(rb'[\x00-\x08\x0b-\x1f]')  #байты, которые нельзя сохранить текстом xml (\r тоже)
+_BASE64_TEXT = re.compile(r'[A-Za-z0-9+/]*(=*)')  #base64 без пробелов: длина данных известна без декодирования
+WHITEOUT_PREFIX = ".wh."  #файл .wh.<имя> в верхнем слое скрывает <имя> нижних слоев (как в overlayfs/aufs)
+OPAQUE_MARKER = ".wh..wh..opq"  #файл-маркер: содержимое директории из нижних слоев не видно
+_HEXDUMP_TEXT = bytes(b if 32 <= b < 127 else 46 for b in range(256))  #непечатные байты заменяются точкой
+
+IMAGE_MAGIC = b'FVFSIMG\x00'  #сигнатура бинарного образа vfs
+IMAGE_VERSION = 1  #версия формата бинарного образа
+#заголовок: сигнатура, версия, длина имени vfs, число записей, смещение таблицы, размер таблицы, смещение содержимого
+_IMAGE_HEADER = struct.Struct('<8sHHIQQQ')
+#запись таблицы: тип (0 - директория, 1 - файл), права, длина пути, смещение содержимого, длина содержимого
+_IMAGE_ENTRY = struct.Struct('<BHHQQ')
+_IMAGE_DIR, _IMAGE_FILE = 0, 1  #типы записей таблицы
+_DIGEST_MEMORY = sys.getsizeof(hashlib.sha256().digest())  #память одного хеша меркла в узле
+
+OUTPUT_FLUSH_INTERVAL = 30  #период сброса буфера вывода в окно, мс
+OUTPUT_CHUNK_LINES = 2000  #сколько записей буфера вставляется в окно за один сброс
+OUTPUT_MAX_LINES = 10000  #максимальное число строк, хранимых в окне вывода
+VIEWER_THRESHOLD = 512 * 1024  #cat файла больше этого размера (в байтах) открывает окно просмотра
+VIEWER_ROWS = 30  #строк в окне просмотра до первого изменения его размера
+VIEWER_COLUMNS = 100  #символов строки в окне просмотра до первого изменения его размера
+VIEWER_SCROLL_STEP = 8  #на сколько байт сдвигают строки стрелки влево/вправо
+PROFILE_LINES = 20  #сколько строк отчета cProfile выводит команда profile
+SCRIPT_STEP_BUDGET = 0.02  #сколько секунд скрипт выполняется за один тик окна
+SCRIPT_CACHE_SIZE = 64  #сколько разобранных скриптов хранится одновременно
+SERVE_CHUNK = 64 * 1024  #размер блока, которым сервер отдает содержимое файла
+SERVE_LINE_LIMIT = 64 * 1024  #максимальная длина строки команды, принимаемой сервером
+
+
+class _HashingReader:
+    """обертка над бинарным файлом, считающая sha-256 по мере чтения"""
+
+    def __init__(self, raw):
+        self.raw = raw  #исходный бинарный файл
+        self.hasher = hashlib.sha256()  #накопитель хеша
+
+    def read(self, size=-1):
+        data = self.raw.read(size)  #читаем очередной блок
+        self.hasher.update(data)  #добавляем блок в хеш
+        return data  #отдаем блок парсеру
+
+    def hexdigest(self):
+        """дочитывание остатка файла и получение итогового хеша"""
+        while self.read(HASH_CHUNK_SIZE):  #парсер мог остановиться до конца файла
+            pass
+        return self.hasher.hexdigest()  #итоговый хеш
+
+
+def _layer_paths(path):
+    """пути слоев из значения vfs_path: 'нижний.xml,верхний.xml' (существующий файл с запятой - один слой);
+    не кэшируется: файл с запятой в имени может появиться позже"""
+    if ',' not in path or os.path.exists(path):
+        return [path]
+    return [part.strip() for part in path.split(',') if part.strip()]
+
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def _resolve_path(cwd, path):
+    """канонический абсолютный путь: учитывает '.', '..', повторные и завершающие слеши"""
+    parts = [] if path.startswith('/') else [part for part in cwd.split('/') if part]  #стартовые сегменты
+    for part in path.split('/'):  #разбор сегментов пути
+        if not part or part == '.':  #пустой сегмент (//, завершающий /) или текущая директория
+            continue
+        if part == '..':  #переход на уровень выше (выше корня подняться нельзя)
+            if parts:
+                parts.pop()
+            continue
+        parts.append(part)  #обычный сегмент
+    return '/' + '/'.join(parts)  #путь от корня
+
+
+class _XmlSource:
+    """исходный xml образ, из которого файлы читаются по требованию"""
+
+    def __init__(self, path):
+        self.path = path  #путь к xml файлу
+
+    def read_range(self, start, end):
+        """чтение диапазона байт образа"""
+        with open(self.path, 'rb') as f:  #открытие файла в бинарном режиме
+            f.seek(start)  #переход к началу элемента
+            return f.read(end - start)  #чтение байт элемента
+
+
+class _XmlWriter:
+    """потоковая запись xml в бинарный файл с подсчетом смещения и sha-256"""
+
+    def __init__(self, raw):
+        self.raw = raw  #файл, открытый на запись в бинарном режиме
+        self.offset = 0  #число записанных байт
+        self._hash = hashlib.sha256()  #хеш записанных байт
+
+    def write(self, text):
+        """запись текста в utf-8"""
+        data = text.encode('utf-8')  #байты фрагмента
+        self.raw.write(data)
+        self._hash.update(data)  #хеш считается по мере записи
+        self.offset += len(data)
+
+    def hexdigest(self):
+        """итоговый хеш записанного файла"""
+        return self._hash.hexdigest()
+
+
+def _mode_attr(mode, is_dir):
+    """атрибут mode элемента xml, если права отличаются от значений по умолчанию"""
+    if mode == (0o755 if is_dir else 0o644):
+        return ""
+    return f' mode="{mode:03o}"'
+
+
+def _needs_base64(data):
+    """содержимое нельзя сохранить текстом xml: не utf-8 или есть управляющие символы"""
+    if _XML_UNSAFE.search(data):  #управляющие символы и \r (парсер xml заменил бы его)
+        return True
+    try:
+        str(data, 'utf-8')
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def _file_xml(attrs, data):
+    """части элемента <file> без закрывающего тега: текст с экранированием или base64 блоками"""
+    if _needs_base64(data):  #двоичные данные
+        yield f'<file {attrs} encoding="base64">'
+        view = memoryview(data)
+        for pos in range(0, len(view), BASE64_CHUNK):  #блоки кратны 3 - склеиваются без '='
+            yield base64.b64encode(view[pos:pos + BASE64_CHUNK]).decode('ascii')
+    else:  #текст с экранированием
+        yield f"<file {attrs}>"
+        yield escape(str(data, 'utf-8'))
+
+
+def file_xml(name, data, mode=None):
+    """части элемента <file> для XmlImageWriter.write_file_parts; mode - права числом (None - по умолчанию).
+    от записи не зависит, поэтому файлы можно кодировать в рабочих потоках"""
+    return list(_file_xml(f"name={quoteattr(name)}{_mode_attr(0o644 if mode is None else mode, False)}", data))
+
+
+class XmlImageWriter:
+    """потоковая запись xml образа vfs по мере обхода дерева (save, vfs_import.py); смещение и sha-256 считаются
+    по мере записи, права - числом (None - по умолчанию)"""
+
+    def __init__(self, raw, name, mode=None):
+        self._out = _XmlWriter(raw)  #файл, открытый на запись в бинарном режиме
+        self.depth = 1  #глубина вложенности следующего элемента
+        self._out.write('<?xml version="1.0" encoding="UTF-8"?>\n')  #объявление кодировки
+        self._out.write(f"<vfs name={quoteattr(name)}{_mode_attr(0o755 if mode is None else mode, True)}>\n")
+
+    @property
+    def offset(self):
+        """число записанных байт"""
+        return self._out.offset
+
+    def open_directory(self, name, mode=None):
+        """открывающий тег директории: следующие элементы пишутся внутрь нее"""
+        self._out.write(f"{XML_INDENT * self.depth}<directory name={quoteattr(name)}"
+                        f"{_mode_attr(0o755 if mode is None else mode, True)}>\n")
+        self.depth += 1
+
+    def close_directory(self):
+        """закрывающий тег текущей директории"""
+        self.depth -= 1
+        self._out.write(f"{XML_INDENT * self.depth}</directory>\n")
+
+    def write_file(self, name, data, mode=None):
+        """элемент файла (base64 кодируется блоками по мере записи); (начало, конец) без закрывающего тега"""
+        return self.write_file_parts(_file_xml(f"name={quoteattr(name)}"
+                                               f"{_mode_attr(0o644 if mode is None else mode, False)}", data))
+
+    def write_file_parts(self, parts):
+        """элемент файла из готовых частей file_xml; (начало, конец) как у смещений ленивого загрузчика"""
+        self._out.write(XML_INDENT * self.depth)
+        start = self._out.offset  #начало элемента файла
+        for part in parts:
+            self._out.write(part)
+        end = self._out.offset
+        self._out.write("</file>\n")
+        return start, end
+
+    def close(self):
+        """закрытие корневого элемента; sha-256 записанного файла"""
+        self._out.write("</vfs>\n")
+        return self._out.hexdigest()
+
+
+class _LazyContent:
+    """ссылка на еще не декодированное содержимое файла в xml образе"""
+
+    def __init__(self, source, start, end, size=None):
+        self.source = source  #источник байт
+        self.start = start  #смещение открывающего тега <file>
+        self.end = end  #смещение закрывающего тега </file> (у файлов с текстом он всегда есть)
+        self.size = size  #длина декодированного содержимого, посчитанная при индексации (None - неизвестна)
+
+    def load(self, vfs):
+        """чтение и декодирование содержимого файла"""
+        raw = self.source.read_range(self.start, self.end) + b'</file>'  #байты элемента целиком
+        element = ET.fromstring(raw)  #разбор одного элемента (сущности и cdata обрабатывает парсер)
+        return vfs._decode_content(element.text, element.get('encoding'))  #декодированное содержимое
+
+
+class _MappedContent:
+    """ссылка на содержимое файла в отображенном в память бинарном образе"""
+
+    def __init__(self, image, start, length):
+        self.image = image  #mmap бинарного образа
+        self.start = start  #смещение содержимого в образе
+        self.length = length  #длина содержимого в байтах
+
+    def view(self):
+        """срез отображенной области без копирования"""
+        return memoryview(self.image)[self.start:self.start + self.length]
+
+    def load(self, vfs):
+        """содержимое файла - срез образа без копирования"""
+        return self.view()
+
+
+class VFSNode:
+    """узел дерева vfs: директория с картой потомков или файл с содержимым и правами"""
+
+    __slots__ = ('name', 'parent', 'children', 'content', 'mode', 'size', 'digest')  #без __dict__ на каждый узел
+
+    def __init__(self, name, is_dir, parent=None, content=None, mode=None):
+        self.name = sys.intern(name)  #имя узла (последний сегмент пути), одинаковые имена хранятся один раз
+        self.parent = parent  #родительский узел
+        self.children = {} if is_dir else None  #потомки директории {имя: узел}
+        self.content = content  #содержимое файла (байты или ссылка), у директории None
+        self.mode = (0o755 if is_dir else 0o644) if mode is None else mode  #права числом
+        self.size = None  #кэш размера узла в байтах (для директории - всего поддерева)
+        self.digest = None  #кэш хеша меркла: sha-256 содержимого файла или списка потомков директории
+
+    @property
+    def is_dir(self):
+        """флаг директории"""
+        return self.children is not None
+
+
+_NODE_MEMORY = sys.getsizeof(VFSNode("", False))  #память узла без имени, карты потомков и содержимого
+
+
+class _FilesView(Mapping):
+    """файлы vfs как отображение {путь: содержимое} поверх дерева (полные пути не хранятся)"""
+
+    def __init__(self, vfs):
+        self._vfs = vfs
+
+    def __getitem__(self, path):
+        node = self._vfs._get_node(path)  #поиск по дереву
+        if node is None or node.is_dir:
+            raise KeyError(path)
+        content = node.content
+        if isinstance(content, _MappedContent):  #копия области образа, как у файлов в памяти
+            return bytes(content.view())
+        if isinstance(content, _LazyContent):  #ссылки наружу не отдаются: содержимое читается через lru кэш
+            return self._vfs._load_lazy(self._vfs.resolve_path(path), content)
+        return content
+
+    def __contains__(self, path):
+        return self._vfs._file_node(path) is not None  #без чтения содержимого
+
+    def __iter__(self):
+        return (path for path, node in self._vfs._iter_nodes() if not node.is_dir)
+
+    def __len__(self):
+        return self._vfs._file_count
+
+
+class _PermissionsView(Mapping):
+    """права доступа как отображение {путь: '644'} поверх чисел в узлах"""
+
+    def __init__(self, vfs):
+        self._vfs = vfs
+
+    def __getitem__(self, path):
+        node = self._vfs._get_node(path)  #поиск по дереву
+        if node is None:
+            raise KeyError(path)
+        return format(node.mode, '03o')
+
+    def __iter__(self):
+        yield self._vfs.root
+        for path, _ in self._vfs._iter_nodes():
+            yield path
+
+    def __len__(self):
+        return self._vfs._file_count + self._vfs._dir_count
+
+
+class _DirectoriesView(Set):
+    """директории vfs как множество путей поверх дерева"""
+
+    def __init__(self, vfs):
+        self._vfs = vfs
+
+    def __contains__(self, path):
+        node = self._vfs._get_node(path)  #поиск по дереву
+        return node is not None and node.is_dir
+
+    def __iter__(self):
+        yield self._vfs.root
+        for path, node in self._vfs._iter_nodes():
+            if node.is_dir:
+                yield path
+
+    def __len__(self):
+        return self._vfs._dir_count
 
 
 class VFS:
-    def __init__(self):
-        self.files = {}  #словарь для хранения файлов {путь: содержимое}
-        self.file_permissions = {}  #словарь для хранения прав доступа {путь: права}
-        self.directories = set()  #множество для хранения директорий
+    def __init__(self, lazy=False, cache_size=64):
+        self.lazy = lazy  #ленивая загрузка содержимого файлов по умолчанию
+        self.cache_size = cache_size  #размер lru кэша декодированного содержимого (0 - без кэша)
+        self._content_cache = OrderedDict()  #lru кэш {путь: содержимое}
+        self._line_index = OrderedDict()  #lru кэш индексов строк {путь: смещения начал строк}
+        self.tree = VFSNode("", True)  #дерево узлов vfs: содержимое и права хранятся в узлах
+        self._file_count = 0  #число файлов в дереве
+        self._dir_count = 1  #число директорий (с корнем)
+        self._metadata_bytes = sys.getsizeof(self.tree) + sys.getsizeof(self.tree.children)  #память узлов (с корнем)
+        self._content_bytes = 0  #память содержимого файлов, хранящегося в дереве
+        self._digest_count = 0  #число узлов с посчитанным хешем меркла
+        self.files = _FilesView(self)  #{путь: содержимое} поверх дерева
+        self.file_permissions = _PermissionsView(self)  #{путь: права} поверх дерева
+        self.directories = _DirectoriesView(self)  #множество путей директорий поверх дерева
         self.root = "/"  #корневая директория vfs
         self.name = ""  #имя vfs из xml
-        self.sha256_hash = ""  #хэш sha-256 данных vfs
+        self._sha256_hash = ""  #хэш sha-256 данных vfs (None - еще не вычислен)
         self.loaded = False  #флаг загрузки vfs
-
-    def load_from_xml(self, xml_path):
-        """загрузка vfs из xml файла"""
+        self.backend = ""  #способ хранения загруженного образа (xml, mmap и т.д.)
+        self._image_map = None  #mmap бинарного образа, если он загружен
+        self._source_path = None  #путь к загруженному образу
+        self._source_key = None  #ключ (путь, размер, mtime, inode) загруженного образа
+        self.layers = []  #пути образов-слоев снизу вверх (один слой - обычная загрузка)
+        self._layers_key = None  #ключи образов, загруженных слоями (для пропуска повторной загрузки)
+        self._modified = False  #флаг изменения vfs после загрузки
+        self._journal = []  #журнал отмены изменений, пока есть снимки (записи для отката)
+        self._snapshots = {}  #снимки {имя: (длина журнала, номер состояния) в момент сохранения}
+        self._changes = 0  #счетчик изменений с загрузки: каждое изменение дает новый номер состояния
+        self._state = 0  #номер текущего состояния vfs
+        self._clean_state = 0  #номер состояния, совпадающего с файлом образа
+        self._grep_index = None  #индекс n-грамм {n-грамма: множество путей файлов}
+        self._grep_grams = {}  #n-граммы каждого проиндексированного файла {путь: множество} для точечного обновления
+
+    @property
+    def sha256_hash(self):
+        """хэш sha-256 образа (для mmap образа вычисляется при первом обращении)"""
+        if self._sha256_hash is None and self._image_map is not None:  #хеш отложен до первого запроса
+            hasher = hashlib.sha256()  #накопитель хеша
+            view = memoryview(self._image_map)  #отображенный образ без копирования
+            for start in range(0, len(view), HASH_CHUNK_SIZE):  #хешируем образ блоками
+                hasher.update(view[start:start + HASH_CHUNK_SIZE])
+            self._sha256_hash = hasher.hexdigest()  #итоговый хеш
+            self._store_cached_hash()  #сохраняем хеш в файл-спутник
+        return self._sha256_hash or ""
+
+    @sha256_hash.setter
+    def sha256_hash(self, value):
+        self._sha256_hash = value  #хеш, посчитанный при разборе
+
+    def _image_key(self, path):
+        """ключ образа для кэша: путь, размер, время изменения и inode"""
+        st = os.stat(path)  #метаданные файла
+        return {"path": os.path.abspath(path), "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns, "inode": st.st_ino}
+
+    def _read_cached_hash(self, key):
+        """чтение хеша из файла-спутника, если образ не изменился"""
+        try:
+            with open(key["path"] + HASH_CACHE_SUFFIX, 'r', encoding='utf-8') as f:  #файл-спутник
+                cached = json.load(f)  #сохраненный ключ и хеш
+        except (OSError, ValueError):  #кэша нет или он поврежден
+            return None
+        if any(cached.get(field) != value for field, value in key.items()):  #образ изменился
+            return None
+        return cached.get("sha256")  #хеш неизмененного образа
+
+    def _store_cached_hash(self):
+        """запись хеша загруженного образа в файл-спутник"""
+        if not self._source_key or not self._sha256_hash:  #нечего сохранять
+            return
+        cached = dict(self._source_key, sha256=self._sha256_hash)  #ключ образа и хеш
+        try:
+            with open(self._source_key["path"] + HASH_CACHE_SUFFIX, 'w', encoding='utf-8') as f:
+                json.dump(cached, f)  #сохраняем кэш рядом с образом
+        except OSError:  #директория образа недоступна на запись - работаем без кэша
+            pass
+
+    def _finish_load(self, path, backend):
+        """общие действия после успешной загрузки образа"""
+        self._source_path = os.path.abspath(path)  #путь к загруженному образу
+        self._source_key = self._image_key(path)  #ключ образа для повторной загрузки
+        self.layers = [self._source_path]  #единственный слой
+        self._layers_key = None
+        self._restore_merkle()  #хеши узлов из файла-спутника, если образ уже проверялся
+        self._modified = False  #vfs совпадает с образом
+        self.backend = backend  #способ хранения образа
+        self.loaded = True  #устанавливаем флаг загрузки
+
+    def load(self, path):
+        """загрузка vfs из xml или бинарного образа (формат определяется по сигнатуре)"""
+        paths = _layer_paths(path)  #несколько образов через запятую - слои
+        if len(paths) > 1:
+            return self.load_layers(paths)
+        try:
+            #неизмененный образ, который уже загружен и не менялся, повторно не читаем
+            if self.loaded and not self._modified and self._source_key == self._image_key(path):
+                return True, f"vfs '{self.name}' не изменилась, повторная загрузка пропущена"
+        except OSError:  #файл недоступен - ошибку сообщит загрузчик
+            pass
+        try:
+            with open(path, 'rb') as f:  #открытие файла в бинарном режиме
+                is_image = f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC  #проверка сигнатуры образа
+        except OSError:  #файл недоступен - ошибку сообщит загрузчик xml
+            is_image = False
+        if is_image:  #бинарный образ
+            return self.load_image(path)
+        return self.load_from_xml(path)  #xml образ
+
+    def load_layers(self, paths):
+        """загрузка образов слоями: первый - нижний, каждый следующий перекрывает предыдущие"""
+        try:
+            keys = [self._image_key(path) for path in paths]  #ключи всех слоев
+        except OSError as e:
+            return False, f"файл vfs не найден: {e.filename}"
+        if self.loaded and not self._modified and self._layers_key == keys:  #те же неизмененные слои
+            return True, f"vfs '{self.name}' не изменилась, повторная загрузка пропущена"
+        success, message = self.load(paths[0])  #нижний слой загружается как обычный образ
+        if not success:
+            return False, message
+        backend = self.backend  #хранилище нижнего слоя
+        for path in paths[1:]:  #верхние слои накладываются по очереди
+            success, message = self.mount(path)
+            if not success:  #частично собранная vfs не используется
+                self._reset()
+                self.loaded = False
+                return False, message
+        self._clean_state = self._state  #наложение слоев - это загрузка, а не изменение
+        self._modified = False
+        self._layers_key = keys
+        self.backend = f"{backend}, слоев: {len(paths)}"
+        return True, f"vfs '{self.name}' успешно загружена (слоев: {len(paths)})"
+
+    def mount(self, path):
+        """наложение образа верхним слоем на загруженную vfs (отменяется через snapshot restore)"""
+        if not self.loaded:  #проверка загрузки vfs
+            return False, "vfs не загружена"
+        layer = VFS(lazy=self.lazy, cache_size=0)  #слой загружается отдельно, его узлы переносятся в дерево
+        success, message = layer.load(path)
+        if not success:
+            return False, message
+        self._record('layers', None, list(self.layers), self._sha256_hash, self._source_path, self._source_key)
+        changed = self._merge_layer(layer)  #объединенное дерево - готовый вид всех слоев
+        #хеш стопки слоев: sha-256 от хеша нижних слоев и хеша нового слоя
+        self.sha256_hash = hashlib.sha256((self.sha256_hash + layer.sha256_hash).encode('ascii')).hexdigest()
+        self.layers.append(os.path.abspath(path))
+        self._source_path = None  #сохранение без пути не должно сливать слои в нижний образ
+        self._source_key = None
+        return True, f"образ '{layer.name}' подключен верхним слоем (изменено элементов: {changed})"
+
+    def _merge_layer(self, layer):
+        """наложение дерева верхнего слоя с записью изменений в журнал; число измененных элементов"""
+        changed = 0
+        stack = [(self.root, self.tree, layer.tree)]  #(путь, директория объединенного дерева, директория слоя)
+        while stack:
+            dir_path, merged, upper = stack.pop()
+            changed += self._apply_whiteouts(dir_path, merged, upper)  #удаления действуют только на нижние слои
+            for name, node in upper.children.items():
+                if name.startswith(WHITEOUT_PREFIX):  #маркеры в дерево не попадают
+                    continue
+                path = self._join(dir_path, name)
+                lower = merged.children.get(name)  #элемент нижних слоев
+                if lower is not None and lower.is_dir != node.is_dir:  #тип изменился - нижний элемент скрывается
+                    self._detach(path, lower)
+                    lower = None
+                if node.is_dir:  #директории объединяются
+                    if lower is None:
+                        self._attach(path, True)
+                        lower = merged.children[name]
+                    stack.append((path, lower, node))
+                    if node.mode != 0o755 and node.mode != lower.mode:  #заданные в слое права
+                        self._set_permission(path, format(node.mode, '03o'))
+                else:  #файл верхнего слоя заменяет нижний целиком (содержимое остается ссылкой на слой)
+                    if lower is None:
+                        self._attach(path, False, node.content)
+                    else:
+                        self._set_content(path, node.content)
+                    self._set_digest(merged.children[name], node.digest)  #хеш содержимого, если слой уже проверялся
+                    if merged.children[name].mode != node.mode:
+                        self._set_permission(path, format(node.mode, '03o'))
+                changed += 1
+        return changed
+
+    def _apply_whiteouts(self, dir_path, merged, upper):
+        """удаление элементов нижних слоев по маркерам директории верхнего слоя; число удаленных"""
+        removed = 0
+        if OPAQUE_MARKER in upper.children:  #непрозрачная директория: все нижние элементы скрываются
+            for name, child in list(merged.children.items()):
+                removed += self._detach(self._join(dir_path, name), child)
+        for name in upper.children:
+            if name.startswith(WHITEOUT_PREFIX) and name != OPAQUE_MARKER:
+                hidden = merged.children.get(name[len(WHITEOUT_PREFIX):])  #скрываемый элемент
+                if hidden is not None:
+                    removed += self._detach(self._join(dir_path, hidden.name), hidden)
+        return removed
+
+    def load_from_xml(self, xml_path, streaming=None, lazy=None):
+        """загрузка vfs из xml файла (streaming=None - выбор режима по размеру файла)"""
         try:
             if not os.path.exists(xml_path):  #проверка существования файла
                 return False, f"файл vfs не найден: {xml_path}"  #возврат ошибки
 
-            #читаем файл для вычисления хеша в бинарном режиме
+            if lazy is None:  #режим по умолчанию задается при создании vfs
+                lazy = self.lazy
+            if lazy:  #ленивая загрузка - запоминаем только положение файлов в образе
+                self._load_xml_lazy(xml_path)  #индексация за один проход
+                self._finish_load(xml_path, "xml (ленивый)")  #содержимое читается из xml по требованию
+                return True, f"vfs '{self.name}' успешно загружена (ленивый режим)"  #возврат успешного результата
+
+            if streaming is None:  #автоматический выбор режима
+                streaming = os.path.getsize(xml_path) >= STREAMING_THRESHOLD  #большие образы читаем потоково
+            if streaming:  #потоковая загрузка через iterparse
+                self._load_xml_streaming(xml_path)  #разбор за один проход
+                self._finish_load(xml_path, "xml (потоковый)")  #образ разобран потоково, содержимое в памяти
+                return True, f"vfs '{self.name}' успешно загружена (потоковый режим)"  #возврат успешного результата
+
+            #парсим xml, хеш считается блоками в том же проходе
             with open(xml_path, 'rb') as f:  #открытие файла в бинарном режиме
-                file_data = f.read()  #чтение всех данных файла
-                self.sha256_hash = hashlib.sha256(file_data).hexdigest()  #вычисление sha-256 хеша
-
-            #парсим xml с указанием кодировки
-            with open(xml_path, 'r', encoding='utf-8') as f:  #открытие файла с кодировкой utf-8
-                tree = ET.parse(f)  #парсинг xml дерева
+                reader = _HashingReader(f)  #чтение с подсчетом sha-256
+                tree = ET.parse(reader)  #парсинг xml дерева
                 root = tree.getroot()  #получение корневого элемента
+                self.sha256_hash = reader.hexdigest()  #хеш всех байт файла
 
             #получаем имя vfs из атрибута xml
             self.name = root.get('name', 'unnamed_vfs')  #имя vfs или значение по умолчанию
-            self.files = {}  #очищаем словарь файлов
-            self.file_permissions = {}  #очищаем словарь прав доступа
-            self.directories = set()  #очищаем множество директорий
-            self.directories.add("/")  #добавляем корневую директорию
-
-            def process_element(element, current_path):  #внутренняя функция обработки элементов
-                #рекурсивная обработка структуры xml
-                for child in element:  #перебор всех дочерних элементов
-                    if child.tag == 'directory':  #если элемент - директория
-                        #обработка директории
-                        dir_name = child.get('name', 'unnamed')  #получение имени директории
-                        dir_path = os.path.join(current_path, dir_name).replace('\\', '/')  #формирование пути
-                        #устанавливаем права по умолчанию для директории
-                        self.file_permissions[dir_path] = '755'
-                        self.directories.add(dir_path)  #добавляем директорию в множество
-                        process_element(child, dir_path)  #рекурсивный вызов для вложенных элементов
-                    elif child.tag == 'file':  #если элемент - файл
-                        #обработка файла
-                        file_name = child.get('name', 'unnamed')  #получение имени файла
-                        file_path = os.path.join(current_path, file_name).replace('\\', '/')  #формирование пути
-                        content = child.text or ""  #содержимое файла (пустая строка если none)
-                        if child.get('encoding') == 'base64':  #проверка кодировки base64
-                            #декодирование base64 данных
-                            try:
-                                content = base64.b64decode(content).decode('utf-8')  #декодирование base64
-                            except:  #обработка ошибок декодирования
-                                content = f"[binary data - size: {len(content)} bytes]"  #сообщение об ошибке
-                        self.files[file_path] = content  #сохраняем файл в памяти
-                        #устанавливаем права по умолчанию для файла
-                        self.file_permissions[file_path] = '644'
-
-            process_element(root, self.root)  #начинаем обработку с корневого элемента
-            self.loaded = True  #устанавливаем флаг загрузки
+            self._reset()  #очищаем структуры vfs
+            self._add_directory(self.root, root.get('mode'))  #права корня
+
+            #обход структуры xml с явным стеком итераторов (глубина вложенности не ограничена стеком вызовов)
+            stack = [(self.root, iter(root))]  #(путь директории, ее необработанные элементы)
+            while stack:
+                current_path, children = stack[-1]
+                child = next(children, None)  #очередной дочерний элемент
+                if child is None:  #директория пройдена
+                    stack.pop()
+                    continue
+                if child.tag == 'directory':  #если элемент - директория
+                    dir_name = child.get('name', 'unnamed')  #получение имени директории
+                    dir_path = self._child_path(current_path, dir_name)  #формирование пути
+                    self._add_directory(dir_path, child.get('mode'))  #добавляем директорию в дерево и множество
+                    stack.append((dir_path, iter(child)))  #вложенные элементы обрабатываются следующими
+                elif child.tag == 'file':  #если элемент - файл
+                    file_name = child.get('name', 'unnamed')  #получение имени файла
+                    file_path = self._child_path(current_path, file_name)  #формирование пути
+                    content = self._decode_content(child.text, child.get('encoding'))  #содержимое файла
+                    self._add_file(file_path, content, child.get('mode'))  #сохраняем файл в памяти и в дереве
+            self._finish_load(xml_path, "xml")  #образ разобран целиком, содержимое в памяти
             return True, f"vfs '{self.name}' успешно загружена"  #возврат успешного результата
 
         except Exception as e:  #обработка всех исключений
             return False, f"ошибка загрузки vfs: {str(e)}"  #возврат ошибки
 
+    def _load_xml_streaming(self, xml_path):
+        """потоковый разбор xml через iterparse с явным стеком директорий"""
+        with open(xml_path, 'rb') as raw:  #открытие файла в бинарном режиме
+            reader = _HashingReader(raw)  #хеш считается в том же проходе, что и разбор
+            elements = []  #стек открытых xml элементов
+            paths = []  #стек путей: путь директории или None, если элемент не контейнер
+            self._reset()  #очищаем структуры vfs
+
+            for event, element in ET.iterparse(reader, events=('start', 'end')):
+                if event == 'start':  #открывающий тег
+                    if not elements:  #корневой элемент образа
+                        self.name = element.get('name', 'unnamed_vfs')  #имя vfs или значение по умолчанию
+                        path = self.root  #корень vfs
+                        self._add_directory(path, element.get('mode'))  #права корня
+                    elif paths[-1] is not None and element.tag == 'directory':  #директория внутри контейнера
+                        path = self._child_path(paths[-1], element.get('name', 'unnamed'))  #формирование пути
+                        self._add_directory(path, element.get('mode'))  #добавляем директорию в дерево и множество
+                    else:  #файлы и прочие теги не содержат директорий
+                        path = None
+                    elements.append(element)  #кладем элемент в стек
+                    paths.append(path)  #кладем путь в стек
+                    continue
+
+                elements.pop()  #закрывающий тег - снимаем элемент со стека
+                paths.pop()
+                if not elements:  #закрыт корневой элемент
+                    element.clear()  #освобождаем корень
+                    continue
+                parent_path = paths[-1]  #путь директории-родителя
+                if parent_path is not None and element.tag == 'file':  #файл внутри контейнера
+                    file_path = self._child_path(parent_path, element.get('name', 'unnamed'))  #формирование пути
+                    content = self._decode_content(element.text, element.get('encoding'))  #содержимое файла
+                    self._add_file(file_path, content, element.get('mode'))  #сохраняем файл в памяти и в дереве
+                element.clear()  #освобождаем обработанный элемент
+                del elements[-1][-1]  #отцепляем его от родителя, чтобы дерево не росло
+
+            self.sha256_hash = reader.hexdigest()  #хеш всех прочитанных байт
+
+    def load_image(self, image_path):
+        """загрузка vfs из бинарного образа через mmap без копирования содержимого"""
+        try:
+            if not os.path.exists(image_path):  #проверка существования файла
+                return False, f"файл vfs не найден: {image_path}"  #возврат ошибки
+
+            with open(image_path, 'rb') as f:  #открытие файла в бинарном режиме
+                image = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  #отображение образа в память
+
+            magic, version, name_len, count, table_offset, _, content_offset = _IMAGE_HEADER.unpack_from(image, 0)
+            if magic != IMAGE_MAGIC:  #проверка сигнатуры
+                return False, f"ошибка загрузки vfs: файл не является образом vfs: {image_path}"  #возврат ошибки
+            if version != IMAGE_VERSION:  #проверка версии формата
+                return False, f"ошибка загрузки vfs: неподдерживаемая версия образа: {version}"  #возврат ошибки
+
+            self._reset()  #очищаем структуры vfs
+            name_start = _IMAGE_HEADER.size  #имя vfs идет сразу после заголовка
+            self.name = image[name_start:name_start + name_len].decode('utf-8')  #имя vfs
+
+            pos = table_offset  #начало таблицы путей
+            for _ in range(count):  #чтение записей таблицы
+                kind, mode, path_len, offset, length = _IMAGE_ENTRY.unpack_from(image, pos)
+                pos += _IMAGE_ENTRY.size  #путь идет сразу после записи
+                path = image[pos:pos + path_len].decode('utf-8')  #путь элемента
+                pos += path_len  #переход к следующей записи
+                if kind == _IMAGE_DIR:  #директория
+                    node = self._add_directory(path)  #добавляем директорию в дерево
+                else:  #файл - храним только ссылку на область образа
+                    node = self._add_file(path, _MappedContent(image, content_offset + offset, length))
+                node.mode = mode  #права в образе уже хранятся числом
+
+            self._image_map = image  #образ остается отображенным, пока vfs его использует
+            key = self._image_key(image_path)  #ключ образа для кэша хеша
+            self.sha256_hash = self._read_cached_hash(key)  #хеш из кэша или None - посчитаем по запросу
+            self._finish_load(image_path, "mmap образ")  #содержимое читается срезами отображенной памяти
+            return True, f"vfs '{self.name}' успешно загружена из бинарного образа"  #возврат успешного результата
+
+        except Exception as e:  #обработка всех исключений
+            return False, f"ошибка загрузки vfs: {str(e)}"  #возврат ошибки
+
+    def save_image(self, image_path):
+        """сохранение текущего состояния vfs в бинарный образ"""
+        entries = []  #записи таблицы путей
+        with open(image_path, 'wb') as f:  #открытие файла образа на запись
+            name = self.name.encode('utf-8')  #имя vfs в utf-8
+            f.write(b'\0' * _IMAGE_HEADER.size)  #место под заголовок, он пишется в конце
+            f.write(name)  #имя vfs
+            content_offset = f.tell()  #начало области содержимого
+            size = 0  #текущий размер области содержимого
+            for path, node in self._walk():  #обход дерева: родители раньше потомков
+                mode = node.mode  #права в виде числа
+                if node.is_dir:  #директория без содержимого
+                    entries.append((_IMAGE_DIR, mode, path, 0, 0))
+                    continue
+                data = self.read_file(path)  #содержимое файла в байтах
+                f.write(data)  #содержимое идет сплошной областью
+                entries.append((_IMAGE_FILE, mode, path, size, len(data)))
+                size += len(data)
+
+            table_offset = f.tell()  #таблица путей идет после содержимого
+            for kind, mode, path, offset, length in entries:  #запись таблицы
+                encoded = path.encode('utf-8')  #путь в utf-8
+                f.write(_IMAGE_ENTRY.pack(kind, mode, len(encoded), offset, length))
+                f.write(encoded)
+            table_size = f.tell() - table_offset  #размер таблицы путей
+
+            f.seek(0)  #возврат к заголовку
+            f.write(_IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, len(name), len(entries),
+                                       table_offset, table_size, content_offset))
+        return len(entries)  #число записанных элементов
+
+    def _walk(self, path="/"):
+        """обход дерева в прямом порядке: пары (путь, узел) без стартового узла"""
+        start = self._get_node(path)  #стартовый узел
+        if start is None or not start.is_dir:  #нет такой директории
+            return
+        stack = [(self._join(path, name), child)  #явный стек вместо рекурсии
+                 for name, child in sorted(start.children.items(), reverse=True)]
+        while stack:
+            child_path, node = stack.pop()  #очередной узел
+            yield child_path, node
+            if node.is_dir:  #потомки кладутся в обратном порядке, чтобы выходить по алфавиту
+                stack.extend((self._join(child_path, name), child)
+                             for name, child in sorted(node.children.items(), reverse=True))
+
+    def _join(self, path, name):
+        """путь потомка канонической директории"""
+        return '/' + name if path == '/' else path + '/' + name
+
+    def _iter_nodes(self):
+        """все узлы в порядке добавления (как в образе): пары (путь, узел) без корня"""
+        stack = [(self.root, iter(self.tree.children.values()))]  #явный стек итераторов потомков
+        while stack:
+            dir_path, children = stack[-1]
+            node = next(children, None)  #очередной потомок
+            if node is None:  #директория пройдена
+                stack.pop()
+                continue
+            path = self._join(dir_path, node.name)
+            yield path, node
+            if node.is_dir:
+                stack.append((path, iter(node.children.values())))
+
+    def _file_node(self, path):
+        """узел файла по каноническому пути или None"""
+        node = self._get_node(path)  #поиск по дереву
+        return None if node is None or node.is_dir else node
+
+    def _load_xml_lazy(self, xml_path):
+        """индексация xml через expat: для файлов сохраняются только смещения в образе"""
+        source = _XmlSource(xml_path)  #общий источник для всех файлов образа
+        parser = xml.parsers.expat.ParserCreate()  #потоковый парсер с доступом к смещениям
+        paths = []  #стек путей: путь директории или None, если элемент не контейнер
+        files = []  #стек открытых файлов: путь, смещение, флаг текста, права, base64, длина, число '='
+
+        def start_element(tag, attrs):  #открывающий тег
+            if not paths:  #корневой элемент образа
+                self.name = attrs.get('name', 'unnamed_vfs')  #имя vfs или значение по умолчанию
+                self._add_directory(self.root, attrs.get('mode'))  #права корня
+                paths.append(self.root)  #корень vfs
+                return
+            parent_path = paths[-1]  #путь директории-родителя
+            if parent_path is not None and tag == 'directory':  #директория внутри контейнера
+                dir_path = self._child_path(parent_path, attrs.get('name', 'unnamed'))  #формирование пути
+                self._add_directory(dir_path, attrs.get('mode'))  #добавляем директорию в дерево и множество
+                paths.append(dir_path)
+                return
+            if parent_path is not None and tag == 'file':  #файл внутри контейнера
+                file_path = self._child_path(parent_path, attrs.get('name', 'unnamed'))  #формирование пути
+                files.append([file_path, parser.CurrentByteIndex, False, attrs.get('mode'),
+                              attrs.get('encoding') == 'base64', 0, 0])  #длина содержимого считается по тексту
+            paths.append(None)  #внутри файлов и прочих тегов директорий нет
+
+        def end_element(tag):  #закрывающий тег
+            paths.pop()  #снимаем элемент со стека
+            if paths and paths[-1] is not None and tag == 'file':  #закрыт файл внутри контейнера
+                file_path, start, has_text, mode, is_base64, size, padding = files.pop()  #начало элемента файла
+                if is_base64 and size is not None:  #длина декодированных base64 данных
+                    size = None if size % 4 or padding > 2 else size // 4 * 3 - padding
+                content = _LazyContent(source, start, parser.CurrentByteIndex, size) if has_text else b""  #ссылка на содержимое
+                self._add_file(file_path, content, mode)  #сохраняем ссылку вместо содержимого
+
+        def character_data(data):  #текст внутри элементов
+            if files:  #текст относится к открытому файлу
+                current = files[-1]
+                current[2] = True  #у файла есть содержимое
+                if current[5] is None:  #длину узнаем только при чтении
+                    return
+                if not current[4]:  #текст хранится в utf-8
+                    current[5] += len(data) if data.isascii() else len(data.encode('utf-8'))
+                    return
+                text = ''.join(data.split())  #пробелы и переводы строк base64 декодер пропускает
+                match = _BASE64_TEXT.fullmatch(text)
+                if match is None or current[6] and text.strip('='):  #необычный base64 - длину посчитает чтение
+                    current[5] = None
+                    return
+                current[5] += len(text)
+                current[6] += len(match.group(1))  #завершающие '='
+
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+
+        with open(xml_path, 'rb') as raw:  #открытие файла в бинарном режиме
+            reader = _HashingReader(raw)  #хеш считается в том же проходе, что и разбор
+            self._reset()  #очищаем структуры vfs
+            parser.ParseFile(reader)  #потоковый разбор
+            self.sha256_hash = reader.hexdigest()  #хеш всех прочитанных байт
+
+    def resolve_path(self, path, cwd="/"):
+        """канонический путь относительно текущей директории (результат кэшируется)"""
+        return _resolve_path(cwd, path)
+
+    def _child_path(self, parent_path, name):
+        """формирование пути дочернего элемента"""
+        return _resolve_path(parent_path, name)  #канонический путь
+
+    def _decode_content(self, text, encoding):
+        """получение содержимого файла в байтах из текста xml элемента"""
+        content = text or ""  #содержимое файла (пустая строка если none)
+        if encoding == 'base64':  #проверка кодировки base64
+            #декодирование base64 данных (байты хранятся как есть, без перевода в текст)
+            try:
+                return base64.b64decode(content)  #декодирование base64
+            except ValueError:  #некорректный base64 - сохраняем исходный текст
+                pass
+        return content.encode('utf-8')  #текст хранится в utf-8 (строка xml дальше не удерживается)
+
+    def _reset(self):
+        """очистка всех структур vfs"""
+        self.tree = VFSNode("", True)  #новое пустое дерево (файлы, права и директории хранятся в нем)
+        self._file_count = 0  #файлов нет
+        self._dir_count = 1  #только корень
+        self._metadata_bytes = sys.getsizeof(self.tree) + sys.getsizeof(self.tree.children)  #память только корня
+        self._content_bytes = 0
+        self._digest_count = 0
+        self._content_cache.clear()  #содержимое прежнего образа больше не нужно
+        self._line_index.clear()  #индексы строк прежнего образа
+        self._image_map = None  #отображение прежнего образа закроется вместе с последней ссылкой
+        self._source_key = None  #пока загрузка не завершена, vfs не соответствует ни одному образу
+        self._grep_index = None  #индекс n-грамм строится заново при первом grep после загрузки
+        self._grep_grams = {}
+        self._journal = []  #изменения прежнего образа откатывать некуда
+        self._snapshots = {}  #снимки относятся к прежнему образу
+        self._changes = self._state = self._clean_state = 0  #vfs совпадает с образом
+
+    def _split_path(self, path):
+        """разбиение пути на сегменты без пустых частей"""
+        return [part for part in path.split('/') if part]  #сегменты пути
+
+    def _get_node(self, path):
+        """поиск узла дерева по пути за O(глубины)"""
+        node = self.tree  #начинаем с корня
+        for part in self._split_path(path):  #спуск по сегментам пути
+            if not node.is_dir:  #файл не может содержать потомков
+                return None
+            node = node.children.get(part)  #переход к потомку
+            if node is None:  #сегмент не найден
+                return None
+        return node  #найденный узел
+
+    def _add_directory(self, path, mode=None):
+        """добавление директории (и недостающих родителей) в дерево; mode - права из образа"""
+        node = self.tree  #начинаем с корня
+        current = ""  #текущий собираемый путь
+        for part in self._split_path(path):  #проход по сегментам
+            current += '/' + part  #путь очередной директории
+            child = node.children.get(part)  #существующий потомок
+            if child is None:  #директории еще нет
+                child = VFSNode(part, True, node)  #создаем узел директории (права по умолчанию 755)
+                before = sys.getsizeof(node.children)  #размер карты потомков до вставки
+                node.children[child.name] = child  #привязываем к родителю по интернированному имени
+                self._count_node(child, 1, before)
+                self._dir_count += 1
+            node = child  #спускаемся ниже
+        if mode and self._is_valid_mode(mode):  #права заданы в образе
+            node.mode = int(mode, 8)
+        return node  #узел директории
+
+    def _add_file(self, path, content, mode=None):
+        """добавление файла в дерево и словари; mode - права из образа"""
+        parent_path, _, file_name = path.rpartition('/')  #разделяем путь на директорию и имя
+        parent = self._add_directory(parent_path)  #гарантируем существование родителя
+        children = parent.children
+        before = sys.getsizeof(children)  #размер карты потомков до вставки
+        previous = children.get(file_name)
+        if previous is None:
+            self._file_count += 1
+        else:  #повторный файл с тем же именем заменяет прежний
+            self._count_node(previous, -1, before)
+        node = VFSNode(file_name, False, parent, content,
+                       int(mode, 8) if mode and self._is_valid_mode(mode) else None)  #узел файла с содержимым
+        children[node.name] = node
+        #учет памяти как в _count_node, без лишних вызовов: файлов при загрузке миллионы
+        self._metadata_bytes += _NODE_MEMORY + sys.getsizeof(node.name) + sys.getsizeof(children) - before
+        if type(content) is bytes:
+            self._content_bytes += sys.getsizeof(content)
+        else:  #ссылка на образ
+            self._metadata_bytes += sys.getsizeof(content)
+        return node
+
+    def add_directory(self, path, mode=None):
+        """добавление директории (и недостающих родителей) без журнала отмены - для построения vfs
+        из других источников; mode - права числом"""
+        node = self._add_directory(self.resolve_path(path), None if mode is None else format(mode, '03o'))
+        self._invalidate_size(node)  #права директории входят в ее хеш
+        if self.loaded:
+            self._modified = True  #vfs больше не совпадает с образом
+
+    def add_file(self, path, content, mode=None):
+        """добавление файла с содержимым в байтах (недостающие директории создаются, прежний файл заменяется)
+        без журнала отмены - для построения vfs из других источников; mode - права числом"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        node = self._add_file(path, bytes(content), None if mode is None else format(mode, '03o'))
+        self._invalidate_size(node.parent)
+        self._forget_content(path)  #кэши и индекс поиска прежнего файла
+        if self.loaded:
+            self._modified = True
+
     def list_directory(self, path):
         """список содержимого директории"""
-        #Нормализуем путь
-        if path != "/":
-            path = path.rstrip('/')
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        node = self._get_node(path)  #узел директории
+        if node is None or not node.is_dir:  #нет такой директории
+            return []  #пустой результат
 
-        dirs = set()  #множество для директорий
+        dirs = []  #список для директорий
         files = []  #список для файлов
-
-        for file_path in self.files.keys():  #перебор всех путей файлов
-            #Получаем директорию файла
-            file_dir = os.path.dirname(file_path)
-            if file_dir == "":
-                file_dir = "/"
-
-            #Если запрашивают корневую директорию
-            if path == "/":
-                if file_dir == "/":  #файл в корне
-                    files.append(os.path.basename(file_path))
-                else:  #файл во вложенной директории
-                    #Берем первую часть пути после корня
-                    first_dir = file_path.split('/')[1]
-                    dirs.add(first_dir)
-            else:
-                #Если файл находится в запрашиваемой директории
-                if file_dir == path:
-                    files.append(os.path.basename(file_path))
-                #Если файл находится во вложенной директории
-                elif file_path.startswith(path + '/'):
-                    remaining = file_path[len(path) + 1:]
-                    next_part = remaining.split('/')[0]
-                    dirs.add(next_part)
-
-        #Добавляем поддиректории из множества directories
-        for dir_path in self.directories:
-            if dir_path != "/" and dir_path.startswith(path + '/') or (path == "/" and dir_path.count('/') == 1):
-                dir_name = os.path.basename(dir_path)
-                if dir_name:
-                    dirs.add(dir_name)
+        for name, child in node.children.items():  #перебор только потомков директории
+            (dirs if child.is_dir else files).append(name)
 
         result = []  #результирующий список
         for d in sorted(dirs):  #сортировка директорий по алфавиту
@@ -123,39 +939,534 @@ class VFS:
 
     def directory_exists(self, path):
         """проверка существования директории"""
-        if path == "/":
-            return True  #корневая директория всегда существует
-
-        #Проверяем в множестве директорий
-        if path in self.directories:
-            return True
-
-        #Проверяем, есть ли файлы в этой директории или ее поддиректориях
-        for file_path in self.files.keys():
-            file_dir = os.path.dirname(file_path)
-            if file_dir == "":
-                file_dir = "/"
-
-            if file_dir == path or file_path.startswith(path + '/'):
-                return True
-        return False
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        node = self._get_node(path)  #поиск узла за O(глубины)
+        return node is not None and node.is_dir  #узел существует и это директория
 
     def file_exists(self, path):
         """проверка существования файла"""
-        return path in self.files  #проверка наличия пути в словаре
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        return self._file_node(path) is not None  #проверка по дереву
 
     def read_file(self, path):
-        """чтение содержимого файла"""
-        return self.files.get(path, None)  #возвращаем содержимое файла или none
+        """чтение содержимого файла в байтах (для mmap образа - memoryview без копирования)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        node = self._file_node(path)  #узел файла
+        content = None if node is None else node.content  #содержимое файла или ссылка на него
+        if isinstance(content, _MappedContent):  #файл в отображенном образе
+            return content.view()  #memoryview на область образа
+        if isinstance(content, _LazyContent):  #файл загружен лениво
+            content = self._load_lazy(path, content)  #декодирование при первом обращении
+        return content  #возвращаем содержимое файла или none
+
+    read_file_bytes = read_file  #прежнее имя чтения в байтах
+
+    def read_text(self, path):
+        """содержимое файла в виде текста (только для вывода, неверные байты заменяются)"""
+        data = self.read_file(path)  #содержимое в байтах
+        return None if data is None else str(data, 'utf-8', errors='replace')
+
+    def is_binary(self, path):
+        """проверка начала файла: двоичные данные, а не текст в utf-8"""
+        span = self._content_span(self.resolve_path(path))  #содержимое файла
+        if span is None:  #файл не найден
+            return False
+        buf, start, end = span
+        stop = min(end, start + BINARY_SNIFF_SIZE)  #проверяется только начало файла
+        sample = bytes(buf[start:stop])
+        if b'\x00' in sample:  #нулевой байт в тексте не встречается
+            return True
+        try:  #символ, обрезанный границей образца, ошибкой не считается
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=stop == end)
+        except UnicodeDecodeError:
+            return True
+        return False
+
+    def _load_lazy(self, path, ref):
+        """получение лениво загружаемого содержимого через lru кэш"""
+        cache = self._content_cache  #lru кэш декодированного содержимого
+        if path in cache:  #попадание в кэш
+            cache.move_to_end(path)  #отмечаем как недавно использованное
+            return cache[path]
+        content = ref.load(self)  #чтение и декодирование из образа
+        if self.cache_size > 0:  #кэш включен
+            cache[path] = content  #сохраняем декодированное содержимое
+            if len(cache) > self.cache_size:  #кэш переполнен
+                cache.popitem(last=False)  #вытесняем самое старое содержимое
+        return content
+
+    def _content_span(self, path):
+        """содержимое файла как (буфер, начало, конец) для поиска без копирования"""
+        node = self._file_node(path)  #узел файла
+        content = None if node is None else node.content  #содержимое файла или ссылка на него
+        if isinstance(content, _MappedContent):  #поиск прямо в отображенном образе
+            return content.image, content.start, content.start + content.length
+        content = self.read_file(path)  #содержимое в байтах
+        if content is None:  #файл не найден
+            return None
+        return content, 0, len(content)
+
+    def _span_text(self, buf, start, end):
+        """текст участка буфера (декодирование только для вывода)"""
+        return str(buf[start:end], 'utf-8', errors='replace')  #копируется только нужный участок
 
     def get_file_head(self, path, lines=10):
-        """получение первых N строк файла"""
-        content = self.read_file(path)  #чтение содержимого файла
-        if content is None:  #если файл не найден
+        """получение первых N строк файла (просмотр только до N-го перевода строки)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        span = self._content_span(path)  #содержимое файла
+        if span is None:  #если файл не найден
             return None  #возвращаем None
-
-        file_lines = content.split('\n')  #разбиваем содержимое на строки
-        return '\n'.join(file_lines[:lines])  #возвращаем первые N строк
+        buf, start, end = span
+        if lines < 0:  #отрицательное число - все строки, кроме последних
+            file_lines = self._span_text(buf, start, end).split('\n')  #разбиваем содержимое на строки
+            return '\n'.join(file_lines[:lines])
+
+        newline = b'\n'  #разделитель строк
+        pos = start  #позиция поиска
+        for _ in range(lines):  #ищем только нужное число переводов строки
+            pos = buf.find(newline, pos, end)
+            if pos < 0:  #строк меньше, чем запрошено
+                return self._span_text(buf, start, end)
+            pos += 1
+        return self._span_text(buf, start, max(start, pos - 1))  #без последнего перевода строки
+
+    def get_file_tail(self, path, lines=10):
+        """получение последних N строк файла (просмотр с конца)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        span = self._content_span(path)  #содержимое файла
+        if span is None:  #если файл не найден
+            return None
+        buf, start, end = span
+        if lines <= 0:  #нечего выводить
+            return ""
+        newline = b'\n'  #разделитель строк
+        stop = end - 1 if end > start and buf[end - 1:end] == newline else end  #завершающий перевод строки не считается
+        pos = stop  #позиция поиска с конца
+        for _ in range(lines):  #ищем только нужное число переводов строки
+            pos = buf.rfind(newline, start, pos)
+            if pos < 0:  #строк меньше, чем запрошено
+                return self._span_text(buf, start, stop)
+        return self._span_text(buf, pos + 1, stop)
+
+    def get_file_lines(self, path, first, last):
+        """строки с first по last (с 1, включительно) через индекс смещений строк"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        span = self._content_span(path)  #содержимое файла
+        if span is None:  #если файл не найден
+            return None
+        buf, start, end = span
+        offsets = self._get_line_index(path, buf, start, end)  #смещения начал строк
+        first = max(first, 1)  #строки нумеруются с 1
+        if first > len(offsets) or last < first:  #диапазон за пределами файла
+            return ""
+        stop = offsets[last] - 1 if last < len(offsets) else end  #конец последней строки без перевода строки
+        return self._span_text(buf, offsets[first - 1], stop)
+
+    def get_line_count(self, path):
+        """число строк файла (по индексу смещений строк)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        span = self._content_span(path)  #содержимое файла
+        if span is None:  #если файл не найден
+            return None
+        return len(self._get_line_index(path, *span))
+
+    def _get_line_index(self, path, buf, start, end):
+        """смещения начал строк файла (строится при первом обращении и кэшируется)"""
+        index = self._line_index  #lru кэш индексов
+        if path in index:  #индекс уже построен
+            index.move_to_end(path)  #отмечаем как недавно использованный
+            return index[path]
+        newline = b'\n'  #разделитель строк
+        offsets = array('Q', [start])  #первая строка начинается с начала содержимого
+        pos = buf.find(newline, start, end)
+        while pos >= 0:  #один проход по содержимому
+            offsets.append(pos + 1)  #следующая строка начинается после перевода строки
+            pos = buf.find(newline, pos + 1, end)
+        index[path] = offsets
+        if len(index) > LINE_INDEX_CACHE_SIZE:  #кэш переполнен
+            index.popitem(last=False)  #вытесняем самый старый индекс
+        return offsets
+
+    def get_line_window(self, path, first, last, column, width):
+        """строки с first по last (с 1): не больше width символов, начиная с байта column (длинная строка
+        целиком не читается и не декодируется); (строки, длина самой длинной из них в байтах)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        span = self._content_span(path)  #содержимое файла
+        if span is None:  #если файл не найден
+            return None
+        buf, start, end = span
+        offsets = self._get_line_index(path, buf, start, end)  #смещения начал строк
+        rows, longest = [], 0
+        for line in range(max(first, 1), min(last, len(offsets)) + 1):
+            line_start = offsets[line - 1]
+            line_end = offsets[line] - 1 if line < len(offsets) else end  #без перевода строки
+            longest = max(longest, line_end - line_start)
+            pos = line_start + column
+            while pos < line_end and buf[pos] & 0xC0 == 0x80:  #начало окна не режет символ utf-8
+                pos += 1
+            stop = min(line_end, pos + width * 4)  #символ utf-8 занимает не больше 4 байт
+            rows.append(str(buf[pos:stop], 'utf-8', errors='replace')[:width])
+        return rows, longest
+
+    def read_file_range(self, path, start, end):
+        """байты содержимого файла с start по end (end не включается)"""
+        data = self.read_file(path)  #содержимое в байтах (для mmap - срез без копирования)
+        if data is None:  #если файл не найден
+            return None
+        return bytes(data[start:end])  #копируется только запрошенный участок
+
+    def iter_hexdump(self, path, offset=0, length=None):
+        """строки шестнадцатеричного дампа файла (как hexdump -C), выдаются по мере чтения"""
+        data = self.read_file(path)  #содержимое в байтах (для mmap - срез без копирования)
+        if data is None:  #если файл не найден
+            return
+        view = memoryview(data)  #срезы строк без копирования всего файла
+        end = len(view) if length is None else min(len(view), offset + length)  #конец дампа
+        for pos in range(offset, end, HEXDUMP_WIDTH):  #по строке на HEXDUMP_WIDTH байт
+            row = bytes(view[pos:min(pos + HEXDUMP_WIDTH, end)])
+            yield f"{pos:08x}  {row.hex(' '):<{HEXDUMP_WIDTH * 3 - 1}}  |{row.translate(_HEXDUMP_TEXT).decode('ascii')}|"
+        yield f"{max(end, offset):08x}"  #итоговое смещение
+
+    def iter_find(self, path="/", pattern=None, kind=None):
+        """поиск путей в поддереве: pattern - шаблон имени, kind - 'f' или 'd'"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        start = self._get_node(path)  #стартовый узел
+        if start is None:  #нет такого пути
+            return
+
+        def matches(name, node):  #проверка условий поиска
+            if kind == 'f' and node.is_dir or kind == 'd' and not node.is_dir:
+                return False
+            return pattern is None or fnmatch.fnmatchcase(name, pattern)
+
+        if matches(start.name or '/', start):  #сам стартовый путь, как в find
+            yield path
+        for child_path, node in self._walk(path):  #ленивый обход поддерева
+            if matches(node.name, node):
+                yield child_path
+
+    def iter_du(self, path="/", summarize=False):
+        """размеры директорий поддерева (потомки раньше родителей): пары (размер, путь)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        start = self._get_node(path)  #стартовый узел
+        if start is None:  #нет такого пути
+            return
+        if summarize or not start.is_dir:  #только итоговый размер
+            yield self._subtree_size(path, start), path
+            return
+        stack = [(path, start, False)]  #явный стек обхода
+        while stack:
+            dir_path, node, done = stack.pop()
+            if done:  #все поддиректории уже посчитаны
+                node.size = sum(child.size if child.is_dir else self._subtree_size(self._join(dir_path, name), child)
+                                for name, child in node.children.items())
+                yield node.size, dir_path
+                continue
+            stack.append((dir_path, node, True))  #вернемся к директории после потомков
+            for name, child in sorted(node.children.items(), reverse=True):
+                if child.is_dir:
+                    stack.append((self._join(dir_path, name), child, False))
+
+    def _subtree_size(self, path, node):
+        """размер узла в байтах с кэшированием размеров директорий"""
+        if node.size is not None:  #размер уже известен
+            return node.size
+        stack = [(path, node, False)]  #явный стек обхода
+        while stack:
+            node_path, current, done = stack.pop()
+            if current.size is not None:  #размер поддерева в кэше
+                continue
+            if not current.is_dir:  #размер файла
+                current.size = self._content_size(node_path, current.content)
+            elif done:  #потомки посчитаны
+                current.size = sum(child.size for child in current.children.values())
+            else:  #сначала считаем потомков
+                stack.append((node_path, current, True))
+                stack.extend((self._join(node_path, name), child) + (False,)
+                             for name, child in current.children.items() if child.size is None)
+        return node.size
+
+    def _file_size(self, path):
+        """размер содержимого файла в байтах"""
+        node = self._file_node(path)  #узел файла
+        return 0 if node is None else self._content_size(path, node.content)
+
+    def _content_size(self, path, content):
+        """размер содержимого в байтах (ленивое содержимое читается через кэш)"""
+        if isinstance(content, _MappedContent):  #размер известен из таблицы образа
+            return content.length
+        if isinstance(content, _LazyContent):  #ленивый файл: размер посчитан при индексации
+            if content.size is not None:
+                return content.size
+            content = self._load_lazy(path, content)  #base64 необычного вида - размер по содержимому
+        return len(content) if content else 0
+
+    def _invalidate_size(self, node):
+        """сброс кэша размеров и хешей меркла узла и всех его предков"""
+        while node is not None:  #подъем к корню
+            node.size = None
+            if node.digest is not None:
+                self._digest_count -= 1
+                node.digest = None
+            node = node.parent
+
+    def _subtree_digest(self, path, node):
+        """хеш меркла узла; пересчитываются только узлы, сброшенные изменениями"""
+        if node.digest is not None:  #хеш уже известен
+            return node.digest
+        stack = [(path, node, False)]  #явный стек обхода
+        while stack:
+            node_path, current, done = stack.pop()
+            if current.digest is not None:  #хеш поддерева в кэше
+                continue
+            if not current.is_dir:  #хеш содержимого файла
+                self._set_digest(current, self._content_digest(current))
+            elif done:  #хеши потомков посчитаны
+                self._set_digest(current, self._directory_digest(current))
+            else:  #сначала считаем потомков
+                stack.append((node_path, current, True))
+                stack.extend((self._join(node_path, name), child) + (False,)
+                             for name, child in current.children.items() if child.digest is None)
+        return node.digest
+
+    def _set_digest(self, node, digest):
+        """установка хеша меркла узла с учетом числа хешей в памяти"""
+        self._digest_count += (digest is not None) - (node.digest is not None)
+        node.digest = digest
+
+    def _content_digest(self, node):
+        """sha-256 содержимого файла (ленивое содержимое читается мимо lru кэша)"""
+        content = node.content
+        if isinstance(content, (_LazyContent, _MappedContent)):
+            content = content.load(self)
+        return hashlib.sha256(content).digest()
+
+    def _directory_digest(self, node):
+        """sha-256 директории: ее права и отсортированные (имя, тип, права файла, хеш) потомков"""
+        hasher = hashlib.sha256(b'D%03o' % node.mode)
+        for name in sorted(node.children):
+            child = node.children[name]
+            hasher.update(name.encode('utf-8') + b'\0')  #имя не может содержать \0
+            hasher.update(b'd' if child.is_dir else b'f%03o' % child.mode)  #права директории входят в ее хеш
+            hasher.update(child.digest)
+        return hasher.digest()
+
+    def merkle_hash(self, path="/"):
+        """хеш меркла поддерева (hex); после полного пересчета неизмененного образа хеши сохраняются рядом с ним"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        node = self._get_node(path)  #узел поддерева
+        if node is None:  #нет такого пути
+            return None
+        computed = self.tree.digest is None  #корень будет пересчитан
+        digest = self._subtree_digest(path, node)
+        if computed and self.tree.digest is not None:  #все дерево посчитано
+            self._store_merkle()
+        return digest.hex()
+
+    def _store_merkle(self):
+        """запись хешей всех узлов (корень и далее в порядке обхода _walk - по именам, а не по порядку потомков,
+        который меняется при откате снимка) в файл-спутник"""
+        if self._modified or not self._source_key:  #хеши соответствуют образу только без изменений
+            return
+        try:
+            with open(self._source_key["path"] + MERKLE_CACHE_SUFFIX, 'wb') as f:
+                f.write(json.dumps(dict(self._source_key, order="path")).encode('utf-8') + b"\n")  #ключ образа и порядок
+                f.write(self.tree.digest)
+                for _, node in self._walk():  #по 32 байта на узел
+                    f.write(node.digest)
+        except OSError:  #директория образа недоступна на запись - работаем без кэша
+            pass
+
+    def _restore_merkle(self):
+        """хеши узлов из файла-спутника, если образ не изменился (diff и verify не читают содержимое заново)"""
+        try:
+            with open(self._source_key["path"] + MERKLE_CACHE_SUFFIX, 'rb') as f:
+                if json.loads(f.readline()) != dict(self._source_key, order="path"):  #образ изменился (или старый порядок)
+                    return
+                data = f.read()  #хеши узлов подряд
+        except (OSError, ValueError):  #кэша нет или он поврежден
+            return
+        nodes = [self.tree]
+        nodes.extend(node for _, node in self._walk())  #тот же порядок, что при записи
+        size = hashlib.sha256().digest_size
+        if len(data) != size * len(nodes):  #число узлов не совпадает
+            return
+        for i, node in enumerate(nodes):
+            self._set_digest(node, data[i * size:(i + 1) * size])
+
+    def verify(self, path="/"):
+        """пересчет хешей файлов поддерева по содержимому и сравнение с кэшем; (хеш, несовпавшие пути, файлов)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        node = self._get_node(path)  #узел поддерева
+        if node is None:  #нет такого пути
+            return None
+        mismatched = []  #файлы, содержимое которых не совпало с хешем или не читается
+        checked = 0  #число проверенных файлов
+        readable = True  #все файлы прочитаны - хеш поддерева можно посчитать
+        for file_path, child in (self._walk(path) if node.is_dir else [(path, node)]):
+            if child.is_dir:
+                continue
+            checked += 1
+            try:
+                digest = self._content_digest(child)  #содержимое читается заново (для ленивых - из образа)
+            except (OSError, ET.ParseError):  #образ изменился на диске и элемент не читается
+                digest = None
+                readable = False
+            if digest is None or (child.digest is not None and digest != child.digest):
+                mismatched.append(file_path)
+                self._forget_content(file_path)  #кэши прежнего содержимого
+                self._invalidate_size(child)  #хеши предков пересчитаются
+            self._set_digest(child, digest)
+        return (self.merkle_hash(path) if readable else None), mismatched, checked
+
+    def diff(self, other_path):
+        """сравнение с другим образом по хешам меркла; (успех, итератор различий или сообщение)"""
+        other = VFS(lazy=True, cache_size=0)  #содержимое другого образа читается только для хеширования
+        success, message = other.load(other_path)
+        if not success:
+            return False, message
+        self.merkle_hash()  #хеши обоих деревьев (из кэша или пересчет)
+        other.merkle_hash()
+        return True, self._iter_diff(other)
+
+    def _iter_diff(self, other):
+        """различия деревьев (знак, путь, подробности): спуск только в директории с разными хешами"""
+        if self.tree.digest == other.tree.digest:  #деревья совпадают
+            return
+        stack = [(self.root, self.tree, other.tree)]  #пары отличающихся директорий
+        while stack:
+            path, mine, theirs = stack.pop()
+            if mine.mode != theirs.mode:
+                yield '~', path, f"права {mine.mode:03o} -> {theirs.mode:03o}"
+            subdirs = []  #отличающиеся поддиректории
+            for name in sorted(mine.children.keys() | theirs.children.keys()):
+                child_path = self._join(path, name)
+                a, b = mine.children.get(name), theirs.children.get(name)
+                if b is None:
+                    yield '-', child_path, "директория" if a.is_dir else "файл"
+                elif a is None:
+                    yield '+', child_path, "директория" if b.is_dir else "файл"
+                elif a.is_dir != b.is_dir:
+                    yield '~', child_path, "директория -> файл" if a.is_dir else "файл -> директория"
+                elif a.is_dir:
+                    if a.digest != b.digest:  #совпадающие поддеревья пропускаются целиком
+                        subdirs.append((child_path, a, b))
+                else:
+                    changes = []  #что отличается у файла
+                    if a.digest != b.digest:
+                        changes.append("содержимое")
+                    if a.mode != b.mode:
+                        changes.append(f"права {a.mode:03o} -> {b.mode:03o}")
+                    if changes:
+                        yield '~', child_path, ', '.join(changes)
+            stack.extend(reversed(subdirs))  #поддиректории по алфавиту
+
+    def iter_tree(self, path="/", max_depth=None):
+        """строки дерева директорий (как утилита tree) с ограничением глубины"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        start = self._get_node(path)  #стартовый узел
+        if start is None:  #нет такого пути
+            return
+        yield path  #корень дерева
+        dirs = files = 0  #счетчики для итоговой строки
+        stack = [(self._tree_entries(start), "", 1)]  #стек (потомки, отступ, глубина)
+        while stack:
+            entries, prefix, depth = stack[-1]  #текущий уровень
+            entry = next(entries, None)  #следующий потомок
+            if entry is None:  #уровень закончился
+                stack.pop()
+                continue
+            name, node, last = entry
+            yield prefix + ("└── " if last else "├── ") + name  #строка потомка
+            if node.is_dir:
+                dirs += 1
+                if max_depth is None or depth < max_depth:  #спускаемся, пока не достигнут лимит
+                    stack.append((self._tree_entries(node), prefix + ("    " if last else "│   "), depth + 1))
+            else:
+                files += 1
+        yield f"директорий: {dirs}, файлов: {files}"  #итоговая строка
+
+    def _tree_entries(self, node):
+        """потомки директории для tree: сначала директории, затем файлы, по алфавиту"""
+        if not node.is_dir:  #у файла нет потомков
+            return
+        items = sorted(node.children.items(), key=lambda item: (not item[1].is_dir, item[0]))
+        for index, (name, child) in enumerate(items):
+            yield name, child, index == len(items) - 1  #флаг последнего потомка
+
+    def iter_grep(self, pattern, path="/", recursive=False, ignore_case=False):
+        """поиск строки в содержимом файлов: тройки (путь, номер строки, строка)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        start = self._get_node(path)  #стартовый узел
+        if start is None or start.is_dir and not recursive:  #директории просматриваются только с -r
+            return
+        if not start.is_dir:  #поиск в одном файле
+            paths = [path]
+        else:  #кандидаты из индекса внутри директории
+            candidates = self._grep_candidates(pattern)  #файлы, содержащие все n-граммы шаблона
+            prefix = "/" if path == "/" else path + "/"  #префикс путей поддерева
+            if candidates is None:  #шаблон короче n-граммы - индекс не помогает
+                paths = (file_path for file_path, node in self._walk(path) if not node.is_dir)
+            else:
+                paths = sorted(file_path for file_path in candidates if file_path.startswith(prefix))
+
+        needle = pattern.casefold() if ignore_case else pattern  #искомая строка
+        for file_path in paths:  #проверка кандидатов по содержимому
+            if self.is_binary(file_path):  #двоичные файлы построчно не просматриваются
+                continue
+            content = self.read_text(file_path)  #содержимое файла как текст
+            if not content:
+                continue
+            for line_num, line in enumerate(content.split('\n'), 1):  #поиск по строкам
+                if needle in (line.casefold() if ignore_case else line):
+                    yield file_path, line_num, line
+
+    def _grep_candidates(self, pattern):
+        """пути файлов, которые могут содержать шаблон (None - индекс неприменим)"""
+        if len(pattern) < GREP_NGRAM:  #слишком короткий шаблон
+            return None
+        if self._grep_index is None:  #индекс строится при первом поиске
+            self._build_grep_index()
+        text = pattern.casefold()  #индекс не зависит от регистра
+        grams = {text[i:i + GREP_NGRAM] for i in range(len(text) - GREP_NGRAM + 1)}  #n-граммы шаблона
+        postings = sorted((self._grep_index.get(gram, set()) for gram in grams), key=len)  #от редких к частым
+        result = set(postings[0])  #пересечение начинаем с самого короткого списка
+        for paths in postings[1:]:
+            if not result:  #кандидатов не осталось
+                break
+            result &= paths
+        return list(result)
+
+    def _build_grep_index(self):
+        """построение инвертированного индекса n-грамм по содержимому всех файлов"""
+        self._grep_index = {}  #n-грамма -> пути файлов
+        self._grep_grams = {}
+        for file_path in self.files:  #перебор всех файлов в порядке образа
+            self._index_file(file_path)
+
+    def _index_file(self, path):
+        """добавление n-грамм содержимого файла в индекс (двоичные файлы в индекс не попадают)"""
+        if self.is_binary(path):
+            return
+        text = (self.read_text(path) or "").casefold()  #содержимое без учета регистра
+        grams = {text[i:i + GREP_NGRAM] for i in range(len(text) - GREP_NGRAM + 1)}
+        for gram in grams:
+            self._grep_index.setdefault(gram, set()).add(path)
+        self._grep_grams[path] = grams
+
+    def _reindex_file(self, path):
+        """обновление индекса n-грамм после изменения одного файла: O(его содержимого), а не всего образа"""
+        for gram in self._grep_grams.pop(path, ()):  #прежние n-граммы файла
+            paths = self._grep_index[gram]
+            paths.discard(path)
+            if not paths:
+                del self._grep_index[gram]
+        if self._file_node(path) is None:  #файл удален
+            return
+        try:
+            self._index_file(path)  #новое содержимое
+        except (OSError, ET.ParseError):  #содержимое не читается (образ изменился на диске) - файл вне индекса
+            pass
 
     def get_info(self):
         """получение информации о vfs"""
@@ -164,15 +1475,59 @@ class VFS:
 
         file_count = len(self.files)  #количество файлов
         dir_count = len(self.directories)  #количество директорий
+        metadata, content = self.memory_usage()  #оценка занимаемой памяти
+        layers = ""  #строка со слоями, если образ собран из нескольких
+        if len(self.layers) > 1:
+            layers = f"слои: {', '.join(os.path.basename(path) for path in self.layers)}\n"
 
         return (f"имя vfs: {self.name}\n"  #форматированная информация о vfs
                 f"хэш sha-256: {self.sha256_hash}\n"
                 f"файлов: {file_count}\n"
                 f"директорий: {dir_count}\n"
+                f"хранилище: {self.backend}\n"
+                f"{layers}"
+                f"память: метаданные {metadata / 1024:.1f} КБ, содержимое {content / 1024:.1f} КБ\n"
                 f"статус: загружена")
 
+    def memory_usage(self):
+        """оценка памяти в байтах: (узлы, имена, карты потомков и хеши; содержимое в памяти);
+        итоги ведутся при добавлении и удалении узлов, обход дерева не нужен (имя считается у каждого узла)"""
+        metadata = self._metadata_bytes + self._digest_count * _DIGEST_MEMORY
+        content = self._content_bytes + sum(sys.getsizeof(data) for data in self._content_cache.values())  #lru кэш
+        return metadata, content
+
+    def _count_node(self, node, sign, children_before):
+        """учет памяти узла, добавленного (sign=1) или удаленного (sign=-1) из карты потомков родителя;
+        children_before - размер этой карты до изменения"""
+        metadata = _NODE_MEMORY + sys.getsizeof(node.name)
+        content = 0
+        if node.is_dir:
+            metadata += sys.getsizeof(node.children)
+        else:
+            content_metadata, content = self._content_memory(node.content)
+            metadata += content_metadata
+        self._metadata_bytes += sign * metadata + sys.getsizeof(node.parent.children) - children_before
+        self._content_bytes += sign * content
+        if node.digest is not None:
+            self._digest_count += sign
+
+    def _content_memory(self, content):
+        """память содержимого файла: (метаданные, содержимое в памяти)"""
+        if isinstance(content, bytes):  #содержимое в памяти
+            return 0, sys.getsizeof(content)
+        return sys.getsizeof(content), 0  #ссылка на образ (mmap или xml)
+
+    def _replace_content(self, node, content):
+        """замена содержимого узла файла с учетом памяти (без записи в журнал)"""
+        old_metadata, old_content = self._content_memory(node.content)
+        new_metadata, new_content = self._content_memory(content)
+        self._metadata_bytes += new_metadata - old_metadata
+        self._content_bytes += new_content - old_content
+        node.content = content
+
     def chmod(self, path, mode):
         """изменение прав доступа для файла или директории"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
         if not self._path_exists(path):  #проверка существования пути
             return False, f"ошибка: путь не существует: {path}"  #возврат ошибки
 
@@ -180,30 +1535,338 @@ class VFS:
         if not self._is_valid_mode(mode):  #проверка валидности режима
             return False, f"ошибка: неверный формат прав доступа: {mode}"  #возврат ошибки
 
-        self.file_permissions[path] = mode  #установка новых прав доступа
+        self._set_permission(path, mode)  #установка новых прав доступа (с записью в журнал)
         return True, f"права доступа для '{path}' изменены на {mode}"  #возврат успеха
 
     def rmdir(self, path):
         """удаление директории"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
         if path == "/":  #проверка попытки удаления корневой директории
             return False, "ошибка: невозможно удалить корневую директорию"  #возврат ошибки
 
-        if path not in self.directories:  #проверка существования директории
+        node = self._get_node(path)  #узел удаляемой директории
+        if node is None or not node.is_dir:  #проверка существования директории
             return False, f"ошибка: директория не существует: {path}"  #возврат ошибки
 
         #Проверка, что директория пуста
-        if not self._is_directory_empty(path):  #проверка пустоты директории
+        if node.children:  #проверка пустоты директории
             return False, f"ошибка: директория не пуста: {path}"  #возврат ошибки
 
-        self.directories.remove(path)  #удаление директории из множества
-        if path in self.file_permissions:  #удаление прав доступа
-            del self.file_permissions[path]  #удаление записи о правах
-
+        self._detach(path, node)  #удаление узла из дерева (с записью в журнал)
         return True, f"директория '{path}' успешно удалена"  #возврат успеха
 
+    def _check_new_path(self, path):
+        """проверка, что путь свободен и его родитель - директория (None - можно создавать)"""
+        if path == "/" or self._path_exists(path):  #путь уже занят
+            return f"ошибка: путь уже существует: {path}"
+        parent_path = path.rpartition('/')[0] or "/"  #родительская директория
+        if not self.directory_exists(parent_path):  #некуда создавать
+            return f"ошибка: директория не существует: {parent_path}"
+        return None
+
+    def touch(self, path):
+        """создание пустого файла (существующий файл не меняется)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        if path in self.files:  #файл уже есть
+            return True, f"файл '{path}' уже существует"
+        error = self._check_new_path(path)  #проверка пути
+        if error:
+            return False, error
+        self._attach(path, False)  #пустой файл
+        return True, f"файл '{path}' создан"
+
+    def mkdir(self, path, parents=False):
+        """создание директории (parents - вместе с недостающими родителями)"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        if parents and path in self.directories:  #с -p существующая директория не ошибка
+            return True, f"директория '{path}' уже существует"
+        if parents:  #создаем недостающих родителей по очереди
+            current = ""  #текущий собираемый путь
+            for part in self._split_path(path)[:-1]:
+                current += '/' + part
+                if current in self.files:  #на пути файл
+                    return False, f"ошибка: не является директорией: {current}"
+                if current not in self.directories:
+                    self._attach(current, True)
+        error = self._check_new_path(path)  #проверка пути
+        if error:
+            return False, error
+        self._attach(path, True)
+        return True, f"директория '{path}' создана"
+
+    def remove(self, path, recursive=False):
+        """удаление файла или (recursive) директории со всем содержимым"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        if path == "/":  #проверка попытки удаления корневой директории
+            return False, "ошибка: невозможно удалить корневую директорию"
+        node = self._get_node(path)  #узел удаляемого элемента
+        if node is None:  #нет такого пути
+            return False, f"ошибка: путь не существует: {path}"
+        if node.is_dir and not recursive:  #директория без -r
+            return False, f"ошибка: {path} - директория (используйте -r)"
+        removed = self._detach(path, node)  #число удаленных элементов
+        return True, f"'{path}' удален (элементов: {removed})"
+
+    def write_file(self, path, data, append=False):
+        """запись байт в файл (создается при отсутствии), append - дописывание в конец"""
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        if path in self.directories:  #запись в директорию
+            return False, f"ошибка: {path} - директория"
+        if path not in self.files:  #новый файл
+            error = self._check_new_path(path)  #проверка пути
+            if error:
+                return False, error
+            self._attach(path, False, bytes(data))
+        else:  #существующий файл: прежнее содержимое уходит в журнал
+            self._set_content(path, bytes(self.read_file(path)) + data if append else bytes(data))
+        return True, f"файл '{path}' записан ({self._file_size(path)} байт)"
+
+    def save_xml(self, xml_path=None):
+        """сохранение vfs в xml потоковой записью (хеш считается по мере записи)"""
+        if not self.loaded:  #проверка загрузки vfs
+            return False, "vfs не загружена"
+        target = os.path.abspath(xml_path) if xml_path else self._source_path  #куда сохранять
+        if target is None:
+            return False, "ошибка: укажите путь для сохранения"
+        try:
+            with open(target, 'rb') as f:  #бинарный образ xml не перезаписывается
+                if f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC:
+                    return False, f"ошибка: {target} - бинарный образ, укажите другой путь для xml"
+        except OSError:  #файла еще нет
+            pass
+
+        #ленивые ссылки на перезаписываемый xml после сохранения указывают на новые смещения
+        rebind = any(isinstance(node.content, _LazyContent) and os.path.abspath(node.content.source.path) == target
+                     for _, node in self._iter_nodes())
+        if rebind:  #содержимое из журнала в новом файле не окажется - читаем его заранее
+            self._materialize_journal()
+        offsets = {}  #узел файла -> (начало, конец) элемента в новом xml
+        temp_path = target + '.tmp'  #запись во временный файл и атомарная замена
+        try:
+            with open(temp_path, 'wb') as f:
+                count, digest = self._write_xml(f, offsets if rebind else None)
+            os.replace(temp_path, target)
+        except OSError as e:  #ошибка записи - исходный файл не тронут
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False, f"ошибка сохранения vfs: {e}"
+
+        if rebind:  #переназначаем ленивые ссылки на новый файл
+            source = _XmlSource(target)
+            for node, (start, end) in offsets.items():
+                if isinstance(node.content, _LazyContent):
+                    node.content = _LazyContent(source, start, end, node.content.size)
+        self.sha256_hash = digest  #хеш посчитан при записи
+        self._source_path = target  #vfs теперь совпадает с сохраненным файлом
+        self._source_key = self._image_key(target)
+        self.layers = [target]  #слои слиты в один файл
+        self._layers_key = None
+        self._clean_state = self._state
+        self._modified = False
+        return True, f"vfs '{self.name}' сохранена в {target} (элементов: {count})"
+
+    def _materialize_journal(self):
+        """замена ленивых ссылок в журнале на байты (перед перезаписью исходного xml)"""
+        for i, entry in enumerate(self._journal):
+            if entry[0] == 'detach':  #удаленный узел: файлы всего поддерева
+                for _, node in self._iter_subtree(entry[1], entry[2]):
+                    if isinstance(node.content, _LazyContent):
+                        node.content = node.content.load(self)
+            elif entry[0] == 'content' and isinstance(entry[2], _LazyContent):  #прежнее содержимое
+                self._journal[i] = entry[:2] + (entry[2].load(self),)
+
+    def _write_xml(self, raw, offsets=None):
+        """запись дерева в xml в исходном порядке элементов (явный стек вместо рекурсии); (элементов, sha-256)"""
+        writer = XmlImageWriter(raw, self.name, self.tree.mode)
+        count = 0  #число записанных элементов
+        stack = [(self.root, iter(self.tree.children.values()))]  #(путь, потомки)
+        while stack:
+            dir_path, children = stack[-1]
+            child = next(children, None)  #очередной потомок
+            if child is None:  #директория записана целиком
+                stack.pop()
+                if stack:
+                    writer.close_directory()
+                continue
+            count += 1
+            path = self._join(dir_path, child.name)  #путь потомка
+            if child.is_dir:  #директория: потомки пишутся следующими итерациями
+                writer.open_directory(child.name, child.mode)
+                stack.append((path, iter(child.children.values())))
+                continue
+            span = writer.write_file(child.name, self.read_file(path), child.mode)  #текст или base64 блоками
+            if offsets is not None:
+                offsets[child] = span  #смещения как у ленивого загрузчика
+        return count, writer.close()
+
+    def _record(self, *entry):
+        """учет изменения; в журнал отмены оно пишется, только если есть снимок, к которому можно вернуться"""
+        self._changes += 1
+        self._state = self._changes  #новое состояние не совпадает ни с одним прежним
+        self._modified = True  #vfs отличается от образа
+        if self._snapshots:
+            self._journal.append(entry)  #запись для отката изменения
+
+    def _set_permission(self, path, mode):
+        """установка прав доступа с записью прежнего значения в журнал"""
+        node = self._get_node(path)  #узел с правами
+        self._record('perm', path, node.mode)  #прежние права
+        node.mode = int(mode, 8)  #новые права числом
+        self._invalidate_size(node if node.is_dir else node.parent)  #права файла входят в хеш директории
+
+    def _detach(self, path, node):
+        """отцепление узла вместе с поддеревом с записью в журнал (поддерево остается в узле, откат возвращает его
+        на прежнее место среди соседей); число удаленных элементов"""
+        index = None  #место узла в порядке потомков родителя
+        if self._snapshots:  #журнал ведется - место нужно для отката
+            index = next(i for i, name in enumerate(node.parent.children) if name == node.name)
+        self._record('detach', path, node, index)  #содержимое и права остаются в самих узлах
+        return self._unlink(path, node)
+
+    def _iter_subtree(self, path, node):
+        """узел и все его потомки (в том числе отцепленные от дерева): пары (путь, узел)"""
+        stack = [(path, node)]  #явный стек вместо рекурсии
+        while stack:
+            node_path, current = stack.pop()
+            yield node_path, current
+            if current.is_dir:
+                stack.extend((self._join(node_path, name), child) for name, child in current.children.items())
+
+    def _unlink(self, path, node):
+        """удаление узла с поддеревом из дерева (без записи в журнал); число удаленных элементов"""
+        before = sys.getsizeof(node.parent.children)
+        del node.parent.children[node.name]  #удаление узла из дерева
+        removed = self._count_subtree(path, node, -1, before)
+        self._invalidate_size(node.parent)  #размеры предков изменились (кэши поддерева остаются верными)
+        return removed
+
+    def _link(self, path, node, index=None):
+        """возврат узла с поддеревом в дерево (без записи в журнал); index - место среди потомков родителя"""
+        children = node.parent.children
+        before = sys.getsizeof(children)
+        tail = []  #потомки, которые должны идти после узла
+        if index is not None and index < len(children):
+            tail = [(name, children.pop(name)) for name in list(itertools.islice(children, index, None))]
+        children[node.name] = node  #узел снова в дереве (вместе с поддеревом)
+        children.update(tail)  #порядок потомков как до удаления (его сохраняет save)
+        self._count_subtree(path, node, 1, before)
+        self._invalidate_size(node.parent)  #размеры предков изменились
+
+    def _count_subtree(self, path, node, sign, children_before):
+        """учет счетчиков, памяти и кэшей содержимого поддерева, добавленного (sign=1) или удаленного (sign=-1);
+        children_before - размер карты потомков родителя до изменения; число узлов поддерева"""
+        count = 0
+        for node_path, current in self._iter_subtree(path, node):
+            if current is node:  #размер изменился только у карты потомков родителя верхнего узла
+                self._count_node(current, sign, children_before)
+            else:
+                self._count_node(current, sign, sys.getsizeof(current.parent.children))
+            if current.is_dir:
+                self._dir_count += sign
+            else:
+                self._file_count += sign
+                self._forget_content(node_path)  #кэши содержимого файла
+            count += 1
+        return count
+
+    def _attach(self, path, is_dir, content=b""):
+        """создание узла в существующей директории с записью в журнал"""
+        parent_path, _, name = path.rpartition('/')  #разделяем путь на директорию и имя
+        parent = self._get_node(parent_path or self.root)  #родитель должен существовать
+        self._link(path, VFSNode(name, is_dir, parent, None if is_dir else content))  #права по умолчанию
+        self._record('attach', path)
+
+    def _set_content(self, path, content):
+        """замена содержимого существующего файла с записью прежнего в журнал"""
+        node = self._get_node(path)  #узел файла
+        self._record('content', path, node.content)  #прежнее содержимое (или ссылка на него)
+        self._replace_content(node, content)
+        self._forget_content(path)  #кэши прежнего содержимого
+        self._invalidate_size(node)
+
+    def _forget_content(self, path):
+        """сброс кэшей, зависящих от содержимого файла"""
+        self._content_cache.pop(path, None)  #декодированное содержимое
+        self._line_index.pop(path, None)  #индекс смещений строк
+        if self._grep_index is not None:  #индекс уже построен - обновляется только этот файл
+            self._reindex_file(path)
+
+    def _undo(self, entry):
+        """откат одной записи журнала (без записи в журнал)"""
+        kind, path = entry[0], entry[1]
+        if kind == 'perm':  #изменение прав
+            node = self._get_node(path)
+            node.mode = entry[2]
+            self._invalidate_size(node if node.is_dir else node.parent)
+        elif kind == 'detach':  #удаленный узел возвращается на место
+            self._link(path, entry[2], entry[3])
+        elif kind == 'attach':  #созданный узел удаляется
+            self._unlink(path, self._get_node(path))
+        elif kind == 'content':  #возвращается прежнее содержимое
+            node = self._get_node(path)
+            self._replace_content(node, entry[2])
+            self._forget_content(path)
+            self._invalidate_size(node)
+        elif kind == 'layers':  #отключение слоя: узлы вернули предыдущие записи, здесь - описание слоев
+            self.layers, self._sha256_hash, self._source_path, self._source_key = entry[2:]
+
+    def snapshot_save(self, name):
+        """сохранение снимка состояния: запоминается только текущая длина журнала"""
+        if not self.loaded:  #проверка загрузки vfs
+            return False, "vfs не загружена"
+        self._snapshots[name] = (len(self._journal), self._state)  #O(1) - данные не копируются
+        self._trim_journal()  #снимок с тем же именем мог быть самым старым
+        return True, f"снимок '{name}' сохранен (изменений с загрузки: {self._changes})"
+
+    def snapshot_restore(self, name):
+        """откат к снимку за O(изменений после него)"""
+        if name not in self._snapshots:  #нет такого снимка
+            return False, f"ошибка: снимок не найден: {name}"
+        position, self._state = self._snapshots[name]  #длина журнала и состояние в момент снимка
+        undone = len(self._journal) - position  #число откатываемых изменений
+        while len(self._journal) > position:  #откат в обратном порядке
+            self._undo(self._journal.pop())
+        for other, (other_position, _) in list(self._snapshots.items()):  #снимки из отмененной ветки
+            if other_position > position:
+                del self._snapshots[other]
+        self._modified = self._state != self._clean_state  #vfs снова может совпадать с образом
+        self._trim_journal()
+        return True, f"состояние восстановлено из снимка '{name}' (отменено изменений: {undone})"
+
+    def snapshot_drop(self, name):
+        """удаление снимка; записи журнала старше оставшихся снимков освобождаются"""
+        if self._snapshots.pop(name, None) is None:  #нет такого снимка
+            return False, f"ошибка: снимок не найден: {name}"
+        self._trim_journal()
+        return True, f"снимок '{name}' удален"
+
+    def _trim_journal(self):
+        """удаление записей журнала до самого старого снимка (удаленные узлы и прежнее содержимое освобождаются)"""
+        oldest = min((position for position, _ in self._snapshots.values()), default=len(self._journal))
+        if oldest:
+            del self._journal[:oldest]
+            for other, (position, state) in self._snapshots.items():  #позиции отсчитываются от нового начала
+                self._snapshots[other] = (position - oldest, state)
+
+    def snapshot_list(self):
+        """имена снимков в порядке сохранения"""
+        return sorted((name for name in self._snapshots if name is not None), key=lambda name: self._snapshots[name][0])
+
+    def checkpoint(self):
+        """скрытый снимок (имя None, в snapshot list не виден): пакетный режим откатывает к нему изменения скрипта"""
+        self.snapshot_save(None)
+
+    def rollback(self):
+        """откат к скрытому снимку; снимки, сохраненные после него, и журнал удаляются"""
+        self.snapshot_restore(None)
+        self._snapshots.clear()  #снимки скрипта относятся к отмененным изменениям
+        self._journal.clear()
+
     def _path_exists(self, path):
         """проверка существования пути (файла или директории)"""
-        return path in self.files or path in self.directories or self.directory_exists(path)  #комбинированная проверка
+        return self._get_node(path) is not None  #проверка по дереву
 
     def _is_valid_mode(self, mode):
         """проверка валидности формата прав доступа"""
@@ -218,136 +1881,190 @@ class VFS:
 
     def _is_directory_empty(self, path):
         """проверка, что директория пуста"""
-        #Проверяем файлы в этой директории
-        for file_path in self.files.keys():  #перебор файлов
-            file_dir = os.path.dirname(file_path)  #получение директории файла
-            if file_dir == path:  #если файл в удаляемой директории
-                return False  #директория не пуста
-
-        #Проверяем поддиректории
-        for dir_path in self.directories:  #перебор директорий
-            if dir_path != path and dir_path.startswith(path + '/'):  #если есть поддиректории
-                return False  #директория не пуста
-
-        return True  #директория пуста
+        node = self._get_node(path)  #узел директории
+        return node is None or not node.children  #пустая, если нет потомков
 
     def get_permissions(self, path):
         """получение прав доступа для пути"""
-        return self.file_permissions.get(path, '644' if path in self.files else '755')  #возврат прав или значений по умолчанию
-
-
-class VFSEmulator:
-    def __init__(self, root, vfs_path=None, script_path=None):
-        self.root = root  #главное окно
-        self.root.title("finikato.os(vfs)")  #заголовок окна
-        self.root.configure(background="#7366bd")  #фон окна
-        self.root.geometry("800x600")  #размер окна
-
-        self.program_dir = os.path.dirname(os.path.abspath(__file__))  #директория программы
-        os.chdir(self.program_dir)  #меняем текущую директорию
-
-        self.vfs_path = os.path.abspath(vfs_path) if vfs_path else self.program_dir  #путь к vfs
+        path = self.resolve_path(path)  #единый нормализованный ключ
+        node = self._get_node(path)  #узел с правами
+        return '755' if node is None else format(node.mode, '03o')  #права строкой '644'
+
+
+class Command:
+    """описание команды: имя, имя метода-обработчика и спецификация аргументов"""
+
+    def __init__(self, name, handler, usage, min_args=0):
+        self.name = name  #имя команды
+        self.handler = handler  #имя метода движка, обрабатывающего команду
+        self.usage = usage  #строка использования для help и сообщений об ошибках
+        self.min_args = min_args  #минимальное число аргументов
+
+
+def command_table(*commands):
+    """таблица команд {имя: описание} в порядке перечисления"""
+    return {command.name: command for command in commands}
+
+
+#команды эмулятора (после start и в скриптах); новая команда - строка здесь и метод handle_* в движке
+VFS_COMMANDS = command_table(
+    Command("ls", "handle_ls", "ls [путь]"),
+    Command("cd", "handle_cd", "cd [путь]"),
+    Command("cat", "handle_cat", "cat [--bytes начало-конец | --lines первая-последняя] <файл>"),
+    Command("head", "handle_head", "head [-n число] <файл>"),
+    Command("tail", "handle_tail", "tail [-n число] <файл>"),
+    Command("less", "handle_less", "less <файл>", min_args=1),
+    Command("hexdump", "handle_hexdump", "hexdump [-s смещение] [-n длина] <файл>"),
+    Command("chmod", "handle_chmod", "chmod <режим> <файл/директория>"),
+    Command("rmdir", "handle_rmdir", "rmdir <директория>"),
+    Command("touch", "handle_touch", "touch <файл>", min_args=1),
+    Command("mkdir", "handle_mkdir", "mkdir [-p] <директория>", min_args=1),
+    Command("rm", "handle_rm", "rm [-r] <файл/директория>", min_args=1),
+    Command("echo", "handle_echo", "echo [текст] [> файл | >> файл]"),
+    Command("save", "handle_save", "save [путь]"),
+    Command("snapshot", "handle_snapshot", "snapshot save|restore|drop <имя> | snapshot list", min_args=1),
+    Command("mount", "handle_mount", "mount [образ]"),
+    Command("verify", "handle_verify", "verify [путь]"),
+    Command("diff", "handle_diff", "diff <образ>", min_args=1),
+    Command("find", "handle_find", "find [путь] [-name шаблон] [-type f|d]"),
+    Command("du", "handle_du", "du [-s] [путь]"),
+    Command("tree", "handle_tree", "tree [-L глубина] [путь]"),
+    Command("grep", "handle_grep", "grep [-r] [-i] <строка> [путь]", min_args=1),
+    Command("vfs-info", "handle_vfs_info", "vfs-info"),
+    Command("stats", "handle_stats", "stats [reset | memory on|off | log <файл>|off]"),
+    Command("profile", "handle_profile", "profile <команда> [аргументы]", min_args=1),
+    Command("help", "handle_help", "help"),
+    Command("exit", "handle_exit", "exit"),
+)
+
+#команды настройки (до start)
+SETUP_COMMANDS = command_table(
+    Command("set", "process_set_command", "set vfs_path|script_path <значение>"),
+    Command("start", "handle_start", "start"),
+    Command("vfs-info", "handle_vfs_info", "vfs-info"),
+    Command("stats", "handle_stats", "stats [reset | memory on|off | log <файл>|off]"),
+    Command("help", "handle_help", "help"),
+    Command("exit", "handle_quit", "exit"),
+)
+
+
+#команды подключения к серверу: изменения идут в общую vfs, команды с путями хоста (save, mount, diff,
+#stats log) недоступны
+SERVER_COMMANDS = command_table(
+    Command("ls", "handle_ls", "ls [путь]"),
+    Command("cd", "handle_cd", "cd [путь]"),
+    Command("pwd", "handle_pwd", "pwd"),
+    Command("cat", "handle_cat", "cat [--bytes начало-конец | --lines первая-последняя] <файл>"),
+    Command("head", "handle_head", "head [-n число] <файл>"),
+    Command("tail", "handle_tail", "tail [-n число] <файл>"),
+    Command("less", "handle_less", "less <файл>", min_args=1),
+    Command("hexdump", "handle_hexdump", "hexdump [-s смещение] [-n длина] <файл>"),
+    Command("chmod", "handle_chmod", "chmod <режим> <файл/директория>"),
+    Command("rmdir", "handle_rmdir", "rmdir <директория>"),
+    Command("touch", "handle_touch", "touch <файл>", min_args=1),
+    Command("mkdir", "handle_mkdir", "mkdir [-p] <директория>", min_args=1),
+    Command("rm", "handle_rm", "rm [-r] <файл/директория>", min_args=1),
+    Command("echo", "handle_echo", "echo [текст] [> файл | >> файл]"),
+    Command("snapshot", "handle_snapshot", "snapshot save|restore|drop <имя> | snapshot list", min_args=1),
+    Command("verify", "handle_verify", "verify [путь]"),
+    Command("find", "handle_find", "find [путь] [-name шаблон] [-type f|d]"),
+    Command("du", "handle_du", "du [-s] [путь]"),
+    Command("tree", "handle_tree", "tree [-L глубина] [путь]"),
+    Command("grep", "handle_grep", "grep [-r] [-i] <строка> [путь]", min_args=1),
+    Command("vfs-info", "handle_vfs_info", "vfs-info"),
+    Command("stats", "handle_stats", "stats [reset | memory on|off]"),
+    Command("profile", "handle_profile", "profile <команда> [аргументы]", min_args=1),
+    Command("help", "handle_help", "help"),
+    Command("exit", "handle_exit", "exit"),
+)
+
+
+class ParsedCommand:
+    """заранее разобранная строка скрипта с уже найденными описанием команды и обработчиком"""
+
+    def __init__(self, line_num, text, name, args, command=None, handler=None):
+        self.line_num = line_num  #номер строки в скрипте
+        self.text = text  #исходный текст команды
+        self.name = name  #имя команды в нижнем регистре
+        self.args = args  #аргументы команды
+        self.command = command  #описание команды из таблицы (None - неизвестная команда)
+        self.handler = handler  #функция-обработчик класса движка (вызывается с движком и аргументами)
+
+
+_compiled_scripts = OrderedDict()  #lru кэш разобранных скриптов {(путь, класс движка): (размер, mtime, скрипт)}
+
+
+def compile_script(script_path, shell_class):
+    """разбор файла скрипта в список команд с привязкой к таблице и обработчикам shell_class;
+    результат кэшируется, пока файл не изменится"""
+    st = os.stat(script_path)  #метаданные файла для проверки кэша
+    key = (script_path, shell_class)  #обработчики зависят от класса движка
+    cached = _compiled_scripts.get(key)  #ранее разобранный скрипт
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:  #файл не менялся
+        _compiled_scripts.move_to_end(key)  #отмечаем как недавно использованный
+        return cached[2]
+
+    script_content = None  #строки скрипта
+    for encoding in ['utf-8', 'cp1251', 'cp866', 'iso-8859-1']:  #пробуем разные кодировки
+        try:
+            with open(script_path, 'r', encoding=encoding) as f:
+                script_content = f.readlines()
+            break
+        except UnicodeDecodeError:
+            continue
+    if script_content is None:  #ни одна кодировка не подошла
+        return None
+
+    commands = []  #разобранные команды
+    for line_num, line in enumerate(script_content, 1):
+        line = line.strip()  #удаление пробелов
+        if not line or line.startswith('#'):  #пропуск пустых строк и комментариев
+            continue
+        parts = line.split()  #разбиение строки на части
+        name = parts[0].lower()  #имя команды
+        command = shell_class.vfs_commands.get(name)  #поиск в таблице один раз при разборе
+        handler = None if command is None else getattr(shell_class, command.handler)
+        commands.append(ParsedCommand(line_num, line, name, parts[1:], command, handler))
+
+    compiled = (commands, len(script_content))  #команды и число строк для прогресса
+    _compiled_scripts[key] = (st.st_size, st.st_mtime_ns, compiled)  #сохраняем в кэш
+    if len(_compiled_scripts) > SCRIPT_CACHE_SIZE:  #кэш переполнен
+        _compiled_scripts.popitem(last=False)  #вытесняем самый старый скрипт
+    return compiled
+
+
+class VFSShell:
+    """движок команд vfs без привязки к интерфейсу: вывод идет в текстовый поток"""
+
+    vfs_commands = VFS_COMMANDS  #таблица команд эмулятора
+    setup_commands = SETUP_COMMANDS  #таблица команд настройки
+
+    def __init__(self, vfs=None, script_path=None, output=None, stats_log=None):
+        self.vfs = vfs if vfs is not None else VFS()  #экземпляр vfs
+        self.vfs_path = None  #путь к vfs
         self.prompt = "vfs> "  #приглашение командной строки
         self.script_path = os.path.abspath(script_path) if script_path else None  #путь к скрипту
         self.is_running = False  #флаг работы эмулятора
         self.current_dir = "/"  #текущая директория в vfs
-
-        #инициализация vfs
-        self.vfs = VFS()  #создание экземпляра vfs
-
-        self.create_gui()  #создание графического интерфейса
-
-        self.write_output(f"программа запущена из: {self.program_dir}")  #информация о запуске
-        self.write_output(f"текущая рабочая директория: {os.getcwd()}")  #текущая директория
-
-        if self.script_path:  #если указан путь к скрипту
-            exists = "найден" if os.path.exists(self.script_path) else "не найден"  #проверка существования
-            self.write_output(f"путь к скрипту: {self.script_path} ({exists})")  #вывод информации о скрипте
-
-        self.write_output("\nкоманды: set vfs_path|script_path <значение>, start, exit, vfs-info")  #список команд
-        self.write_output("=" * 50)  #разделитель
-
-        #автозагрузка vfs если указан путь
-        if vfs_path and os.path.exists(vfs_path):  #проверка существования vfs
-            success, message = self.vfs.load_from_xml(vfs_path)  #загрузка vfs
-            self.write_output(message)  #вывод сообщения
-            if success:  #если загрузка успешна
-                self.write_output(self.vfs.get_info())  #вывод информации о vfs
-
-        if self.script_path and os.path.exists(self.script_path):  #если скрипт существует
-            self.root.after(100, self.start_emulator)  #автозапуск через 100мс
-
-    def create_gui(self):
-        """создание графического интерфейса"""
-        create = tk.Label(self.root, text="меню пользователя:", background="#ffffff",  #метка заголовка
-                          font=("comic sans ms", 16))  #шрифт заголовка
-        create.grid(column=0, row=0, padx=10, pady=10, columnspan=2)  #размещение заголовка
-
-        text_frame = tk.Frame(self.root)  #фрейм для текстового поля
-        text_frame.grid(column=0, row=1, columnspan=2, padx=10, pady=10, sticky="nsew")  #размещение фрейма
-
-        self.root.grid_rowconfigure(1, weight=1)  #настройка веса строки
-        self.root.grid_columnconfigure(0, weight=1)  #настройка веса колонки
-
-        scrollbar = tk.Scrollbar(text_frame)  #создание скроллбара
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)  #размещение скроллбара
-
-        self.output_area = tk.Text(text_frame, width=70, height=20, background="white",  #текстовое поле вывода
-                                   font=("consolas", 10), yscrollcommand=scrollbar.set)  #настройки текстового поля
-        self.output_area.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)  #размещение текстового поля
-
-        scrollbar.config(command=self.output_area.yview)  #связываем скроллбар с текстовым полем
-
-        self.output_area.insert(tk.END, "добро пожаловать в finikato.os с vfs\nвведите команду\n")  #начальное сообщение
-        self.output_area.configure(state='disabled')  #блокируем редактирование
-
-        input_frame = tk.Frame(self.root, background="#7366bd")  #фрейм для ввода
-        input_frame.grid(column=0, row=2, columnspan=2, padx=10, pady=10)  #размещение фрейма ввода
-
-        self.entry = tk.Entry(input_frame, width=50, font=("arial", 12))  #поле ввода команд
-        self.entry.pack(side=tk.LEFT, padx=5)  #размещение поля ввода
-        self.entry.bind("<Return>", self.process_command)  #привязка клавиши enter
-        self.entry.focus()  #установка фокуса на поле ввода
-
-        self.btn = tk.Button(input_frame, text="ввод", command=self.process_command,  #кнопка ввода
-                             font=("comic sans ms", 12), background="#4caf50")  #настройки кнопки
-        self.btn.pack(side=tk.LEFT, padx=5)  #размещение кнопки
-
-        button_frame = tk.Frame(self.root, background="#7366bd")  #фрейм для дополнительных кнопок
-        button_frame.grid(column=0, row=3, columnspan=2, pady=5)  #размещение фрейма кнопок
-
-        btn_clear = tk.Button(button_frame, text="очистить вывод", command=self.clear_output,  #кнопка очистки
-                              font=("comic sans ms", 10), background="#ff5722")  #настройки кнопки очистки
-        btn_clear.pack(side=tk.LEFT, padx=5)  #размещение кнопки очистки
+        self.output = output if output is not None else sys.stdout  #поток вывода
+        self.exit_status = 0  #код завершения (0 - успех, 1 - ошибка скрипта, 2 - ошибка загрузки vfs)
+        self.in_script = False  #команды идут из стартового скрипта
+        self.command_stats = {}  #статистика команд {имя: [вызовов, секунд всего, секунд максимум, байт максимум]}
+        self.stats_log = None  #файл json lines с записью о каждой команде
+        if stats_log:
+            self.open_stats_log(stats_log)
 
     def write_output(self, text):
-        """вывод текста в область вывода"""
-        self.output_area.configure(state='normal')  #включаем редактирование
-        self.output_area.insert(tk.END, text + "\n")  #добавляем текст
-        self.output_area.see(tk.END)  #автопрокрутка к концу
-        self.output_area.configure(state='disabled')  #отключаем редактирование
-
-    def clear_output(self):
-        """очистка текстового поля вывода"""
-        self.output_area.configure(state='normal')  #включаем редактирование
-        self.output_area.delete(1.0, tk.END)  #удаляем весь текст
-        self.output_area.insert(tk.END, "введите команду\n")  #добавляем начальное сообщение
-        self.output_area.see(tk.END)  #автопрокрутка к концу
-        self.output_area.configure(state='disabled')  #отключаем редактирование
-
-    def process_command(self, event=None):
-        """обработка команд пользователя"""
-        command = self.entry.get().strip()  #получение команды из поля ввода
-        self.entry.delete(0, tk.END)  #очищаем поле ввода
-
-        if not command:  #если команда пустая
-            return  #выход из функции
+        """вывод текста в поток"""
+        self.output.write(text + "\n")  #строка с переводом строки
 
-        if self.is_running:  #если эмулятор запущен
-            self.write_output(f"{self.prompt}{command}")  #вывод с приглашением vfs
-        else:  #если эмулятор не запущен
-            self.write_output(f"> {command}")  #вывод с приглашением настроек
+    def quit(self):
+        """завершение работы движка"""
+        self.is_running = False  #сброс флага работы
+        self.close_stats_log()  #дописываем журнал команд
 
+    def execute_command(self, command):
+        """выполнение одной команды (общая часть для gui и безоконного режима)"""
         parts = command.split()  #разбиение команды на части
 
         if not parts:  #если нет частей команды
@@ -355,48 +2072,149 @@ class VFSEmulator:
 
         cmd = parts[0].lower()  #команда в нижнем регистре
         args = parts[1:]  #аргументы команды
+        table = self.vfs_commands if self.is_running else self.setup_commands  #команды текущего режима
+        self.dispatch(table, cmd, args)  #вызов обработчика
+
+    def dispatch(self, table, cmd, args):
+        """вызов обработчика команды из таблицы с проверкой числа аргументов"""
+        command = table.get(cmd)  #описание команды
+        if command is None:  #неизвестная команда
+            self.write_output(f"неизвестная команда: {cmd}")  #сообщение об ошибке
+            return
+        #обработчик ищется по имени в классе движка, поэтому его можно переопределить в наследнике
+        self.invoke(command, getattr(type(self), command.handler), args)
+
+    def invoke(self, command, handler, args):
+        """вызов найденного обработчика (функции класса движка) с проверкой числа аргументов и учетом в статистике"""
+        cmd = command.name  #имя команды
+        if len(args) < command.min_args:  #не хватает аргументов
+            self.write_output(f"ошибка: недостаточно аргументов для команды {cmd}")  #сообщение об ошибке
+            self.write_output(f"использование: {command.usage}")  #справка по использованию
+            return
+        tracing = tracemalloc.is_tracing()  #память считается, только если включен tracemalloc
+        if tracing:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]  #память до команды
+        start = time.perf_counter()
+        try:
+            handler(self, args)
+        finally:  #время учитывается и для команд, завершившихся исключением
+            elapsed = time.perf_counter() - start
+            tracing = tracing and tracemalloc.is_tracing()  #stats memory off останавливает учет внутри команды
+            memory = tracemalloc.get_traced_memory()[1] - before if tracing else None  #пик выделений за команду
+            self._record_command(cmd, args, elapsed, memory)
+
+    def _record_command(self, cmd, args, elapsed, memory):
+        """учет выполненной команды в статистике и журнале json lines"""
+        entry = self.command_stats.setdefault(cmd, [0, 0.0, 0.0, 0])  #вызовов, всего, максимум, память
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+        if memory is not None:
+            entry[3] = max(entry[3], memory)
+        if self.stats_log is not None:  #запись о команде в журнал
+            record = {"time": time.time(), "command": cmd, "args": args, "seconds": elapsed}
+            if memory is not None:
+                record["memory_bytes"] = memory
+            self.stats_log.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def open_stats_log(self, path):
+        """включение журнала json lines (файл дописывается)"""
+        self.close_stats_log()
+        self.stats_log = open(path, 'a', encoding='utf-8', buffering=1)  #построчная буферизация
+
+    def close_stats_log(self):
+        """закрытие журнала json lines"""
+        if self.stats_log is not None:
+            self.stats_log.close()
+            self.stats_log = None
+
+    def handle_exit(self, args):
+        """обработка команды exit в режиме эмулятора (в скрипте - завершение скрипта)"""
+        self.is_running = False  #сброс флага работы
+        self.write_output("завершение работы..." if self.in_script else "эмулятор остановлен.")  #сообщение об остановке
+
+    def handle_quit(self, args):
+        """обработка команды exit в режиме настройки"""
+        self.quit()  #завершение программы
+
+    def handle_start(self, args):
+        """обработка команды start"""
+        self.start_emulator()  #запуск эмулятора
+
+    def handle_vfs_info(self, args):
+        """обработка команды vfs-info"""
+        if self.vfs.loaded:  #если vfs загружена
+            self.write_output(self.vfs.get_info())  #вывод информации
+        else:  #если vfs не загружена
+            self.write_output("vfs не загружена")  #сообщение об ошибке
 
-        if self.is_running:  #команды эмулятора vfs
-            if cmd == "exit":  #команда выхода
-                self.is_running = False  #сброс флага работы
-                self.write_output("эмулятор остановлен.")  #сообщение об остановке
-            elif cmd == "ls":  #команда списка файлов
-                self.handle_ls(args)  #обработка команды ls
-            elif cmd == "cd":  #команда смены директории
-                self.handle_cd(args)  #обработка команды cd
-            elif cmd == "cat":  #команда просмотра файла
-                self.handle_cat(args)  #обработка команды cat
-            elif cmd == "head":  #команда вывода начала файла
-                self.handle_head(args)  #обработка команды head
-            elif cmd == "vfs-info":  #команда информации о vfs
-                if self.vfs.loaded:  #если vfs загружена
-                    self.write_output(self.vfs.get_info())  #вывод информации
-                else:  #если vfs не загружена
-                    self.write_output("vfs не загружена")  #сообщение об ошибке
-            elif cmd == "chmod":  #команда изменения прав доступа
-                self.handle_chmod(args)  #обработка команды chmod
-            elif cmd == "rmdir":  #команда удаления директории
-                self.handle_rmdir(args)  #обработка команды rmdir
-            else:  #неизвестная команда
-                self.write_output(f"неизвестная команда: {cmd}")  #сообщение об ошибке
-        else:  #команды настройки
-            if cmd == "set":  #команда установки параметров
-                self.process_set_command(args)  #обработка команды set
-            elif cmd == "start":  #команда запуска эмулятора
-                self.start_emulator()  #запуск эмулятора
-            elif cmd == "vfs-info":  #команда информации о vfs
-                if self.vfs.loaded:  #если vfs загружена
-                    self.write_output(self.vfs.get_info())  #вывод информации
-                else:  #если vfs не загружена
-                    self.write_output("vfs не загружена")  #сообщение об ошибке
-            elif cmd == "exit":  #команда выхода
-                self.root.destroy()  #завершение программы
-            else:  #неизвестная команда
-                self.write_output(f"неизвестная команда: {cmd}")  #сообщение об ошибке
+    def handle_help(self, args):
+        """обработка команды help: список команд текущего режима"""
+        table = self.vfs_commands if self.is_running else self.setup_commands  #команды текущего режима
+        for command in table.values():  #перебор команд в порядке регистрации
+            self.write_output(command.usage)  #вывод подсказки
+
+    def handle_stats(self, args):
+        """обработка команды stats: статистика команд, сброс, учет памяти и журнал json lines"""
+        action = args[0] if args else ""
+        if action == "reset":  #сброс статистики
+            self.command_stats.clear()
+            self.write_output("статистика команд сброшена")
+        elif action == "memory" and len(args) > 1 and args[1] in ("on", "off"):  #учет памяти через tracemalloc
+            if args[1] == "on" and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            elif args[1] == "off" and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self.write_output(f"учет памяти команд: {'включен' if tracemalloc.is_tracing() else 'выключен'}")
+        elif action == "log" and len(args) > 1:  #журнал json lines
+            if args[1] == "off":
+                self.close_stats_log()
+                self.write_output("журнал команд выключен")
+                return
+            path = ' '.join(args[1:])  #путь к файлу журнала
+            try:
+                self.open_stats_log(path)
+            except OSError as e:
+                self.write_output(f"ошибка: не удалось открыть журнал: {e}")
+                return
+            self.write_output(f"журнал команд: {os.path.abspath(path)}")
+        elif action:  #неизвестное действие
+            self.write_output("использование: stats [reset | memory on|off | log <файл>|off]")
+        else:  #таблица статистики, самые долгие команды сверху
+            if not self.command_stats:
+                self.write_output("статистика команд пуста")
+                return
+            self.write_output(f"{'команда':<12}{'вызовов':>9}{'всего мс':>12}{'среднее мс':>12}{'макс мс':>10}{'память КБ':>11}")
+            for cmd, (count, total, longest, memory) in sorted(self.command_stats.items(),
+                                                                key=lambda item: item[1][1], reverse=True):
+                self.write_output(f"{cmd:<12}{count:>9}{total * 1000:>12.2f}{total * 1000 / count:>12.3f}"
+                                  f"{longest * 1000:>10.2f}{memory / 1024:>11.1f}")
+
+    def handle_profile(self, args):
+        """обработка команды profile: выполнение одной команды под cProfile"""
+        cmd = args[0].lower()  #профилируемая команда
+        if cmd not in self.vfs_commands or cmd == "profile":  #профилировать нечего
+            self.write_output(f"неизвестная команда: {cmd}" if cmd != "profile" else "ошибка: profile нельзя вкладывать")
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            self.dispatch(self.vfs_commands, cmd, args[1:])  #выполнение с учетом в статистике
+        finally:
+            profiler.disable()
+        report = io.StringIO()  #отчет pstats
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        for line in report.getvalue().strip('\n').split('\n'):
+            self.write_output(line)
+
+    def _resolve(self, path):
+        """канонический путь относительно текущей директории"""
+        return self.vfs.resolve_path(path, self.current_dir)
 
     def handle_ls(self, args):
         """обработка команды ls"""
-        target = ' '.join(args) if args else self.current_dir  #целевая директория
+        target = self._resolve(' '.join(args)) if args else self.current_dir  #целевая директория
         if self.vfs.loaded:  #если vfs загружена
             items = self.vfs.list_directory(target)  #получение списка файлов
             if items:  #если есть элементы
@@ -416,17 +2234,7 @@ class VFSEmulator:
 
         target = ' '.join(args)  #целевая директория
 
-        #обработка абсолютных и относительных путей
-        if target.startswith('/'):  #абсолютный путь
-            new_dir = target
-        else:  #относительный путь
-            if self.current_dir == '/':  #если текущая директория корневая
-                new_dir = '/' + target
-            else:  #если текущая директория не корневая
-                new_dir = self.current_dir + '/' + target
-
-        #нормализация пути (удаление двойных слешей и т.д.)
-        new_dir = new_dir.replace('//', '/')  #удаление двойных слешей
+        new_dir = self._resolve(target)  #канонический путь (абсолютный или относительно текущей директории)
 
         #проверка существования директории
         if self.vfs.loaded and self.vfs.directory_exists(new_dir):  #если vfs загружена и директория существует
@@ -441,30 +2249,137 @@ class VFSEmulator:
             self.write_output("ошибка: укажите имя файла")  #сообщение об ошибке
             return  #выход из функции
 
+        selection = None  #диапазон: ('--bytes' или '--lines', начало, конец)
+        if args[0] in ('--bytes', '--lines'):  #чтение диапазона
+            bounds = args[1].split('-', 1) if len(args) > 2 else []  #границы диапазона
+            try:
+                selection = (args[0], int(bounds[0]), int(bounds[1]))  #преобразование в числа
+            except (IndexError, ValueError):  #диапазон не указан или указан неверно
+                self.write_output(f"ошибка: неверный диапазон для {args[0]}")  #сообщение об ошибке
+                self.write_output("использование: cat [--bytes начало-конец | --lines первая-последняя] <файл>")
+                return
+            args = args[2:]  #остальное - путь к файлу
+
         file_path = ' '.join(args)  #путь к файлу
 
-        #обработка относительных путей
-        if not file_path.startswith('/'):  #если путь относительный
-            if self.current_dir == '/':  #если текущая директория корневая
-                file_path = '/' + file_path
-            else:  #если текущая директория не корневая
-                file_path = self.current_dir + '/' + file_path
+        file_path = self._resolve(file_path)  #канонический путь (абсолютный или относительно текущей директории)
 
         if self.vfs.loaded and self.vfs.file_exists(file_path):  #проверка существования файла
-            content = self.vfs.read_file(file_path)  #чтение содержимого файла
-            self.write_output(f"содержимое файла {file_path}:")  #заголовок
+            if selection is None or selection[0] == '--lines':  #текстовый вывод
+                if self._binary_notice(file_path):  #двоичный файл - только через hexdump
+                    return
+            if selection is None:  #файл целиком
+                content = self.vfs.read_text(file_path)  #чтение содержимого файла
+                self.write_output(f"содержимое файла {file_path}:")  #заголовок
+            elif selection[0] == '--bytes':  #диапазон байт
+                data = self.vfs.read_file_range(file_path, selection[1], selection[2])  #только нужные байты
+                content = data.decode('utf-8', errors='replace')  #текст для вывода
+                self.write_output(f"байты {selection[1]}-{selection[2]} файла {file_path}:")  #заголовок
+            else:  #диапазон строк
+                content = self.vfs.get_file_lines(file_path, selection[1], selection[2])  #строки по индексу
+                self.write_output(f"строки {selection[1]}-{selection[2]} файла {file_path}:")  #заголовок
             self.write_output("-" * 40)  #разделитель
             self.write_output(content)  #вывод содержимого
             self.write_output("-" * 40)  #разделитель
         else:  #если файл не найден
             self.write_output(f"файл не найден: {file_path}")  #сообщение об ошибке
 
+    def handle_less(self, args):
+        """обработка команды less: просмотр файла (в окне - по видимым строкам)"""
+        file_path = self._resolve(' '.join(args))  #канонический путь к файлу
+        if not (self.vfs.loaded and self.vfs.file_exists(file_path)):  #проверка существования файла
+            self.write_output(f"файл не найден: {file_path}")  #сообщение об ошибке
+            return
+        if self._binary_notice(file_path):  #двоичный файл - только через hexdump
+            return
+        self.open_viewer(file_path)
+
+    def open_viewer(self, file_path):
+        """просмотр файла; без окна файл просто выводится целиком"""
+        self.write_output(self.vfs.read_text(file_path))
+
     def handle_head(self, args):
         """обработка команды head"""
+        parsed = self._parse_lines_args(args, "head")  #число строк и путь к файлу
+        if parsed is None:  #ошибка в аргументах
+            return
+        lines, file_path = parsed
+
+        if self.vfs.loaded and self.vfs.file_exists(file_path):  #проверка существования файла
+            if self._binary_notice(file_path):  #двоичный файл - только через hexdump
+                return
+            content = self.vfs.get_file_head(file_path, lines)  #получение первых строк
+            self.write_output(f"первые {lines} строк файла {file_path}:")  #заголовок
+            self.write_output("-" * 40)  #разделитель
+            self.write_output(content)  #вывод содержимого
+            self.write_output("-" * 40)  #разделитель
+        else:  #если файл не найден
+            self.write_output(f"файл не найден: {file_path}")  #сообщение об ошибке
+
+    def handle_tail(self, args):
+        """обработка команды tail"""
+        parsed = self._parse_lines_args(args, "tail")  #число строк и путь к файлу
+        if parsed is None:  #ошибка в аргументах
+            return
+        lines, file_path = parsed
+
+        if self.vfs.loaded and self.vfs.file_exists(file_path):  #проверка существования файла
+            if self._binary_notice(file_path):  #двоичный файл - только через hexdump
+                return
+            content = self.vfs.get_file_tail(file_path, lines)  #получение последних строк
+            self.write_output(f"последние {lines} строк файла {file_path}:")  #заголовок
+            self.write_output("-" * 40)  #разделитель
+            self.write_output(content)  #вывод содержимого
+            self.write_output("-" * 40)  #разделитель
+        else:  #если файл не найден
+            self.write_output(f"файл не найден: {file_path}")  #сообщение об ошибке
+
+    def handle_hexdump(self, args):
+        """обработка команды hexdump"""
+        offset, length, file_args = 0, None, []  #смещение, длина и аргументы пути
+        i = 0
+        while i < len(args):  #парсинг аргументов
+            if args[i] in ('-s', '-n') and i + 1 < len(args):  #смещение или длина
+                try:
+                    value = int(args[i + 1], 0)  #десятичное или 0x... число
+                except ValueError:  #если преобразование не удалось
+                    value = -1
+                if value < 0:
+                    self.write_output(f"ошибка: неверное значение для {args[i]}: {args[i + 1]}")
+                    return
+                if args[i] == '-s':
+                    offset = value
+                else:
+                    length = value
+                i += 2  #пропускаем два аргумента
+            else:  #часть пути
+                file_args.append(args[i])
+                i += 1
+        if not file_args:  #если не указано имя файла
+            self.write_output("ошибка: укажите имя файла")  #сообщение об ошибке
+            self.write_output("использование: hexdump [-s смещение] [-n длина] <файл>")  #справка по использованию
+            return
+        file_path = self._resolve(' '.join(file_args))  #канонический путь к файлу
+        if not (self.vfs.loaded and self.vfs.file_exists(file_path)):  #проверка существования файла
+            self.write_output(f"файл не найден: {file_path}")  #сообщение об ошибке
+            return
+        for line in self.vfs.iter_hexdump(file_path, offset, length):  #строки выводятся по мере чтения
+            self.write_output(line)
+
+    def _binary_notice(self, file_path):
+        """сообщение вместо вывода двоичного файла как текста (True - файл двоичный)"""
+        if not self.vfs.is_binary(file_path):
+            return False
+        size = self.vfs._file_size(file_path)  #размер содержимого в байтах
+        self.write_output(f"{file_path}: двоичные данные, {size} байт (используйте hexdump {file_path})")
+        return True
+
+    def _parse_lines_args(self, args, cmd):
+        """разбор аргументов head/tail: (число строк, канонический путь) или None при ошибке"""
         if not args:  #если нет аргументов
             self.write_output("ошибка: укажите имя файла")  #сообщение об ошибке
-            self.write_output("использование: head [-n число] <файл>")  #справка по использованию
-            return  #выход из функции
+            self.write_output(f"использование: {cmd} [-n число] <файл>")  #справка по использованию
+            return None
 
         lines = 10  #количество строк по умолчанию
         file_args = []  #аргументы для имени файла
@@ -478,33 +2393,17 @@ class VFSEmulator:
                     i += 2  #пропускаем два аргумента
                 except ValueError:  #если преобразование не удалось
                     self.write_output(f"ошибка: неверное число строк: {args[i + 1]}")  #сообщение об ошибке
-                    return  #выход из функции
+                    return None
             else:  #если это не параметр -n
                 file_args.append(args[i])  #добавляем в аргументы файла
                 i += 1  #переходим к следующему аргументу
 
         if not file_args:  #если не указано имя файла
             self.write_output("ошибка: укажите имя файла")  #сообщение об ошибке
-            self.write_output("использование: head [-n число] <файл>")  #справка по использованию
-            return  #выход из функции
-
-        file_path = ' '.join(file_args)  #путь к файлу
-
-        #обработка относительных путей
-        if not file_path.startswith('/'):  #если путь относительный
-            if self.current_dir == '/':  #если текущая директория корневая
-                file_path = '/' + file_path
-            else:  #если текущая директория не корневая
-                file_path = self.current_dir + '/' + file_path
+            self.write_output(f"использование: {cmd} [-n число] <файл>")  #справка по использованию
+            return None
 
-        if self.vfs.loaded and self.vfs.file_exists(file_path):  #проверка существования файла
-            content = self.vfs.get_file_head(file_path, lines)  #получение первых строк
-            self.write_output(f"первые {lines} строк файла {file_path}:")  #заголовок
-            self.write_output("-" * 40)  #разделитель
-            self.write_output(content)  #вывод содержимого
-            self.write_output("-" * 40)  #разделитель
-        else:  #если файл не найден
-            self.write_output(f"файл не найден: {file_path}")  #сообщение об ошибке
+        return lines, self._resolve(' '.join(file_args))  #канонический путь к файлу
 
     def handle_chmod(self, args):
         """обработка команды chmod"""
@@ -516,12 +2415,7 @@ class VFSEmulator:
         mode = args[0]  #режим прав доступа
         target = ' '.join(args[1:])  #целевой путь
 
-        #обработка относительных путей
-        if not target.startswith('/'):  #если путь относительный
-            if self.current_dir == '/':  #если текущая директория корневая
-                target = '/' + target
-            else:  #если текущая директория не корневая
-                target = self.current_dir + '/' + target
+        target = self._resolve(target)  #канонический путь (абсолютный или относительно текущей директории)
 
         if self.vfs.loaded:  #если vfs загружена
             success, message = self.vfs.chmod(target, mode)  #изменение прав доступа
@@ -538,12 +2432,7 @@ class VFSEmulator:
 
         target = ' '.join(args)  #целевая директория
 
-        #обработка относительных путей
-        if not target.startswith('/'):  #если путь относительный
-            if self.current_dir == '/':  #если текущая директория корневая
-                target = '/' + target
-            else:  #если текущая директория не корневая
-                target = self.current_dir + '/' + target
+        target = self._resolve(target)  #канонический путь (абсолютный или относительно текущей директории)
 
         if self.vfs.loaded:  #если vfs загружена
             success, message = self.vfs.rmdir(target)  #удаление директории
@@ -551,6 +2440,232 @@ class VFSEmulator:
         else:  #если vfs не загружена
             self.write_output("vfs не загружена")  #сообщение об ошибке
 
+    def handle_touch(self, args):
+        """обработка команды touch"""
+        if self._require_vfs():  #vfs загружена
+            success, message = self.vfs.touch(self._resolve(' '.join(args)))  #создание файла
+            self.write_output(message)  #вывод результата
+
+    def handle_mkdir(self, args):
+        """обработка команды mkdir"""
+        parents = '-p' in args  #создание недостающих родителей
+        path_args = [arg for arg in args if arg != '-p']  #аргументы пути
+        if not path_args:  #если не указана директория
+            self.write_output("использование: mkdir [-p] <директория>")  #справка по использованию
+            return
+        if self._require_vfs():  #vfs загружена
+            success, message = self.vfs.mkdir(self._resolve(' '.join(path_args)), parents)  #создание директории
+            self.write_output(message)  #вывод результата
+
+    def handle_rm(self, args):
+        """обработка команды rm"""
+        recursive = bool(args) and args[0] in ('-r', '-rf', '-R')  #удаление директорий с содержимым
+        path_args = args[1:] if recursive else args  #аргументы пути
+        if not path_args:  #если не указан путь
+            self.write_output("использование: rm [-r] <файл/директория>")  #справка по использованию
+            return
+        if not self._require_vfs():  #vfs не загружена
+            return
+        target = self._resolve(' '.join(path_args))  #канонический путь
+        success, message = self.vfs.remove(target, recursive)  #удаление
+        self.write_output(message)  #вывод результата
+        if success and not self.vfs.directory_exists(self.current_dir):  #удалена текущая директория
+            self.current_dir = "/"  #переход в корневую директорию
+
+    def handle_echo(self, args):
+        """обработка команды echo: вывод текста или запись в файл (> - заменить, >> - дописать)"""
+        words, target, append = [], None, False  #текст, файл и режим записи
+        for i, arg in enumerate(args):  #поиск перенаправления
+            if arg.startswith('>'):
+                append = arg.startswith('>>')
+                rest = arg[2 if append else 1:]  #путь, записанный слитно с > (echo a >file)
+                target = ' '.join(([rest] if rest else []) + args[i + 1:])
+                break
+            words.append(arg)
+        text = ' '.join(words)  #текст без кавычек по краям
+        if len(text) > 1 and text[0] == text[-1] and text[0] in '"\'':
+            text = text[1:-1]
+        if target is None:  #без перенаправления - просто вывод
+            self.write_output(text)
+            return
+        if not target:  #перенаправление без файла
+            self.write_output("ошибка: укажите файл после >")  #сообщение об ошибке
+            return
+        if self._require_vfs():  #vfs загружена
+            success, message = self.vfs.write_file(self._resolve(target), (text + '\n').encode('utf-8'), append)
+            self.write_output(message)  #вывод результата
+
+    def handle_save(self, args):
+        """обработка команды save"""
+        if self._require_vfs():  #vfs загружена
+            success, message = self.vfs.save_xml(' '.join(args) if args else None)  #сохранение в xml
+            self.write_output(message)  #вывод результата
+
+    def handle_snapshot(self, args):
+        """обработка команды snapshot"""
+        action = args[0] if args else ""  #действие со снимком
+        if action not in ('save', 'restore', 'drop', 'list') or (action != 'list' and len(args) < 2):
+            self.write_output("использование: snapshot save|restore|drop <имя> | snapshot list")  #справка по использованию
+            return
+        if not self._require_vfs():  #vfs не загружена
+            return
+        name = ' '.join(args[1:])  #имя снимка
+        if action == 'list':  #список снимков
+            names = self.vfs.snapshot_list()
+            self.write_output(', '.join(names) if names else "снимков нет")
+            return
+        handlers = {'save': self.vfs.snapshot_save, 'restore': self.vfs.snapshot_restore, 'drop': self.vfs.snapshot_drop}
+        success, message = handlers[action](name)  #действие со снимком
+        self.write_output(message)  #вывод результата
+        if success and not self.vfs.directory_exists(self.current_dir):  #текущей директории больше нет
+            self.current_dir = "/"  #переход в корневую директорию
+            self.write_output(f"текущая директория: {self.current_dir}")
+
+    def handle_mount(self, args):
+        """обработка команды mount: без аргументов - список слоев, иначе наложение образа верхним слоем"""
+        if not self._require_vfs():  #vfs не загружена
+            return
+        if not args:  #слои снизу вверх
+            for number, path in enumerate(self.vfs.layers, 1):
+                self.write_output(f"{number}: {path}")
+            return
+        success, message = self.vfs.mount(os.path.abspath(' '.join(args).strip('"\'')))  #путь к образу слоя
+        self.write_output(message)  #вывод результата
+        if success and not self.vfs.directory_exists(self.current_dir):  #текущую директорию скрыл слой
+            self.current_dir = "/"  #переход в корневую директорию
+            self.write_output(f"текущая директория: {self.current_dir}")
+
+    def handle_verify(self, args):
+        """обработка команды verify: пересчет хешей содержимого и хеш меркла поддерева"""
+        if not self._require_vfs():  #vfs не загружена
+            return
+        target = self._resolve(' '.join(args)) if args else self.current_dir  #проверяемый путь
+        result = self.vfs.verify(target)
+        if result is None:  #нет такого пути
+            self.write_output(f"ошибка: путь не существует: {target}")
+            return
+        root, mismatched, checked = result
+        for path in mismatched:  #содержимое изменилось в источнике (ленивый xml, mmap образ)
+            self.write_output(f"содержимое изменилось: {path}")
+        self.write_output(f"проверено файлов: {checked}, несовпадений: {len(mismatched)}")
+        if root is not None:
+            self.write_output(f"хэш дерева {target}: {root}")
+
+    def handle_diff(self, args):
+        """обработка команды diff: отличия другого образа от текущего состояния vfs"""
+        if not self._require_vfs():  #vfs не загружена
+            return
+        success, result = self.vfs.diff(os.path.abspath(' '.join(args).strip('"\'')))  #путь к образу
+        if not success:  #образ не загружен
+            self.write_output(result)
+            return
+        count = 0  #число различий
+        for sign, path, details in result:  #различия выводятся по мере спуска
+            self.write_output(f"{sign} {path} ({details})")
+            count += 1
+        self.write_output(f"различий: {count}" if count else "образы совпадают")
+
+    def handle_find(self, args):
+        """обработка команды find"""
+        pattern, kind, path_args = None, None, []  #параметры поиска
+        i = 0
+        while i < len(args):  #парсинг аргументов
+            if args[i] in ('-name', '-type') and i + 1 < len(args):  #параметр со значением
+                if args[i] == '-name':
+                    pattern = args[i + 1].strip('"\'')  #шаблон имени без кавычек
+                elif args[i + 1] in ('f', 'd'):
+                    kind = args[i + 1]  #тип элементов
+                else:
+                    self.write_output(f"ошибка: неверный тип: {args[i + 1]} (допустимо f или d)")
+                    return
+                i += 2  #пропускаем два аргумента
+            else:  #часть пути
+                path_args.append(args[i])
+                i += 1
+        if not self._require_vfs():  #vfs не загружена
+            return
+        target = self._resolve(' '.join(path_args)) if path_args else self.current_dir  #стартовый путь
+        if not self.vfs._path_exists(target):  #нет такого пути
+            self.write_output(f"ошибка: путь не существует: {target}")
+            return
+        for path in self.vfs.iter_find(target, pattern, kind):  #результаты выводятся по мере обхода
+            self.write_output(path)
+
+    def handle_du(self, args):
+        """обработка команды du"""
+        summarize = '-s' in args  #только итоговый размер
+        path_args = [arg for arg in args if arg != '-s']  #аргументы пути
+        if not self._require_vfs():  #vfs не загружена
+            return
+        target = self._resolve(' '.join(path_args)) if path_args else self.current_dir  #стартовый путь
+        if not self.vfs._path_exists(target):  #нет такого пути
+            self.write_output(f"ошибка: путь не существует: {target}")
+            return
+        for size, path in self.vfs.iter_du(target, summarize):  #размеры выводятся по мере подсчета
+            self.write_output(f"{size}\t{path}")
+
+    def handle_tree(self, args):
+        """обработка команды tree"""
+        max_depth, path_args = None, []  #ограничение глубины и аргументы пути
+        i = 0
+        while i < len(args):  #парсинг аргументов
+            if args[i] == '-L' and i + 1 < len(args):  #ограничение глубины
+                try:
+                    max_depth = int(args[i + 1])  #преобразование в число
+                except ValueError:  #если преобразование не удалось
+                    self.write_output(f"ошибка: неверная глубина: {args[i + 1]}")
+                    return
+                i += 2  #пропускаем два аргумента
+            else:  #часть пути
+                path_args.append(args[i])
+                i += 1
+        if not self._require_vfs():  #vfs не загружена
+            return
+        target = self._resolve(' '.join(path_args)) if path_args else self.current_dir  #стартовый путь
+        if not self.vfs.directory_exists(target):  #нет такой директории
+            self.write_output(f"ошибка: директория не найдена: {target}")
+            return
+        for line in self.vfs.iter_tree(target, max_depth):  #строки выводятся по мере обхода
+            self.write_output(line)
+
+    def handle_grep(self, args):
+        """обработка команды grep"""
+        recursive = ignore_case = False  #флаги поиска
+        rest = []  #шаблон и путь
+        for arg in args:  #парсинг флагов (в том числе -ri)
+            if arg.startswith('-') and len(arg) > 1 and not rest and set(arg[1:]) <= {'r', 'i'}:
+                recursive = recursive or 'r' in arg
+                ignore_case = ignore_case or 'i' in arg
+            else:
+                rest.append(arg)
+        if not rest:  #нет шаблона
+            self.write_output("ошибка: укажите строку для поиска")  #сообщение об ошибке
+            self.write_output("использование: grep [-r] [-i] <строка> [путь]")  #справка по использованию
+            return
+        if not self._require_vfs():  #vfs не загружена
+            return
+        pattern = rest[0].strip('"\'')  #искомая строка без кавычек
+        target = self._resolve(' '.join(rest[1:])) if len(rest) > 1 else self.current_dir  #где искать
+        if not self.vfs._path_exists(target):  #нет такого пути
+            self.write_output(f"ошибка: путь не существует: {target}")
+            return
+        if self.vfs.directory_exists(target) and not recursive:  #директория без -r
+            self.write_output(f"ошибка: {target} - директория (используйте -r)")
+            return
+        found = 0  #число найденных строк
+        for path, line_num, line in self.vfs.iter_grep(pattern, target, recursive, ignore_case):
+            self.write_output(f"{path}:{line_num}:{line}")  #результаты выводятся по мере поиска
+            found += 1
+        if not found:
+            self.write_output("совпадений не найдено")
+
+    def _require_vfs(self):
+        """проверка загрузки vfs с сообщением об ошибке"""
+        if not self.vfs.loaded:  #если vfs не загружена
+            self.write_output("vfs не загружена")  #сообщение об ошибке
+            return False
+        return True
+
     def process_set_command(self, args):
         """обработка команды set"""
         if len(args) < 2:  #проверка количества аргументов
@@ -564,7 +2679,7 @@ class VFSEmulator:
         if param == "vfs_path":  #установка пути vfs
             self.vfs_path = abs_value  #сохранение пути
             #пытаемся загрузить vfs
-            success, message = self.vfs.load_from_xml(self.vfs_path)  #загрузка vfs
+            success, message = self.vfs.load(self.vfs_path)  #загрузка vfs (xml или бинарный образ)
             self.write_output(message)  #вывод сообщения
             if success:  #если загрузка успешна
                 self.write_output(self.vfs.get_info())  #вывод информации о vfs
@@ -585,82 +2700,645 @@ class VFSEmulator:
         self.current_dir = "/"  #сброс текущей директории
 
         if self.script_path and os.path.exists(self.script_path):  #если скрипт существует
-            self.execute_script()  #выполнение скрипта
+            self.run_script(self.show_ready)  #выполнение скрипта, затем сообщение о готовности
+            return
         elif self.script_path:  #если скрипт указан но не существует
             self.write_output(f"ошибка: скрипт не найден: {self.script_path}")  #сообщение об ошибке
+            self.exit_status = 1  #скрипт не выполнен
 
+        self.show_ready()  #сообщение о готовности
+
+    def show_ready(self):
+        """сообщение о готовности эмулятора"""
         self.write_output("эмулятор запущен. введите команды vfs или 'exit'.")  #сообщение о готовности
-        self.write_output("доступные команды: ls, cd, cat, head, chmod, rmdir, vfs-info, exit")  #список команд
+        self.write_output(f"доступные команды: {', '.join(self.vfs_commands)}")  #список команд
+
+    def run_script(self, on_done):
+        """выполнение скрипта и вызов on_done по завершении (gui выполняет скрипт по частям)"""
+        self.execute_script()  #выполнение целиком
+        on_done()  #действие после скрипта
 
     def execute_script(self):
         """выполнение скрипта команд"""
+        for _ in self.iter_script():  #выполняем все шаги скрипта подряд
+            pass
+
+    def iter_script(self):
+        """пошаговое выполнение скрипта: после каждой команды отдает (номер строки, всего строк)"""
         self.write_output(f"выполнение скрипта: {self.script_path}")  #информация о скрипте
 
         try:  #обработка исключений
-            #пробуем разные кодировки
-            encodings = ['utf-8', 'cp1251', 'cp866', 'iso-8859-1']
-            script_content = None
+            compiled = compile_script(self.script_path, type(self))  #разобранный скрипт (из кэша, если файл не менялся)
 
-            for encoding in encodings:
-                try:
-                    with open(self.script_path, 'r', encoding=encoding) as f:
-                        script_content = f.readlines()
-                    break
-                except UnicodeDecodeError:
-                    continue
-
-            if script_content is None:
+            if compiled is None:
                 self.write_output(f"ошибка: не удалось прочитать скрипт с поддерживаемыми кодировками")
+                self.exit_status = 1  #скрипт не выполнен
                 return
 
-            for line_num, line in enumerate(script_content, 1):
-                line = line.strip()  #удаление пробелов
-
-                if not line or line.startswith('#'):  #пропуск пустых строк и комментариев
-                    continue  #переход к следующей строке
-
-                self.write_output(f"{self.prompt}{line}")  #вывод команды
-
-                parts = line.split()  #разбиение строки на части
-
-                if not parts:  #если нет частей
-                    continue  #переход к следующей строке
-
-                cmd = parts[0].lower()  #команда в нижнем регистре
-                args = parts[1:]  #аргументы команды
-
-                if cmd == "exit":  #команда выхода
-                    self.write_output("завершение работы...")  #сообщение
-                    self.is_running = False  #сброс флага работы
-                    break  #выход из цикла
-                elif cmd == "ls":  #команда списка файлов
-                    self.handle_ls(args)  #обработка команды ls
-                elif cmd == "cd":  #команда смены директории
-                    self.handle_cd(args)  #обработка команды cd
-                elif cmd == "cat":  #команда просмотра файла
-                    self.handle_cat(args)  #обработка команды cat
-                elif cmd == "head":  #команда вывода начала файла
-                    self.handle_head(args)  #обработка команды head
-                elif cmd == "chmod":  #команда изменения прав доступа
-                    self.handle_chmod(args)  #обработка команды chmod
-                elif cmd == "rmdir":  #команда удаления директории
-                    self.handle_rmdir(args)  #обработка команды rmdir
-                elif cmd == "vfs-info":  #команда информации о vfs
-                    if self.vfs.loaded:  #если vfs загружена
-                        self.write_output(self.vfs.get_info())  #вывод информации
-                    else:  #если vfs не загружена
-                        self.write_output("vfs не загружена")  #сообщение об ошибке
-                else:  #неизвестная команда
-                    self.write_output(f"неизвестная команда: {cmd}")  #сообщение об ошибке
+            commands, line_count = compiled  #команды скрипта и число строк
+            self.in_script = True
+            for parsed in commands:  #перебор заранее разобранных команд
+                self.write_output(f"{self.prompt}{parsed.text}")  #вывод команды
+                if parsed.command is None:  #неизвестная команда
+                    self.write_output(f"неизвестная команда: {parsed.name}")  #сообщение об ошибке
+                else:  #обработчик найден при разборе: таблица и getattr не нужны
+                    self.invoke(parsed.command, parsed.handler, parsed.args)
+                if not self.is_running:  #exit завершает скрипт
+                    break
+                yield parsed.line_num, line_count  #команда выполнена - отдаем управление
 
         except Exception as e:  #обработка исключений
             self.write_output(f"ошибка чтения скрипта: {e}")  #сообщение об ошибке
+            self.exit_status = 1  #скрипт не выполнен
+        finally:
+            self.in_script = False
 
         self.write_output("выполнение скрипта завершено")  #сообщение о завершении
 
 
+tk = tkfont = None  #tkinter импортируется только для окна: безоконные режимы работают без _tkinter
+
+
+def _import_tk():
+    """импорт tkinter при создании окна"""
+    global tk, tkfont
+    import tkinter as tk
+    import tkinter.font as tkfont
+
+
+class FileViewer:
+    """окно просмотра файла: в текстовое поле выводятся только видимые строки и только видимая часть каждой строки,
+    остальное читается при прокрутке"""
+
+    def __init__(self, root, vfs, path):
+        self.vfs = vfs  #vfs с просматриваемым файлом
+        self.path = path  #канонический путь к файлу
+        self.total = vfs.get_line_count(path)  #число строк (индекс смещений строится один раз)
+        self.top = 0  #номер первой видимой строки (с 0)
+        self.rows = VIEWER_ROWS  #сколько строк помещается в окно
+        self.left = 0  #смещение видимой части строк в байтах
+        self.columns = VIEWER_COLUMNS  #сколько символов строки помещается в окно
+        self.longest = 0  #длина самой длинной видимой строки в байтах
+
+        self.window = tk.Toplevel(root)  #отдельное окно просмотра
+        self.window.title(f"просмотр: {path}")
+        self.window.geometry("800x600")
+
+        frame = tk.Frame(self.window)  #фрейм для текста и полос прокрутки
+        frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.scrollbar = tk.Scrollbar(frame, command=self.on_scroll)  #прокрутка по строкам файла, а не виджета
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.xscroll = tk.Scrollbar(frame, orient=tk.HORIZONTAL, command=self.on_xscroll)  #прокрутка по байтам строк
+        self.xscroll.pack(side=tk.BOTTOM, fill=tk.X)
+        self.text = tk.Text(frame, wrap=tk.NONE, height=self.rows, width=self.columns, background="white",
+                            font=("consolas", 10))  #одна строка файла - одна строка поля
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.status = tk.Label(self.window, text="", font=("consolas", 10))  #номера видимых строк
+        self.status.pack(side=tk.BOTTOM, fill=tk.X)
+        font = tkfont.Font(font=self.text.cget('font'))
+        self.line_height = font.metrics('linespace')  #высота строки в пикселях
+        self.char_width = font.measure('0')  #ширина символа моноширинного шрифта
+
+        self.text.bind("<Configure>", self.on_resize)  #число видимых строк зависит от размера окна
+        #знак, а не величина delta: windows дает кратные 120, macos - единицы
+        self.text.bind("<MouseWheel>", lambda event: self.scroll_to(self.top + (-3 if event.delta > 0 else 3)))
+        self.text.bind("<Button-4>", lambda event: self.scroll_to(self.top - 3))  #колесо мыши в linux
+        self.text.bind("<Button-5>", lambda event: self.scroll_to(self.top + 3))
+        for key, step in (("<Up>", -1), ("<Down>", 1)):
+            self.window.bind(key, lambda event, step=step: self.scroll_to(self.top + step))
+        for key, step in (("<Left>", -VIEWER_SCROLL_STEP), ("<Right>", VIEWER_SCROLL_STEP)):
+            self.window.bind(key, lambda event, step=step: self.scroll_x_to(self.left + step))
+        self.window.bind("<Prior>", lambda event: self.scroll_to(self.top - self.rows))  #page up
+        self.window.bind("<Next>", lambda event: self.scroll_to(self.top + self.rows))  #page down
+        self.window.bind("<Home>", lambda event: self.scroll_to(0))
+        self.window.bind("<End>", lambda event: self.scroll_to(self.total))
+        self.render()
+
+    def on_resize(self, event):
+        """пересчет числа видимых строк и символов после изменения размера окна"""
+        rows = max(1, event.height // max(1, self.line_height))
+        columns = max(1, event.width // max(1, self.char_width))
+        if rows != self.rows or columns != self.columns:
+            self.rows, self.columns = rows, columns
+            self.scroll_to(self.top, force=True)
+
+    def on_scroll(self, action, value, unit=None):
+        """команды полосы прокрутки: moveto доля | scroll число units|pages"""
+        if action == 'moveto':
+            self.scroll_to(int(float(value) * self.total))
+        elif action == 'scroll':
+            self.scroll_to(self.top + int(value) * (self.rows if unit == 'pages' else 1))
+
+    def on_xscroll(self, action, value, unit=None):
+        """команды горизонтальной полосы прокрутки: доли и шаги в байтах самой длинной видимой строки"""
+        if action == 'moveto':
+            self.scroll_x_to(int(float(value) * self.longest))
+        elif action == 'scroll':
+            self.scroll_x_to(self.left + int(value) * (self.columns if unit == 'pages' else VIEWER_SCROLL_STEP))
+
+    def scroll_x_to(self, left):
+        """сдвиг видимой части строк к байту left с перерисовкой только при изменении"""
+        left = max(0, min(left, self.longest - self.columns))  #конец самой длинной строки остается виден
+        if left != self.left:
+            self.left = left
+            self.render()
+        return "break"
+
+    def scroll_to(self, top, force=False):
+        """переход к строке top (с 0) с перерисовкой только при изменении"""
+        top = max(0, min(top, self.total - self.rows))  #последняя страница заполнена целиком
+        if top != self.top or force:
+            self.top = top
+            self.render()
+        return "break"  #стандартная прокрутка поля не нужна
+
+    def render(self):
+        """вывод видимой области: по индексу смещений читаются только видимые строки и только видимая часть каждой"""
+        last = min(self.total, self.top + self.rows)  #последняя видимая строка (с 1)
+        rows, self.longest = self.vfs.get_line_window(self.path, self.top + 1, last, self.left, self.columns) or ([], 0)
+        if self.left > max(0, self.longest - self.columns):  #после вертикальной прокрутки строки стали короче
+            self.left = max(0, self.longest - self.columns)
+            rows, _ = self.vfs.get_line_window(self.path, self.top + 1, last, self.left, self.columns) or ([], 0)
+        self.text.configure(state='normal')
+        self.text.delete('1.0', tk.END)  #в поле только текущая страница
+        self.text.insert(tk.END, "\n".join(rows))
+        self.text.configure(state='disabled')
+        total = max(self.total, 1)
+        self.scrollbar.set(self.top / total, last / total)  #положение ползунка по номерам строк
+        longest = max(self.longest, 1)
+        self.xscroll.set(self.left / longest, min(1.0, (self.left + self.columns) / longest))  #по байтам строк
+        self.status.configure(text=f"строки {self.top + 1}-{last} из {self.total}, байт {self.left}")
+
+
+class VFSEmulator(VFSShell):
+    def __init__(self, root, vfs_path=None, script_path=None, lazy=False, stats_log=None):
+        _import_tk()  #окно создано вызывающим кодом, tkinter уже загружен
+        self.root = root  #главное окно
+        self.root.title("finikato.os(vfs)")  #заголовок окна
+        self.root.configure(background="#7366bd")  #фон окна
+        self.root.geometry("800x600")  #размер окна
+
+        self.program_dir = os.path.dirname(os.path.abspath(__file__))  #директория программы
+        os.chdir(self.program_dir)  #меняем текущую директорию
+
+        super().__init__(VFS(lazy=lazy), script_path, stats_log=stats_log)  #движок команд с новой vfs
+        self.vfs_path = os.path.abspath(vfs_path) if vfs_path else self.program_dir  #путь к vfs
+        #записи старше лимита окна все равно были бы удалены, поэтому буфер ограничен тем же лимитом
+        self._output_buffer = deque(maxlen=OUTPUT_MAX_LINES)  #буфер еще не выведенного текста
+        self._flush_scheduled = False  #флаг запланированного сброса буфера
+        self._script_steps = None  #генератор выполняемого скрипта
+        self._script_done = None  #действие после завершения скрипта
+
+        self.create_gui()  #создание графического интерфейса
+
+        self.write_output(f"программа запущена из: {self.program_dir}")  #информация о запуске
+        self.write_output(f"текущая рабочая директория: {os.getcwd()}")  #текущая директория
+
+        if self.script_path:  #если указан путь к скрипту
+            exists = "найден" if os.path.exists(self.script_path) else "не найден"  #проверка существования
+            self.write_output(f"путь к скрипту: {self.script_path} ({exists})")  #вывод информации о скрипте
+
+        self.write_output("\nкоманды: set vfs_path|script_path <значение>, start, exit, vfs-info")  #список команд
+        self.write_output("=" * 50)  #разделитель
+
+        #автозагрузка vfs если указан путь
+        if vfs_path and all(map(os.path.exists, _layer_paths(vfs_path))):  #проверка существования vfs (всех слоев)
+            success, message = self.vfs.load(vfs_path)  #загрузка vfs (xml или бинарный образ)
+            self.write_output(message)  #вывод сообщения
+            if success:  #если загрузка успешна
+                self.write_output(self.vfs.get_info())  #вывод информации о vfs
+
+        if self.script_path and os.path.exists(self.script_path):  #если скрипт существует
+            self.root.after(100, self.start_emulator)  #автозапуск через 100мс
+
+    def create_gui(self):
+        """создание графического интерфейса"""
+        create = tk.Label(self.root, text="меню пользователя:", background="#ffffff",  #метка заголовка
+                          font=("comic sans ms", 16))  #шрифт заголовка
+        create.grid(column=0, row=0, padx=10, pady=10, columnspan=2)  #размещение заголовка
+
+        text_frame = tk.Frame(self.root)  #фрейм для текстового поля
+        text_frame.grid(column=0, row=1, columnspan=2, padx=10, pady=10, sticky="nsew")  #размещение фрейма
+
+        self.root.grid_rowconfigure(1, weight=1)  #настройка веса строки
+        self.root.grid_columnconfigure(0, weight=1)  #настройка веса колонки
+
+        scrollbar = tk.Scrollbar(text_frame)  #создание скроллбара
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)  #размещение скроллбара
+
+        self.output_area = tk.Text(text_frame, width=70, height=20, background="white",  #текстовое поле вывода
+                                   font=("consolas", 10), yscrollcommand=scrollbar.set)  #настройки текстового поля
+        self.output_area.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)  #размещение текстового поля
+
+        scrollbar.config(command=self.output_area.yview)  #связываем скроллбар с текстовым полем
+
+        self.output_area.insert(tk.END, "добро пожаловать в finikato.os с vfs\nвведите команду\n")  #начальное сообщение
+        self.output_area.configure(state='disabled')  #блокируем редактирование
+
+        input_frame = tk.Frame(self.root, background="#7366bd")  #фрейм для ввода
+        input_frame.grid(column=0, row=2, columnspan=2, padx=10, pady=10)  #размещение фрейма ввода
+
+        self.entry = tk.Entry(input_frame, width=50, font=("arial", 12))  #поле ввода команд
+        self.entry.pack(side=tk.LEFT, padx=5)  #размещение поля ввода
+        self.entry.bind("<Return>", self.process_command)  #привязка клавиши enter
+        self.entry.focus()  #установка фокуса на поле ввода
+
+        self.btn = tk.Button(input_frame, text="ввод", command=self.process_command,  #кнопка ввода
+                             font=("comic sans ms", 12), background="#4caf50")  #настройки кнопки
+        self.btn.pack(side=tk.LEFT, padx=5)  #размещение кнопки
+
+        button_frame = tk.Frame(self.root, background="#7366bd")  #фрейм для дополнительных кнопок
+        button_frame.grid(column=0, row=3, columnspan=2, pady=5)  #размещение фрейма кнопок
+
+        btn_clear = tk.Button(button_frame, text="очистить вывод", command=self.clear_output,  #кнопка очистки
+                              font=("comic sans ms", 10), background="#ff5722")  #настройки кнопки очистки
+        btn_clear.pack(side=tk.LEFT, padx=5)  #размещение кнопки очистки
+
+        self.btn_cancel = tk.Button(button_frame, text="отмена скрипта", command=self.cancel_script,  #кнопка отмены
+                                    font=("comic sans ms", 10), background="#ffc107", state='disabled')
+        self.btn_cancel.pack(side=tk.LEFT, padx=5)  #размещение кнопки отмены
+
+        self.progress_label = tk.Label(button_frame, text="", background="#7366bd",  #прогресс выполнения скрипта
+                                       foreground="#ffffff", font=("consolas", 10))
+        self.progress_label.pack(side=tk.LEFT, padx=5)  #размещение метки прогресса
+
+    def write_output(self, text):
+        """вывод текста в область вывода (через буфер, сбрасываемый по таймеру)"""
+        self._output_buffer.append(text)  #накапливаем текст
+        if not self._flush_scheduled:  #сброс еще не запланирован
+            self._flush_scheduled = True
+            self.root.after(OUTPUT_FLUSH_INTERVAL, self.flush_output)  #сброс на ближайшем тике
+
+    def flush_output(self):
+        """вставка накопленного вывода в окно одной порцией"""
+        buffer = self._output_buffer  #буфер вывода
+        count = min(len(buffer), OUTPUT_CHUNK_LINES)  #размер порции
+        chunk = [buffer.popleft() for _ in range(count)]  #записи порции по порядку
+        if chunk:  #есть что выводить
+            self.output_area.configure(state='normal')  #включаем редактирование
+            self.output_area.insert(tk.END, "\n".join(chunk) + "\n")  #добавляем порцию целиком
+            lines = int(self.output_area.index('end-1c').split('.')[0])  #число строк в окне
+            if lines > OUTPUT_MAX_LINES:  #окно выросло больше лимита
+                self.output_area.delete('1.0', f"{lines - OUTPUT_MAX_LINES + 1}.0")  #удаляем старые строки
+            self.output_area.see(tk.END)  #автопрокрутка к концу
+            self.output_area.configure(state='disabled')  #отключаем редактирование
+        if buffer:  #остаток выводим на следующем тике, не блокируя окно
+            self.root.after(OUTPUT_FLUSH_INTERVAL, self.flush_output)
+        else:
+            self._flush_scheduled = False  #буфер пуст
+
+    def clear_output(self):
+        """очистка текстового поля вывода"""
+        self._output_buffer.clear()  #невыведенный текст тоже очищаем
+        self.output_area.configure(state='normal')  #включаем редактирование
+        self.output_area.delete(1.0, tk.END)  #удаляем весь текст
+        self.output_area.insert(tk.END, "введите команду\n")  #добавляем начальное сообщение
+        self.output_area.see(tk.END)  #автопрокрутка к концу
+        self.output_area.configure(state='disabled')  #отключаем редактирование
+
+    def handle_cat(self, args):
+        """обработка команды cat: большие файлы открываются в окне просмотра"""
+        if args and args[0] not in ('--bytes', '--lines') and self.vfs.loaded:  #файл целиком
+            file_path = self._resolve(' '.join(args))  #канонический путь к файлу
+            if self.vfs.file_exists(file_path) and self.vfs._file_size(file_path) > VIEWER_THRESHOLD:
+                self.handle_less(args)  #весь файл в текстовое поле не вставляется
+                return
+        super().handle_cat(args)
+
+    def open_viewer(self, file_path):
+        """открытие окна просмотра файла"""
+        viewer = FileViewer(self.root, self.vfs, file_path)  #окно со строками только видимой области
+        self.write_output(f"файл {file_path} открыт в окне просмотра (строк: {viewer.total})")
+
+    def process_command(self, event=None):
+        """обработка команд пользователя"""
+        command = self.entry.get().strip()  #получение команды из поля ввода
+        self.entry.delete(0, tk.END)  #очищаем поле ввода
+
+        if not command:  #если команда пустая
+            return  #выход из функции
+
+        if self._script_steps is not None:  #скрипт еще выполняется
+            self.write_output("выполняется скрипт: дождитесь завершения или нажмите 'отмена скрипта'")
+            return  #команды не смешиваются с командами скрипта
+
+        if self.is_running:  #если эмулятор запущен
+            self.write_output(f"{self.prompt}{command}")  #вывод с приглашением vfs
+        else:  #если эмулятор не запущен
+            self.write_output(f"> {command}")  #вывод с приглашением настроек
+
+        self.execute_command(command)  #выполнение команды
+
+    def run_script(self, on_done):
+        """запуск скрипта по частям на тиках окна, чтобы gui не блокировался"""
+        self._script_steps = self.iter_script()  #генератор шагов скрипта
+        self._script_done = on_done  #действие после завершения
+        self.btn_cancel.configure(state='normal')  #скрипт можно прервать
+        self.root.after(0, self._script_step)  #первый шаг на ближайшем тике
+
+    def _script_step(self):
+        """выполнение команд скрипта в пределах бюджета времени одного тика"""
+        if self._script_steps is None:  #скрипт уже отменен
+            return
+        deadline = time.perf_counter() + SCRIPT_STEP_BUDGET  #конец бюджета тика
+        try:
+            while True:  #выполняем команды, пока не исчерпан бюджет
+                line_num, total = next(self._script_steps)  #очередная команда
+                if time.perf_counter() >= deadline:
+                    break
+        except StopIteration:  #скрипт завершен
+            self._finish_script()
+            return
+        self.progress_label.configure(text=f"скрипт: строка {line_num} из {total}")  #прогресс
+        self.root.after(1, self._script_step)  #продолжение после обработки событий окна
+
+    def cancel_script(self):
+        """прерывание выполняющегося скрипта"""
+        if self._script_steps is None:  #скрипт не выполняется
+            return
+        self._script_steps.close()  #останавливаем генератор на текущей команде
+        self.write_output("выполнение скрипта прервано пользователем")  #сообщение об отмене
+        self._finish_script()
+
+    def _finish_script(self):
+        """общие действия после завершения или отмены скрипта"""
+        self._script_steps = None  #скрипт больше не выполняется
+        self.btn_cancel.configure(state='disabled')  #отменять нечего
+        self.progress_label.configure(text="")  #скрываем прогресс
+        on_done, self._script_done = self._script_done, None  #действие после скрипта
+        if on_done:
+            on_done()
+
+    def quit(self):
+        """завершение программы"""
+        self.close_stats_log()  #дописываем журнал команд
+        self.root.destroy()  #закрытие главного окна
+
+
+def run_headless(vfs_path, script_path, output_path=None, lazy=False, stats_log=None):
+    """выполнение стартового скрипта без gui с выводом в stdout или файл"""
+    output = open(output_path, 'w', encoding='utf-8') if output_path else sys.stdout  #поток вывода
+    shell = None
+    try:
+        shell = VFSShell(VFS(lazy=lazy), script_path, output, stats_log)  #движок команд без tk
+        if vfs_path:  #если указан путь к vfs
+            shell.vfs_path = os.path.abspath(vfs_path)  #сохранение пути
+            success, message = shell.vfs.load(vfs_path)  #загрузка vfs (xml или бинарный образ)
+            shell.write_output(message)  #вывод сообщения
+            if not success:  #vfs не загружена - скрипт выполнять бессмысленно
+                return 2
+            shell.write_output(shell.vfs.get_info())  #вывод информации о vfs
+        shell.start_emulator()  #запуск эмулятора и выполнение скрипта
+        return shell.exit_status  #код завершения
+    finally:
+        if shell is not None:  #дописываем журнал команд
+            shell.close_stats_log()
+        if output is not sys.stdout:  #закрываем файл вывода
+            output.close()
+        else:
+            output.flush()  #выталкиваем буфер stdout
+
+
+_batch_vfs = None  #vfs, общая для процессов пакетного режима (передается через fork)
+
+
+def _init_batch_worker(vfs_path, lazy):
+    """загрузка vfs в рабочем процессе, если fork недоступен (windows): один раз на процесс, а не на скрипт"""
+    global _batch_vfs
+    _batch_vfs = VFS(lazy=lazy)  #своя копия vfs в процессе
+    _batch_vfs.load(vfs_path)  #загрузка образа
+
+
+def _run_batch_script(script_path):
+    """выполнение одного скрипта в рабочем процессе; изменения скрипта откатываются, следующий видит исходную vfs"""
+    output = io.StringIO()  #вывод скрипта собирается в памяти
+    tracing = tracemalloc.is_tracing()  #stats memory в скрипте не должен влиять на следующие
+    _batch_vfs.checkpoint()  #скрытый снимок исходного состояния
+    shell = VFSShell(_batch_vfs, script_path, output)  #движок с общей vfs и своей текущей директорией
+    try:
+        shell.start_emulator()  #выполнение скрипта
+    finally:
+        shell.close_stats_log()
+        _batch_vfs.rollback()  #откат только изменений этого скрипта
+        if tracemalloc.is_tracing() and not tracing:
+            tracemalloc.stop()
+    return script_path, output.getvalue(), shell.exit_status  #результат для главного процесса
+
+
+def run_batch(vfs_path, script_paths, jobs=None, output_dir=None, lazy=False):
+    """выполнение набора скриптов пулом процессов над один раз загруженной vfs"""
+    global _batch_vfs
+    vfs = VFS(lazy=lazy)  #vfs загружается один раз в главном процессе
+    success, message = vfs.load(vfs_path)  #загрузка vfs (xml или бинарный образ)
+    print(message)  #вывод сообщения
+    if not success:  #без vfs скрипты не выполняются
+        return 2
+    _batch_vfs = vfs  #дочерние процессы получат vfs через fork
+
+    if "fork" in multiprocessing.get_all_start_methods():  #образ разделяется копированием при записи
+        context = multiprocessing.get_context("fork")
+        initializer, initargs = None, ()
+    else:  #без fork каждый процесс загружает образ сам
+        context = multiprocessing.get_context("spawn")
+        initializer, initargs = _init_batch_worker, (','.join(map(os.path.abspath, _layer_paths(vfs_path))), lazy)
+
+    if output_dir:  #вывод скриптов сохраняется в отдельные файлы
+        os.makedirs(output_dir, exist_ok=True)
+
+    status = 0  #итоговый код завершения
+    scripts = [os.path.abspath(path) for path in script_paths]  #абсолютные пути скриптов
+    for script in scripts:  #скрипты разбираются один раз, процессы получают кэш через fork
+        if os.path.exists(script):
+            compile_script(script, VFSShell)
+    #процесс выполняет скрипты по очереди: изменения каждого откатываются снимком, образ не загружается заново
+    with context.Pool(jobs, initializer, initargs) as pool:
+        for index, (script, text, code) in enumerate(pool.imap(_run_batch_script, scripts), 1):
+            status = max(status, code)  #худший код среди скриптов
+            if output_dir:  #файл вывода: номер и имя скрипта
+                name = f"{index:04d}_{os.path.basename(script)}.out"
+                with open(os.path.join(output_dir, name), 'w', encoding='utf-8') as f:
+                    f.write(text)
+            else:  #вывод скриптов по порядку в stdout
+                sys.stdout.write(f"===== {script} =====\n{text}")
+            print(f"{script}: код завершения {code}")  #статус скрипта
+    return status  #0 - все скрипты выполнены успешно
+
+
+def parse_address(address):
+    """адрес сервера: 'хост:порт' - tcp (хост по умолчанию 127.0.0.1), иначе путь к unix сокету; (хост или путь, порт)"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():  #tcp адрес
+        return host or "127.0.0.1", int(port)
+    return address, None  #unix сокет
+
+
+class ServerShell(VFSShell):
+    """движок команд одного подключения сервера: общая vfs, своя текущая директория"""
+
+    vfs_commands = SERVER_COMMANDS  #vfs общая для всех подключений, файлы хоста недоступны
+
+    def __init__(self, vfs):
+        super().__init__(vfs, output=io.StringIO())  #вывод команды собирается и отправляется одним блоком
+        self.is_running = True  #доступны команды vfs (образ загружен сервером)
+        self.stream = None  #(путь, хвост) файла, содержимое которого отправляется блоками после команды
+
+    def take_output(self):
+        """накопленный вывод команды с очисткой буфера"""
+        text = self.output.getvalue()
+        self.output.seek(0)
+        self.output.truncate()
+        return text
+
+    def handle_pwd(self, args):
+        """обработка команды pwd"""
+        self.write_output(self.current_dir)  #текущая директория подключения
+
+    def handle_stats(self, args):
+        """обработка команды stats: журнал json lines пишется в файл хоста, поэтому клиентам недоступен"""
+        if args and args[0] == "log":
+            self.write_output("ошибка: stats log недоступен при подключении к серверу")
+            return
+        super().handle_stats(args)
+
+    def handle_cat(self, args):
+        """обработка команды cat: содержимое файла целиком не собирается в памяти, а отправляется блоками"""
+        if args and args[0] not in ('--bytes', '--lines'):  #файл целиком
+            file_path = self._resolve(' '.join(args))  #канонический путь к файлу
+            if self.vfs.file_exists(file_path):
+                if not self._binary_notice(file_path):  #двоичный файл - только через hexdump
+                    self.write_output(f"содержимое файла {file_path}:")  #заголовок как у обычного cat
+                    self.write_output("-" * 40)  #разделитель
+                    self.stream = (file_path, "\n" + "-" * 40 + "\n")
+                return
+        super().handle_cat(args)
+
+    def open_viewer(self, file_path):
+        """less по сети: содержимое файла отправляется блоками"""
+        self.stream = (file_path, "\n")
+
+
+def _write_frame(writer, text):
+    """отправка блока ответа: длина в байтах, перевод строки, данные (пустой блок - конец ответа)"""
+    data = text.encode('utf-8')
+    if data:
+        writer.write(b"%d\n" % len(data) + data)
+
+
+async def _read_command(reader):
+    """следующая строка команды: (байты строки, превышен ли лимит); слишком длинная строка дочитывается
+    и отбрасывается по частям, не накапливаясь в памяти; b"" - клиент закрыл соединение"""
+    overlong = False  #часть строки уже отброшена
+    while True:
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:  #конец потока: последняя строка может быть без перевода строки
+            return (b"" if overlong else e.partial), overlong
+        except asyncio.LimitOverrunError as e:  #перевода строки нет в пределах лимита
+            try:
+                await reader.readexactly(e.consumed)  #отбрасываем прочитанную часть строки
+            except asyncio.IncompleteReadError:
+                return b"", True
+            overlong = True
+            continue
+        return (b"\n" if overlong else line), overlong
+
+
+async def _serve_connection(vfs, reader, writer):
+    """обслуживание одного подключения: команды выполняются по порядку, ответы идут в том же порядке"""
+    shell = ServerShell(vfs)  #своя текущая директория у каждого подключения
+    try:
+        while shell.is_running:  #exit закрывает подключение
+            line, overlong = await _read_command(reader)  #следующая команда (клиент может прислать несколько подряд)
+            if not line:  #клиент закрыл соединение
+                break
+            if overlong:  #строка отброшена, подключение продолжает работать
+                _write_frame(writer, f"ошибка: строка команды длиннее {SERVE_LINE_LIMIT} байт\n")
+                writer.write(b"0\n")  #конец ответа
+                await writer.drain()
+                continue
+            try:
+                shell.execute_command(line.decode('utf-8', errors='replace'))
+            except Exception as e:  #ошибка одной команды не закрывает подключение
+                shell.write_output(f"ошибка: {e}")
+            _write_frame(writer, shell.take_output())
+            if shell.stream is not None:  #содержимое файла блоками по SERVE_CHUNK
+                path, tail = shell.stream
+                shell.stream = None
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')  #символ может попасть на границу блока
+                for start in range(0, vfs._file_size(path), SERVE_CHUNK):
+                    data = vfs.read_file_range(path, start, start + SERVE_CHUNK)
+                    if data is None:  #файл удален другим подключением
+                        break
+                    _write_frame(writer, decoder.decode(data))
+                    await writer.drain()  #медленный клиент не накапливает весь файл в буфере сервера
+                _write_frame(writer, decoder.decode(b'', True) + tail)
+            writer.write(b"0\n")  #конец ответа
+            await writer.drain()
+    except ConnectionError:  #клиент отключился, не дочитав ответ
+        pass
+    finally:
+        shell.close_stats_log()
+        writer.close()
+
+
+async def _serve(vfs, address):
+    """запуск сервера и обслуживание подключений до прерывания"""
+    handler = functools.partial(_serve_connection, vfs)
+    host, port = parse_address(address)
+    if port is None:  #unix сокет; оставшийся от прошлого запуска файл сокета удаляется
+        if os.path.exists(host) and stat.S_ISSOCK(os.stat(host).st_mode):
+            os.unlink(host)
+        server = await asyncio.start_unix_server(handler, path=host, limit=SERVE_LINE_LIMIT)
+    else:
+        server = await asyncio.start_server(handler, host, port, limit=SERVE_LINE_LIMIT)
+    print(f"vfs '{vfs.name}' доступна по адресу {address}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def run_server(vfs_path, address, lazy=False):
+    """загрузка vfs и обслуживание клиентов (vfs_client.py) по tcp или unix сокету"""
+    if not vfs_path:  #сервер без образа не запускается
+        print("ошибка: для --serve укажите --vfs_path")
+        return 2
+    vfs = VFS(lazy=lazy)  #vfs загружается один раз для всех подключений
+    success, message = vfs.load(vfs_path)  #загрузка vfs (xml или бинарный образ)
+    print(message, flush=True)  #вывод сообщения
+    if not success:  #без vfs обслуживать нечего
+        return 2
+    try:
+        asyncio.run(_serve(vfs, address))  #все подключения в одном потоке: команды не выполняются одновременно
+    except KeyboardInterrupt:  #остановка сервера
+        pass
+    finally:
+        host, port = parse_address(address)
+        if port is None and os.path.exists(host):  #удаление файла unix сокета
+            os.unlink(host)
+    return 0
+
+
+def compile_image(xml_path, image_path):
+    """преобразование xml образа в бинарный образ для быстрого открытия через mmap"""
+    vfs = VFS()  #временная vfs для разбора xml
+    success, message = vfs.load_from_xml(xml_path, streaming=True)  #потоковый разбор xml
+    if not success:  #xml не удалось разобрать
+        return False, message  #возврат ошибки
+    count = vfs.save_image(image_path)  #запись бинарного образа
+    return True, f"образ '{vfs.name}' сохранен в {image_path} (элементов: {count})"  #возврат успеха
+
+
 def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--compile":  #преобразование xml в бинарный образ без gui
+        success, message = compile_image(sys.argv[2], sys.argv[3])  #компиляция образа
+        print(message)  #вывод результата
+        sys.exit(0 if success else 1)  #код возврата
+
     vfs_path, script_path = None, None  #инициализация переменных путей
+    lazy = False  #ленивая загрузка содержимого файлов
+    headless, output_path = False, None  #режим без gui и файл для вывода
+    batch_scripts, jobs = [], None  #скрипты пакетного режима и число процессов
+    stats_log = None  #журнал json lines с временем каждой команды
+    serve_address = None  #адрес сервера (tcp хост:порт или путь к unix сокету)
 
     i = 1  #начальный индекс аргументов
     while i < len(sys.argv):  #обработка аргументов командной строки
@@ -670,11 +3348,44 @@ def main():
         elif sys.argv[i] == "--script_path" and i + 1 < len(sys.argv):  #проверка аргумента script_path
             script_path = sys.argv[i + 1]  #сохранение пути скрипта
             i += 2  #переход через два аргумента
+        elif sys.argv[i] == "--lazy":  #ленивая загрузка содержимого файлов
+            lazy = True
+            i += 1  #переход к следующему аргументу
+        elif sys.argv[i] == "--headless":  #выполнение скрипта без gui
+            headless = True
+            i += 1  #переход к следующему аргументу
+        elif sys.argv[i] == "--output" and i + 1 < len(sys.argv):  #файл (или директория в пакетном режиме) для вывода
+            output_path = sys.argv[i + 1]  #сохранение пути вывода
+            i += 2  #переход через два аргумента
+        elif sys.argv[i] == "--batch":  #пакетный режим: скрипты до следующего параметра
+            i += 1  #переход к первому скрипту
+            while i < len(sys.argv) and not sys.argv[i].startswith("--"):
+                batch_scripts.append(sys.argv[i])  #сохранение пути скрипта
+                i += 1
+        elif sys.argv[i] == "--stats_log" and i + 1 < len(sys.argv):  #журнал команд в json lines
+            stats_log = os.path.abspath(sys.argv[i + 1])  #абсолютный путь: окно меняет рабочую директорию
+            i += 2  #переход через два аргумента
+        elif sys.argv[i] == "--serve" and i + 1 < len(sys.argv):  #режим сервера
+            serve_address = sys.argv[i + 1]  #сохранение адреса
+            i += 2  #переход через два аргумента
+        elif sys.argv[i] == "--jobs" and i + 1 < len(sys.argv):  #число процессов пакетного режима
+            jobs = int(sys.argv[i + 1])  #сохранение числа процессов
+            i += 2  #переход через два аргумента
         else:  #неизвестный аргумент
             i += 1  #переход к следующему аргументу
 
+    if serve_address:  #режим сервера: tk не создается
+        sys.exit(run_server(vfs_path, serve_address, lazy=lazy))
+
+    if batch_scripts:  #пакетный режим: tk не создается
+        sys.exit(run_batch(vfs_path, batch_scripts, jobs, output_path, lazy=lazy))
+
+    if headless:  #безоконный режим: tk не создается
+        sys.exit(run_headless(vfs_path, script_path, output_path, lazy=lazy, stats_log=stats_log))
+
+    _import_tk()  #tkinter нужен только окну
     root = tk.Tk()  #создание главного окна
-    app = VFSEmulator(root, vfs_path, script_path)  #создание экземпляра эмулятора
+    app = VFSEmulator(root, vfs_path, script_path, lazy=lazy, stats_log=stats_log)  #создание экземпляра эмулятора
     root.mainloop()  #запуск главного цикла
 
 
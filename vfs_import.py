@@ -0,0 +1,325 @@
+"""импорт директории хоста или архива (.tar, .tar.gz, .tar.bz2, .tar.xz, .zip) в xml образ vfs
+
+запуск:
+  python vfs_import.py <директория|архив> <образ.xml> [--name имя] [--jobs 8] [--no_modes]
+
+файлы читаются и кодируются (base64 для двоичных) пулом потоков, xml пишется потоково в порядке имен,
+поэтому образ не зависит от числа потоков и порядка файлов в архиве; --no_modes - права по умолчанию
+"""
+import os
+import posixpath
+import stat
+import sys
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from vfs_emulator import VFS, XmlImageWriter, file_xml
+
+IMPORT_WINDOW = 8  #сколько файлов на поток читается заранее (ограничивает память)
+
+
+class _DirectorySource:
+    """директория хоста: обход в порядке имен, символические ссылки и спецфайлы пропускаются"""
+
+    thread_safe = True  #файлы читаются рабочими потоками
+
+    def __init__(self, root):
+        self.root = root  #корень импорта
+        self.skipped = 0  #пропущенные элементы (ссылки, сокеты, недоступные директории)
+
+    def root_mode(self):
+        """права корневой директории"""
+        return stat.S_IMODE(os.stat(self.root).st_mode)
+
+    def walk(self):
+        """события обхода: ('dir', имя, права), ('end',), ('file', имя, права, ключ чтения)"""
+        stack = [iter(self._entries(self.root))]  #явный стек итераторов директорий
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:  #директория пройдена
+                stack.pop()
+                if stack:
+                    yield ('end',)
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                self.skipped += 1
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                yield ('dir', entry.name, stat.S_IMODE(st.st_mode))
+                stack.append(iter(self._entries(entry.path)))
+            elif stat.S_ISREG(st.st_mode):
+                yield ('file', entry.name, stat.S_IMODE(st.st_mode), entry.path)
+            else:  #ссылки, сокеты, устройства
+                self.skipped += 1
+
+    def _entries(self, path):
+        """элементы директории по имени"""
+        try:
+            with os.scandir(path) as entries:
+                return sorted(entries, key=lambda entry: entry.name)
+        except OSError:  #директория недоступна - импортируется пустой
+            self.skipped += 1
+            return []
+
+    def read(self, key):
+        """содержимое файла"""
+        with open(key, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+
+class _ArchiveSource:
+    """архив: список элементов собирается в дерево и обходится в порядке имен"""
+
+    def __init__(self):
+        self.tree = [None, {}]  #[права, {имя: узел}] директории, (права, ключ) файла
+        self.skipped = 0  #пропущенные элементы (ссылки, устройства)
+
+    def _add(self, name, mode, key=None):
+        """элемент архива по его пути (недостающие директории создаются с правами по умолчанию)"""
+        parts = [part for part in posixpath.normpath('/' + name).split('/') if part]  #канонический путь без ..
+        if not parts:  #корень архива
+            if key is None:
+                self.tree[0] = mode
+            return
+        node = self.tree
+        for part in parts[:-1]:
+            child = node[1].get(part)
+            if not isinstance(child, list):  #директории еще нет (или на ее месте был файл)
+                child = node[1][part] = [None, {}]
+            node = child
+        if key is None:  #директория
+            child = node[1].get(parts[-1])
+            if isinstance(child, list):
+                child[0] = mode
+            else:
+                node[1][parts[-1]] = [mode, {}]
+        else:  #файл (повторный элемент с тем же путем заменяет прежний, как при распаковке)
+            node[1][parts[-1]] = (mode, key)
+
+    def root_mode(self):
+        """права корневой директории"""
+        return self.tree[0]
+
+    def walk(self):
+        """события обхода: ('dir', имя, права), ('end',), ('file', имя, права, ключ чтения)"""
+        stack = [iter(sorted(self.tree[1].items()))]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:  #директория пройдена
+                stack.pop()
+                if stack:
+                    yield ('end',)
+                continue
+            name, node = item
+            if isinstance(node, list):
+                yield ('dir', name, node[0])
+                stack.append(iter(sorted(node[1].items())))
+            else:
+                yield ('file', name, node[0], node[1])
+
+
+class _ZipSource(_ArchiveSource):
+    """zip архив: ZipFile читает элементы из общего файла под блокировкой, потоки читают параллельно"""
+
+    thread_safe = True
+
+    def __init__(self, path):
+        super().__init__()
+        self.archive = zipfile.ZipFile(path)
+        for info in self.archive.infolist():
+            mode = (info.external_attr >> 16) & 0o777 or None  #права unix, если архив создан в unix
+            self._add(info.filename, mode, None if info.is_dir() else info)
+
+    def read(self, key):
+        """содержимое элемента (распаковка в потоке)"""
+        return self.archive.read(key)
+
+    def close(self):
+        self.archive.close()
+
+
+class _TarSource(_ArchiveSource):
+    """tar архив (в том числе сжатый): элементы читаются главным потоком, пул только кодирует"""
+
+    thread_safe = False  #TarFile читает через общий поток без блокировки
+
+    def __init__(self, path):
+        super().__init__()
+        self.archive = tarfile.open(path, 'r:*')  #сжатие определяется автоматически
+        for member in self.archive.getmembers():
+            if member.isdir():
+                self._add(member.name, member.mode & 0o777)
+            elif member.isfile():
+                self._add(member.name, member.mode & 0o777, member)
+            else:  #ссылки и устройства
+                self.skipped += 1
+
+    def read(self, key):
+        """содержимое элемента"""
+        return self.archive.extractfile(key).read()
+
+    def close(self):
+        self.archive.close()
+
+
+def open_source(path):
+    """источник импорта по пути: директория, tar или zip архив"""
+    if os.path.isdir(path):
+        return _DirectorySource(path)
+    if zipfile.is_zipfile(path):
+        return _ZipSource(path)
+    if tarfile.is_tarfile(path):
+        return _TarSource(path)
+    raise ValueError(f"не директория и не архив tar/zip: {path}")
+
+
+def _source_name(path):
+    """имя vfs по умолчанию: имя директории или архива без расширений"""
+    name = os.path.basename(os.path.normpath(path))
+    for suffix in ('.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.tar', '.zip'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def _iter_file_jobs(source, pool, keep_modes, on_file):
+    """события обхода, где обработка файлов on_file(имя, права, данные) отправлена в пул;
+    права None - по умолчанию: ('dir', имя, права), ('end',), ('file', имя, права, future)"""
+    for event in source.walk():
+        if event[0] == 'end':
+            yield event
+            continue
+        mode = event[2] if keep_modes else None  #права источника или по умолчанию
+        if event[0] == 'dir':
+            yield 'dir', event[1], mode
+            continue
+        name, key = event[1], event[3]
+        if source.thread_safe:  #поток и читает, и кодирует
+            future = pool.submit(lambda name=name, mode=mode, key=key: on_file(name, mode, source.read(key)))
+        else:  #чтение по порядку в главном потоке
+            future = pool.submit(on_file, name, mode, source.read(key))
+        yield 'file', name, mode, future
+
+
+def _ordered(events, limit):
+    """события в исходном порядке, пока вперед обрабатывается не больше limit файлов"""
+    window = deque()
+    files = 0  #файлов в окне
+    for event in events:
+        window.append(event)
+        files += event[0] == 'file'
+        while files > limit:  #ждем самый старый файл
+            event = window.popleft()
+            files -= event[0] == 'file'
+            yield event
+    yield from window
+
+
+def write_xml(source, xml_path, name, jobs=None, keep_modes=True):
+    """потоковая запись xml образа из источника; (файлов, директорий, байт содержимого, sha-256 xml)"""
+    jobs = jobs or min(32, (os.cpu_count() or 1) + 4)  #чтение в основном ждет диск
+    stats = [0, 0, 0]  #файлов, директорий, байт
+    temp_path = xml_path + '.tmp'  #запись во временный файл и атомарная замена
+
+    def encode(file_name, mode, data):  #рабочий поток: готовые части элемента <file>
+        return len(data), file_xml(file_name, data, mode)
+
+    try:
+        with open(temp_path, 'wb') as f, ThreadPoolExecutor(jobs) as pool:
+            writer = XmlImageWriter(f, name, source.root_mode() if keep_modes else None)  #тот же формат, что у save
+            for event in _ordered(_iter_file_jobs(source, pool, keep_modes, encode), jobs * IMPORT_WINDOW):
+                if event[0] == 'dir':
+                    writer.open_directory(event[1], event[2])
+                    stats[1] += 1
+                elif event[0] == 'end':
+                    writer.close_directory()
+                else:
+                    size, parts = event[3].result()  #ошибка чтения прерывает импорт
+                    writer.write_file_parts(parts)
+                    stats[0] += 1
+                    stats[2] += size
+            digest = writer.close()
+        os.replace(temp_path, xml_path)
+    except BaseException:  #недописанный файл не остается
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return stats[0], stats[1], stats[2], digest
+
+
+def load_vfs(path, name=None, jobs=None, keep_modes=True):
+    """импорт директории или архива сразу в vfs без промежуточного xml"""
+    source = open_source(path)
+    vfs = VFS()
+    vfs.name = name or _source_name(path)
+    vfs.add_directory(vfs.root, source.root_mode() if keep_modes else None)
+    jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+    try:
+        with ThreadPoolExecutor(jobs) as pool:
+            parents = [vfs.root]  #стек путей директорий
+            events = _iter_file_jobs(source, pool, keep_modes, lambda file_name, mode, data: data)
+            for event in _ordered(events, jobs * IMPORT_WINDOW):
+                if event[0] == 'end':
+                    parents.pop()
+                    continue
+                path = vfs.resolve_path(event[1], parents[-1])
+                if event[0] == 'dir':
+                    vfs.add_directory(path, event[2])
+                    parents.append(path)
+                else:
+                    vfs.add_file(path, event[3].result(), event[2])
+    finally:
+        source.close()
+    vfs.backend = "импорт"  #образа на диске нет: save требует путь
+    vfs.loaded = True
+    return vfs
+
+
+def main():
+    if len(sys.argv) < 3:  #источник и образ обязательны
+        print(__doc__)
+        sys.exit(1)
+    source_path, xml_path = sys.argv[1], sys.argv[2]
+    name, jobs, keep_modes = None, None, True
+
+    i = 3  #начальный индекс параметров
+    while i < len(sys.argv):  #обработка аргументов командной строки
+        if sys.argv[i] == "--name" and i + 1 < len(sys.argv):  #имя vfs
+            name = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == "--jobs" and i + 1 < len(sys.argv):  #число потоков
+            jobs = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == "--no_modes":  #права по умолчанию (образ не зависит от umask)
+            keep_modes = False
+            i += 1
+        else:  #неизвестный аргумент
+            i += 1
+
+    start = time.perf_counter()
+    try:
+        source = open_source(source_path)
+        try:
+            files, dirs, size, digest = write_xml(source, xml_path, name or _source_name(source_path), jobs, keep_modes)
+        finally:
+            source.close()
+    except (OSError, ValueError, tarfile.TarError, zipfile.BadZipFile) as e:
+        print(f"ошибка импорта: {e}")
+        sys.exit(1)
+    print(f"образ сохранен в {xml_path}: файлов {files}, директорий {dirs}, {size} байт содержимого, "
+          f"{time.perf_counter() - start:.2f} с")
+    print(f"хэш sha-256: {digest}")
+    if source.skipped:
+        print(f"пропущено элементов (ссылки, спецфайлы, недоступные директории): {source.skipped}")
+
+
+if __name__ == "__main__":
+    main()